@@ -0,0 +1,255 @@
+"""
+CRM Analytics
+Pre-aggregated sales summaries behind the ``salesSummary``, ``topProducts``
+and ``customerLifetimeValue`` queries.
+
+``DailySales``, ``ProductSales`` and ``CustomerSales`` are kept up to date
+as orders are created: ``record_orders`` adds orders to the daily and
+per-customer rows and ``record_lines`` adds order lines to the
+per-product rows, in the transaction that creates them. Where the
+backend supports it each table is updated with one
+``INSERT ... ON CONFLICT DO UPDATE`` adding the deltas to the stored
+values, so a bulk insert of thousands of orders costs a few statements.
+``rebuild`` recomputes every row from the order history.
+
+Only order creation is tracked; run ``manage.py rebuild_sales_summaries``
+after deleting or editing orders.
+"""
+
+from decimal import Decimal
+
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import Count, F, Min, Max, Sum
+from django.db.models.functions import Greatest, Least, TruncDate
+from django.utils import timezone
+
+from crm.models import CustomerSales, DailySales, Order, OrderLine, ProductSales
+
+# How each summary column combines with a delta.
+ADD, MIN, MAX = "add", "min", "max"
+
+COMBINE_SQL = {
+    "postgresql": {
+        ADD: "{table}.{col} + EXCLUDED.{col}",
+        MIN: "LEAST({table}.{col}, EXCLUDED.{col})",
+        MAX: "GREATEST({table}.{col}, EXCLUDED.{col})",
+    },
+    "sqlite": {
+        ADD: "{table}.{col} + excluded.{col}",
+        MIN: "MIN({table}.{col}, excluded.{col})",
+        MAX: "MAX({table}.{col}, excluded.{col})",
+    },
+}
+COMBINE_EXPRESSION = {
+    ADD: lambda name, value: F(name) + value,
+    MIN: lambda name, value: Least(F(name), value),
+    MAX: lambda name, value: Greatest(F(name), value),
+}
+
+
+def merge(model, rows, combine):
+    """Collapse ``(pk, {column: delta})`` rows with the same key."""
+    to_python = model._meta.pk.to_python
+    merged = {}
+    for pk, values in rows:
+        pk = to_python(pk)
+        if pk not in merged:
+            merged[pk] = dict(values)
+            continue
+        current = merged[pk]
+        for name, how in combine.items():
+            if how == ADD:
+                current[name] += values[name]
+            elif how == MIN:
+                current[name] = min(current[name], values[name])
+            else:
+                current[name] = max(current[name], values[name])
+    return merged
+
+
+def increment(model, rows, combine):
+    """
+    Add ``rows`` (``(pk, {column: delta})`` pairs) to ``model``'s summary
+    rows, creating missing ones. ``combine`` maps each column to
+    ``ADD``, ``MIN`` or ``MAX``.
+    """
+    merged = merge(model, rows, combine)
+    if not merged:
+        return
+    connection = connections[router.db_for_write(model)]
+    if connection.vendor in COMBINE_SQL:
+        upsert(model, connection, merged, combine)
+        return
+    # Portable fallback: one UPDATE per key, INSERT when the row is missing.
+    for pk, values in merged.items():
+        updates = {n: COMBINE_EXPRESSION[combine[n]](n, v) for n, v in values.items()}
+        if model.objects.filter(pk=pk).update(**updates):
+            continue
+        try:
+            with transaction.atomic():
+                model.objects.create(pk=pk, **values)
+        except IntegrityError:
+            model.objects.filter(pk=pk).update(**updates)
+
+
+def upsert(model, connection, merged, combine):
+    qn = connection.ops.quote_name
+    opts = model._meta
+    table = qn(opts.db_table)
+    fields = [opts.pk, *(opts.get_field(name) for name in combine)]
+    columns = ", ".join(qn(f.column) for f in fields)
+    templates = COMBINE_SQL[connection.vendor]
+    assignments = ", ".join(
+        f"{qn(f.column)} = "
+        + templates[combine[f.name]].format(table=table, col=qn(f.column))
+        for f in fields[1:]
+    )
+    max_params = connection.features.max_query_params or 100000
+    items = list(merged.items())
+    batch_size = max(1, max_params // len(fields))
+    with connection.cursor() as cursor:
+        for start in range(0, len(items), batch_size):
+            batch = items[start : start + batch_size]
+            params = []
+            for pk, values in batch:
+                params.append(fields[0].get_db_prep_save(pk, connection))
+                params.extend(
+                    f.get_db_prep_save(values[f.name], connection) for f in fields[1:]
+                )
+            row = f"({', '.join(['%s'] * len(fields))})"
+            cursor.execute(
+                f"INSERT INTO {table} ({columns}) VALUES "
+                f"{', '.join([row] * len(batch))} "
+                f"ON CONFLICT ({qn(opts.pk.column)}) DO UPDATE SET {assignments}",
+                params,
+            )
+
+
+# ==========================
+# Incremental maintenance
+# ==========================
+def record_orders(orders):
+    """Add newly created ``orders`` to the daily and per-customer summaries."""
+    orders = list(orders)
+    increment(
+        DailySales,
+        [
+            (
+                timezone.localdate(o.order_date),
+                {"order_count": 1, "revenue": o.total_amount},
+            )
+            for o in orders
+        ],
+        {"order_count": ADD, "revenue": ADD},
+    )
+    increment(
+        CustomerSales,
+        [
+            (
+                o.customer_id,
+                {
+                    "order_count": 1,
+                    "total_spent": o.total_amount,
+                    "first_order_at": o.order_date,
+                    "last_order_at": o.order_date,
+                },
+            )
+            for o in orders
+        ],
+        {
+            "order_count": ADD,
+            "total_spent": ADD,
+            "first_order_at": MIN,
+            "last_order_at": MAX,
+        },
+    )
+
+
+def record_lines(lines):
+    """Add newly created ``OrderLine`` rows to the per-product summaries."""
+    increment(
+        ProductSales,
+        [
+            (
+                line.product_id,
+                {
+                    "order_count": 1,
+                    "units_sold": line.quantity,
+                    "revenue": line.amount,
+                },
+            )
+            for line in lines
+        ],
+        {"order_count": ADD, "units_sold": ADD, "revenue": ADD},
+    )
+
+
+# ==========================
+# Rebuild
+# ==========================
+@transaction.atomic
+def rebuild():
+    """Recompute every summary row from the order history."""
+    DailySales.objects.all().delete()
+    ProductSales.objects.all().delete()
+    CustomerSales.objects.all().delete()
+
+    DailySales.objects.bulk_create(
+        DailySales(date=row["day"], order_count=row["n"], revenue=row["revenue"])
+        for row in Order.objects.annotate(day=TruncDate("order_date"))
+        .values("day")
+        .annotate(n=Count("pk"), revenue=Sum("total_amount"))
+        .order_by()
+    )
+    CustomerSales.objects.bulk_create(
+        CustomerSales(
+            customer_id=row["customer"],
+            order_count=row["n"],
+            total_spent=row["spent"],
+            first_order_at=row["first"],
+            last_order_at=row["last"],
+        )
+        for row in Order.objects.values("customer")
+        .annotate(
+            n=Count("pk"),
+            spent=Sum("total_amount"),
+            first=Min("order_date"),
+            last=Max("order_date"),
+        )
+        .order_by()
+    )
+    ProductSales.objects.bulk_create(
+        ProductSales(
+            product_id=row["product"],
+            order_count=row["n"],
+            units_sold=row["units"],
+            revenue=row["revenue"],
+        )
+        for row in OrderLine.objects.values("product")
+        .annotate(
+            n=Count("pk"),
+            units=Sum("quantity"),
+            revenue=Sum(F("quantity") * F("unit_price")),
+        )
+        .order_by()
+    )
+    return {
+        "days": DailySales.objects.count(),
+        "customers": CustomerSales.objects.count(),
+        "products": ProductSales.objects.count(),
+    }
+
+
+def summarize(date_from=None, date_to=None):
+    """Return ``(order_count, revenue, days)`` for the inclusive date range."""
+    days = DailySales.objects.order_by("date")
+    if date_from:
+        days = days.filter(date__gte=date_from)
+    if date_to:
+        days = days.filter(date__lte=date_to)
+    days = list(days)
+    return (
+        sum(d.order_count for d in days),
+        sum((d.revenue for d in days), Decimal("0")),
+        days,
+    )
@@ -4,3 +4,19 @@ from django.apps import AppConfig
 class CrmConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "crm"
+
+    def ready(self):
+        from django.db import connections
+        from django.db.backends.signals import connection_created
+
+        from crm import signals  # noqa: F401
+        from crm.documents import load_persisted_queries
+        from crm.routing import install_replica_wrapper
+        from crm.tracing import install_sql_wrapper
+
+        connection_created.connect(install_sql_wrapper)
+        connection_created.connect(install_replica_wrapper)
+        for connection in connections.all(initialized_only=True):
+            install_sql_wrapper(connection)
+            install_replica_wrapper(connection)
+        load_persisted_queries()
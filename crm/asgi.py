@@ -2,6 +2,8 @@
 ASGI config for alx_backend_graphql_crm project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP goes to Django; WebSocket connections to ``/graphql/`` serve GraphQL
+subscriptions (``crm.websocket``).
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -12,5 +14,31 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "crm.settings")
+os.environ.setdefault("CRM_ASYNC_GRAPHQL", "1")
+# Connections opened by async views are not reused across requests.
+os.environ.setdefault("CRM_CONN_MAX_AGE", "0")
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported once Django is set up, since it loads the schema and models.
+from crm.websocket import GraphQLWebSocketApp  # noqa: E402
+
+WEBSOCKET_PATHS = {"/graphql/", "/graphql"}
+
+
+class ProtocolRouter:
+    def __init__(self, http, websocket):
+        self.http = http
+        self.websocket = websocket
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "websocket":
+            return await self.http(scope, receive, send)
+        if scope["path"] in WEBSOCKET_PATHS:
+            return await self.websocket(scope, receive, send)
+        # Reject the handshake of any other WebSocket path.
+        await receive()
+        await send({"type": "websocket.close", "code": 4404})
+
+
+application = ProtocolRouter(django_application, GraphQLWebSocketApp())
@@ -0,0 +1,224 @@
+"""
+CRM Async Schema
+The schema served by ``AsyncCRMGraphQLView`` and ``crm.websocket`` on the
+ASGI stack, with the subscriptions of ``crm.subscriptions``.
+
+Types are shared with ``crm.schema``; only the root fields differ. Root
+query fields are coroutines, so graphql-core resolves independent fields of
+one operation concurrently. Django runs every async ORM call on the
+request's single sync thread, which would queue those fields behind each
+other again; with ``CRM_ASYNC_PARALLEL_FIELDS`` each root query field
+therefore runs its queries in a worker thread with its own connection.
+Nested resolvers that may touch the database are moved off the event loop
+by ``ORMThreadMiddleware``.
+"""
+
+from functools import partial
+from inspect import iscoroutinefunction
+
+import graphene
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from graphene.relay.node import NodeField
+from graphene.types.resolver import attr_resolver, dict_or_attr_resolver
+from graphene.types.utils import get_type
+from graphene.utils.get_unbound_function import get_unbound_function
+
+from crm import schema as sync_schema
+from crm.fields import KeysetConnectionField
+from crm.graphql_crm.schema import Mutation, Query
+from crm.loaders import get_loaders
+from crm.models import Customer, Product
+from crm.schema import CustomerType, OrderType, ProductType
+from crm.subscriptions import Subscription
+
+
+def parallel_fields_enabled():
+    return getattr(settings, "CRM_ASYNC_PARALLEL_FIELDS", True)
+
+
+def _in_worker(fn, *args):
+    try:
+        return fn(*args)
+    finally:
+        close_old_connections()
+
+
+async def run_orm(fn, *args):
+    """Run ``fn(*args)``, which may query the database, off the event loop."""
+    if parallel_fields_enabled():
+        return await sync_to_async(_in_worker, thread_sensitive=False)(fn, *args)
+    return await sync_to_async(fn)(*args)
+
+
+# ==========================
+# Middleware
+# ==========================
+def is_plain_resolver(resolve):
+    """True for resolvers that only read attributes of an already-loaded object."""
+    if not isinstance(resolve, partial):
+        return False
+    if resolve.func in (dict_or_attr_resolver, attr_resolver):
+        return True
+    # GlobalID.id_resolver around DjangoObjectType.resolve_id (returns pk).
+    return resolve.func is graphene.GlobalID.id_resolver
+
+
+class ORMThreadMiddleware:
+    """
+    Run synchronous resolvers in the request's ORM thread.
+
+    Attribute resolvers are called inline; everything else (relation fields,
+    ``totalCount``, DataLoader-backed resolvers) may query the database and is
+    wrapped with ``sync_to_async``.
+    """
+
+    def resolve(self, next, root, info, **args):
+        resolve = info.parent_type.fields[info.field_name].resolve
+        if (
+            resolve is None
+            or is_plain_resolver(resolve)
+            or iscoroutinefunction(resolve)
+        ):
+            return next(root, info, **args)
+        return sync_to_async(next)(root, info, **args)
+
+
+# ==========================
+# Root Query Fields
+# ==========================
+class AsyncKeysetConnectionField(KeysetConnectionField):
+    """KeysetConnectionField whose page is fetched off the event loop."""
+
+    def wrap_resolve(self, parent_resolver):
+        return partial(self.async_keyset_resolver, self.resolver or parent_resolver)
+
+    async def async_keyset_resolver(self, resolver, root, info, **args):
+        self.check_limits(info, args)
+        return await run_orm(self.fetch_page, resolver, root, info, args)
+
+    def fetch_page(self, resolver, root, info, args):
+        # Building the queryset can query too (filter backends introspect
+        # the database), so it runs in the same thread as the page itself.
+        queryset = self.resolve_queryset_for(resolver, root, info, args)
+        page, window = self.page_queryset(queryset, args)
+        connection = self.make_connection(queryset, list(page), window)
+
+        loaders = get_loaders(info)
+        if loaders is not None:
+            loaders.prime_page([edge.node for edge in connection.edges])
+        return connection
+
+
+class AsyncNodeField(NodeField):
+    def wrap_resolve(self, parent_resolver):
+        return partial(self.resolve_node, get_type(self.field_type))
+
+    async def resolve_node(self, only_type, root, info, id):
+        return await run_orm(
+            graphene.relay.Node.get_node_from_global_id, info, id, only_type
+        )
+
+
+class AsyncQuery(Query):
+    customer = AsyncNodeField(graphene.relay.Node, CustomerType)
+    product = AsyncNodeField(graphene.relay.Node, ProductType)
+    order = AsyncNodeField(graphene.relay.Node, OrderType)
+
+    all_customers = AsyncKeysetConnectionField(CustomerType, sort_key="created_at")
+    all_products = AsyncKeysetConnectionField(ProductType, sort_key="id")
+    all_orders = AsyncKeysetConnectionField(OrderType, sort_key="order_date")
+
+    class Meta:
+        name = "Query"
+
+
+# ==========================
+# Mutations
+# ==========================
+async def run_idempotent(mutation, root, info, **kwargs):
+    """
+    Run the sync ``mutate`` of ``mutation`` in the ORM thread: storing the
+    idempotency key with the writes needs ``transaction.atomic``.
+    """
+    mutate = sync_to_async(get_unbound_function(mutation.mutate))
+    return await mutate(root, info, **kwargs)
+
+
+class CreateCustomer(sync_schema.CreateCustomer):
+    async def mutate(self, info, name, email, phone=None, idempotency_key=None):
+        if idempotency_key is not None:
+            return await run_idempotent(
+                sync_schema.CreateCustomer,
+                self,
+                info,
+                name=name,
+                email=email,
+                phone=phone,
+                idempotency_key=idempotency_key,
+            )
+        if await Customer.objects.filter(email=email).aexists():
+            raise Exception("Email already exists")
+
+        if phone and not sync_schema.services.PHONE_RE.match(phone):
+            raise Exception("Invalid phone format. Use +1234567890 or 123-456-7890")
+
+        customer = await Customer.objects.acreate(name=name, email=email, phone=phone)
+        return CreateCustomer(
+            customer=customer, message="Customer created successfully!"
+        )
+
+
+class CreateProduct(sync_schema.CreateProduct):
+    async def mutate(self, info, name, price, stock, idempotency_key=None):
+        if idempotency_key is not None:
+            return await run_idempotent(
+                sync_schema.CreateProduct,
+                self,
+                info,
+                name=name,
+                price=price,
+                stock=stock,
+                idempotency_key=idempotency_key,
+            )
+        if price <= 0:
+            raise Exception("Price must be positive")
+        if stock < 0:
+            raise Exception("Stock cannot be negative")
+
+        product = await Product.objects.acreate(name=name, price=price, stock=stock)
+        return CreateProduct(product=product)
+
+
+def in_orm_thread(mutation):
+    """
+    Async twin of a mutation that needs ``transaction.atomic``, which the
+    async ORM does not support: the sync ``mutate`` runs in the ORM thread.
+    """
+    mutate = sync_to_async(get_unbound_function(mutation.mutate))
+
+    async def async_mutate(root, info, **kwargs):
+        return await mutate(root, info, **kwargs)
+
+    return type(mutation.__name__, (mutation,), {"mutate": async_mutate})
+
+
+class AsyncMutation(Mutation):
+    create_customer = CreateCustomer.Field()
+    bulk_create_customers = in_orm_thread(sync_schema.BulkCreateCustomers).Field()
+    create_product = CreateProduct.Field()
+    bulk_create_products = in_orm_thread(sync_schema.BulkCreateProducts).Field()
+    create_order = in_orm_thread(sync_schema.CreateOrder).Field()
+    bulk_create_orders = in_orm_thread(sync_schema.BulkCreateOrders).Field()
+    update_low_stock_products = in_orm_thread(
+        sync_schema.UpdateLowStockProducts
+    ).Field()
+
+    class Meta:
+        name = "Mutation"
+
+
+schema = graphene.Schema(
+    query=AsyncQuery, mutation=AsyncMutation, subscription=Subscription
+)
@@ -0,0 +1,149 @@
+"""
+CRM GraphQL Client
+A shared client for running GraphQL operations from cron jobs and scripts.
+
+The default ``inprocess`` transport executes operations directly against
+``crm.graphql_crm.schema.schema``, reusing parsed and validated documents
+from ``crm.documents``; there is no HTTP hop and no schema introspection.
+The ``http`` transport posts to a running server over a kept-alive
+connection per thread, for jobs that must go through the deployed
+endpoint.
+
+Configured by ``CRM_GRAPHQL_CLIENT``:
+
+- ``TRANSPORT``: ``"inprocess"`` or ``"http"``
+- ``URL``: endpoint used by the ``http`` transport
+- ``TIMEOUT``: socket timeout in seconds for the ``http`` transport
+"""
+
+import http.client
+import json
+import threading
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.http import HttpRequest
+from graphene_django.settings import graphene_settings
+from graphql import ExecutionResult, execute
+
+from crm.documents import document_cache
+
+DEFAULTS = {
+    "TRANSPORT": "inprocess",
+    "URL": "http://localhost:8000/graphql/",
+    "TIMEOUT": 30,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, "CRM_GRAPHQL_CLIENT", {})}
+
+
+class GraphQLClientError(Exception):
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__("; ".join(str(e.get("message", e)) for e in errors))
+
+
+class InProcessTransport:
+    def __init__(self, schema=None):
+        self.schema = schema
+
+    def get_schema(self):
+        if self.schema is None:
+            self.schema = graphene_settings.SCHEMA
+        return self.schema.graphql_schema
+
+    def execute(self, query, variables=None, operation_name=None):
+        schema = self.get_schema()
+        document, errors = document_cache.get_document(schema, query)
+        if errors:
+            result = ExecutionResult(errors=errors)
+        else:
+            # A bare request gives resolvers somewhere to keep per-request
+            # state such as the DataLoaders.
+            result = execute(
+                schema,
+                document,
+                context_value=HttpRequest(),
+                variable_values=variables,
+                operation_name=operation_name,
+            )
+        return result.formatted
+
+
+class HTTPTransport:
+    """POSTs operations over one persistent connection per thread."""
+
+    def __init__(self, url, timeout=30):
+        parts = urlsplit(url)
+        self.connection_class = (
+            http.client.HTTPSConnection
+            if parts.scheme == "https"
+            else http.client.HTTPConnection
+        )
+        self.netloc = parts.netloc
+        self.path = parts.path or "/"
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def get_connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self.connection_class(self.netloc, timeout=self.timeout)
+            self._local.connection = connection
+        return connection
+
+    def close(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def execute(self, query, variables=None, operation_name=None):
+        body = json.dumps(
+            {"query": query, "variables": variables, "operationName": operation_name}
+        )
+        headers = {"Content-Type": "application/json", "Accept": "application/json"}
+        # A kept-alive connection may have been closed by the server since
+        # the last run; retry once on a fresh one.
+        for attempt in range(2):
+            connection = self.get_connection()
+            try:
+                connection.request("POST", self.path, body, headers)
+                response = connection.getresponse()
+                payload = response.read()
+                break
+            except (http.client.HTTPException, ConnectionError):
+                self.close()
+                if attempt:
+                    raise
+        return json.loads(payload)
+
+
+class GraphQLClient:
+    def __init__(self, transport):
+        self.transport = transport
+
+    def execute(self, query, variables=None, operation_name=None):
+        """Return the operation's ``data``, raising ``GraphQLClientError`` on errors."""
+        result = self.transport.execute(query, variables, operation_name)
+        if result.get("errors"):
+            raise GraphQLClientError(result["errors"])
+        return result["data"]
+
+
+_client = None
+
+
+def get_client():
+    """Return the process-wide client for ``CRM_GRAPHQL_CLIENT``."""
+    global _client
+    if _client is None:
+        config = get_config()
+        if config["TRANSPORT"] == "http":
+            transport = HTTPTransport(config["URL"], timeout=config["TIMEOUT"])
+        else:
+            transport = InProcessTransport()
+        _client = GraphQLClient(transport)
+    return _client
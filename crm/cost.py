@@ -0,0 +1,221 @@
+"""
+CRM Query Cost
+Static cost and depth analysis of GraphQL operations, used to reject
+expensive queries before they execute.
+
+A connection costs ``limit * (1 + cost of its node selection)``, where
+``limit`` is the ``first``/``last`` argument or the connection's max limit
+when neither is given; any other object field costs ``1 + cost of its
+selection``, and scalars are free. Depth counts nested object fields, with
+the relay ``edges``/``node`` wrappers and introspection fields ignored.
+
+Configured by ``CRM_QUERY_COST``:
+
+- ``ENABLED``: analyze and enforce budgets in the GraphQL views
+- ``MAX_COST`` / ``MAX_DEPTH``: limits for clients without their own budget
+- ``CLIENT_HEADER``: request header identifying the client
+- ``BUDGETS``: ``{"<client>": max cost}`` overriding ``MAX_COST``
+"""
+
+from dataclasses import dataclass
+
+from django.conf import settings
+from graphene_django.settings import graphene_settings
+from graphql import (
+    GraphQLError,
+    GraphQLObjectType,
+    IntValueNode,
+    VariableNode,
+    get_named_type,
+    get_operation_ast,
+)
+from graphql.language import (
+    FieldNode,
+    FragmentDefinitionNode,
+    FragmentSpreadNode,
+    InlineFragmentNode,
+)
+from graphql.validation import ASTValidationRule
+
+DEFAULTS = {
+    "ENABLED": True,
+    "MAX_COST": 50_000,
+    "MAX_DEPTH": 6,
+    "CLIENT_HEADER": "X-Client-Id",
+    "BUDGETS": {},
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, "CRM_QUERY_COST", {})}
+
+
+def is_connection(graphql_type):
+    return isinstance(graphql_type, GraphQLObjectType) and {
+        "edges",
+        "pageInfo",
+    } <= set(graphql_type.fields)
+
+
+def is_edge(graphql_type):
+    return isinstance(graphql_type, GraphQLObjectType) and {"node", "cursor"} <= set(
+        graphql_type.fields
+    )
+
+
+@dataclass
+class QueryCost:
+    cost: int = 0
+    depth: int = 0
+
+    def errors(self, max_cost, max_depth):
+        errors = []
+        if max_depth is not None and self.depth > max_depth:
+            errors.append(
+                GraphQLError(
+                    f"Query depth {self.depth} exceeds the maximum depth of "
+                    f"{max_depth}.",
+                    extensions={"code": "QUERY_TOO_DEEP"},
+                )
+            )
+        if max_cost is not None and self.cost > max_cost:
+            errors.append(
+                GraphQLError(
+                    f"Query cost {self.cost} exceeds the budget of {max_cost}.",
+                    extensions={"code": "QUERY_TOO_COMPLEX"},
+                )
+            )
+        return errors
+
+
+class CostAnalyzer:
+    def __init__(self, schema, document, variables=None, default_limit=None):
+        self.schema = schema
+        self.variables = variables or {}
+        self.default_limit = (
+            default_limit or graphene_settings.RELAY_CONNECTION_MAX_LIMIT
+        )
+        self.fragments = {
+            d.name.value: d
+            for d in document.definitions
+            if isinstance(d, FragmentDefinitionNode)
+        }
+        self.variable_defaults = {}
+        # Fragments being expanded; cycles are reported by NoFragmentCyclesRule.
+        self.expanding = set()
+
+    def analyze(self, operation):
+        self.variable_defaults = {
+            d.variable.name.value: d.default_value
+            for d in operation.variable_definitions or ()
+        }
+        root = self.schema.get_root_type(operation.operation)
+        cost, depth = self.selection_cost(root, operation.selection_set, 0)
+        return QueryCost(cost=cost, depth=depth)
+
+    def selection_cost(self, parent_type, selection_set, depth):
+        cost, deepest = 0, depth
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                c, d = self.field_cost(parent_type, selection, depth)
+            elif isinstance(selection, InlineFragmentNode):
+                condition = selection.type_condition
+                graphql_type = (
+                    self.schema.get_type(condition.name.value)
+                    if condition
+                    else parent_type
+                )
+                c, d = self.selection_cost(graphql_type, selection.selection_set, depth)
+            elif isinstance(selection, FragmentSpreadNode):
+                name = selection.name.value
+                fragment = self.fragments.get(name)
+                if fragment is None or name in self.expanding:
+                    continue
+                graphql_type = self.schema.get_type(fragment.type_condition.name.value)
+                self.expanding.add(name)
+                try:
+                    c, d = self.selection_cost(
+                        graphql_type, fragment.selection_set, depth
+                    )
+                finally:
+                    self.expanding.discard(name)
+            else:
+                continue
+            cost += c
+            deepest = max(deepest, d)
+        return cost, deepest
+
+    def field_cost(self, parent_type, node, depth):
+        name = node.name.value
+        fields = getattr(parent_type, "fields", {})
+        if name.startswith("__") or name not in fields or node.selection_set is None:
+            return 0, depth
+
+        field_type = get_named_type(fields[name].type)
+        if (name == "edges" and is_connection(parent_type)) or (
+            name == "node" and is_edge(parent_type)
+        ):
+            return self.selection_cost(field_type, node.selection_set, depth)
+        if name == "pageInfo" and is_connection(parent_type):
+            return 0, depth
+
+        cost, deepest = self.selection_cost(field_type, node.selection_set, depth + 1)
+        if is_connection(field_type):
+            return self.limit(node) * (1 + cost), deepest
+        return 1 + cost, deepest
+
+    def argument_value(self, value_node):
+        if isinstance(value_node, IntValueNode):
+            return int(value_node.value)
+        if isinstance(value_node, VariableNode):
+            name = value_node.name.value
+            value = self.variables.get(name)
+            if value is None and isinstance(
+                self.variable_defaults.get(name), IntValueNode
+            ):
+                value = int(self.variable_defaults[name].value)
+            return value if isinstance(value, int) else None
+        return None
+
+    def limit(self, node):
+        limits = [
+            self.argument_value(argument.value)
+            for argument in node.arguments
+            if argument.name.value in ("first", "last")
+        ]
+        limits = [limit for limit in limits if limit is not None]
+        # Negative page sizes would offset the cost of sibling fields.
+        return max(min(limits), 0) if limits else self.default_limit
+
+
+def analyze(schema, document, operation_name=None, variables=None):
+    """Return the ``QueryCost`` of the operation that would be executed."""
+    operation = get_operation_ast(document, operation_name)
+    if operation is None:
+        return QueryCost()
+    return CostAnalyzer(schema, document, variables).analyze(operation)
+
+
+def client_budget(request):
+    """Return ``(client, max_cost, max_depth)`` for a request."""
+    config = get_config()
+    client = request.headers.get(config["CLIENT_HEADER"]) if request else None
+    max_cost = config["BUDGETS"].get(client, config["MAX_COST"])
+    return client, max_cost, config["MAX_DEPTH"]
+
+
+class QueryCostRule(ASTValidationRule):
+    """
+    Validation rule rejecting operations over ``MAX_COST`` or ``MAX_DEPTH``.
+
+    Variables are unknown during validation, so ``first: $n`` is costed
+    with the variable's default or the connection's max limit. The views
+    check the per-client budget with the request's variables instead.
+    """
+
+    def enter_operation_definition(self, node, *args):
+        config = get_config()
+        context = self.context
+        cost = CostAnalyzer(context.schema, context.document).analyze(node)
+        for error in cost.errors(config["MAX_COST"], config["MAX_DEPTH"]):
+            self.report_error(error)
@@ -5,8 +5,8 @@ Contains cron job functions for CRM system monitoring and maintenance.
 """
 
 import datetime
-from gql import gql, Client
-from gql.transport.requests import RequestsHTTPTransport
+
+from crm.client import GraphQLClientError, get_client
 
 
 def log_crm_heartbeat():
@@ -23,20 +23,8 @@ def log_crm_heartbeat():
 
     # Test GraphQL endpoint responsiveness
     try:
-        # Set up GraphQL client
-        transport = RequestsHTTPTransport(url="http://localhost:8000/graphql")
-        client = Client(transport=transport, fetch_schema_from_transport=True)
-
-        # Query hello field to test endpoint
-        query = gql(
-            """
-            query {
-                hello
-            }
-        """
-        )
-
-        result = client.execute(query)
+        # Query hello field through the shared in-process client
+        result = get_client().execute("{ hello }")
         hello_response = result.get("hello", "No response")
 
         # Append GraphQL status to message
@@ -66,29 +54,19 @@ def update_low_stock():
     timestamp = datetime.datetime.now().strftime("%d/%m/%Y-%H:%M:%S")
 
     try:
-        # Set up GraphQL client
-        transport = RequestsHTTPTransport(url="http://localhost:8000/graphql")
-        client = Client(transport=transport, fetch_schema_from_transport=True)
-
-        # Define mutation to update low stock products
-        mutation = gql(
-            """
+        # Run the mutation through the shared in-process client
+        result = get_client().execute("""
         mutation {
             updateLowStockProducts {
-                updatedProducts {
+                products {
                     name
                     stock
                 }
             }
         }
-        """
-        )
-
-        # Execute mutation
-        result = client.execute(mutation)
-        updated_products = result.get("updateLowStockProducts", {}).get(
-            "updatedProducts", []
-        )
+        """)
+        payload = result.get("updateLowStockProducts") or {}
+        updated_products = payload.get("products") or []
 
         # Write results to log
         with open("/tmp/low_stock_updates_log.txt", "a") as log_file:
@@ -100,6 +78,13 @@ def update_low_stock():
             else:
                 log_file.write(f"{timestamp} - No products updated\n")
 
+    except GraphQLClientError as e:
+        # The client raises the errors of the response instead of returning them
+        with open("/tmp/low_stock_updates_log.txt", "a") as log_file:
+            for error in e.errors:
+                message = error.get("message", error)
+                log_file.write(f"{timestamp} - GraphQL Error: {message}\n")
+
     except Exception as e:
         # Log any errors to the same file
         with open("/tmp/low_stock_updates_log.txt", "a") as log_file:
@@ -107,5 +92,12 @@ def update_low_stock():
 
 
 if __name__ == "__main__":
+    import os
+
+    import django
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "crm.settings")
+    django.setup()
+
     log_crm_heartbeat()
     update_low_stock()
@@ -1,72 +1,163 @@
 #!/usr/bin/env python3
 """
 Send Order Reminders Script
-Uses GraphQL to query for pending orders from the last 7 days and logs reminders.
+Streams orders from the last 7 days out of the CRM schema (in-process, via
+crm.client) and logs a reminder for each one.
+
+Orders are paged with allOrders cursors and written in buffered batches.
+After every batch the cursor of the last written order is saved as a
+checkpoint, so the next run starts right after it: each order is logged
+once, memory stays bounded by one page plus one batch, and an interrupted
+run resumes from its last completed batch.
 """
 
+import argparse
 import datetime
+import json
+import os
 import sys
-from gql import gql, Client
-from gql.transport.requests import RequestsHTTPTransport
 
+LOG_PATH = "/tmp/order_reminders_log.txt"
+CHECKPOINT_PATH = "/tmp/order_reminders_checkpoint.json"
+PAGE_SIZE = 100
+BATCH_SIZE = 1000
+
+PENDING_ORDERS_QUERY = """
+    query GetPendingOrders($dateFilter: Date!, $after: String, $first: Int!) {
+        allOrders(orderDateGte: $dateFilter, first: $first, after: $after) {
+            edges {
+                cursor
+                node {
+                    id
+                    orderDate
+                    customer {
+                        email
+                    }
+                }
+            }
+            pageInfo {
+                hasNextPage
+                endCursor
+            }
+        }
+    }
+"""
 
-def get_pending_orders():
+
+def iter_pending_orders(after=None, page_size=PAGE_SIZE):
     """
-    Query GraphQL endpoint for orders with order_date within the last 7 days
+    Yield orders with order_date within the last 7 days, oldest first,
+    starting after the ``after`` cursor. Each order carries the cursor
+    that resumes right after it.
     """
+    from crm.client import get_client
+
     # Calculate date 7 days ago
     seven_days_ago = datetime.datetime.now() - datetime.timedelta(days=7)
     date_filter = seven_days_ago.strftime("%Y-%m-%d")
 
-    # GraphQL endpoint
-    transport = RequestsHTTPTransport(url="http://localhost:8000/graphql")
-    client = Client(transport=transport, fetch_schema_from_transport=True)
-
-    # GraphQL query for orders within the last 7 days
-    query = gql(
-        """
-        query GetPendingOrders($dateFilter: String!) {
-            orders(where: {order_date: {_gte: $dateFilter}}) {
-                id
-                customer_email
-                order_date
+    client = get_client()
+    variables = {"dateFilter": date_filter, "after": after, "first": page_size}
+    while True:
+        connection = client.execute(PENDING_ORDERS_QUERY, variables)["allOrders"]
+        for edge in connection["edges"]:
+            node = edge["node"]
+            yield {
+                "id": node["id"],
+                "customer_email": node["customer"]["email"],
+                "order_date": node["orderDate"],
+                "cursor": edge["cursor"],
             }
-        }
+        if not connection["pageInfo"]["hasNextPage"]:
+            return
+        variables["after"] = connection["pageInfo"]["endCursor"]
+
+
+def get_pending_orders():
     """
-    )
+    Query the CRM schema for all orders with order_date within the last 7 days
+    """
+    return list(iter_pending_orders())
 
-    # Execute query
-    variables = {"dateFilter": date_filter}
-    result = client.execute(query, variable_values=variables)
 
-    return result.get("orders", [])
+def load_checkpoint(path=CHECKPOINT_PATH):
+    """Return the saved checkpoint, or None before the first run."""
+    try:
+        with open(path) as checkpoint_file:
+            return json.load(checkpoint_file)
+    except FileNotFoundError:
+        return None
+
+
+def save_checkpoint(order, path=CHECKPOINT_PATH):
+    """Record ``order`` as the high-water mark, atomically."""
+    checkpoint = {
+        "cursor": order["cursor"],
+        "order_id": order["id"],
+        "order_date": order["order_date"],
+    }
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file)
+        checkpoint_file.flush()
+        os.fsync(checkpoint_file.fileno())
+    os.replace(tmp_path, path)
+
+
+def format_reminder(order, timestamp):
+    return (
+        f"{timestamp} - Order ID: {order['id']}, Customer: {order['customer_email']}\n"
+    )
 
 
-def log_order_reminder(order_id, customer_email):
+def write_reminders(
+    orders, log_path=LOG_PATH, checkpoint_path=CHECKPOINT_PATH, batch_size=BATCH_SIZE
+):
     """
-    Log order ID and customer email to /tmp/order_reminders_log.txt with timestamp
+    Append a reminder line per order in batches of ``batch_size``, saving
+    the checkpoint once each batch is on disk. Returns the number logged.
     """
     timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    log_entry = f"{timestamp} - Order ID: {order_id}, Customer: {customer_email}\n"
+    written = 0
+    batch = []
+    with open(log_path, "a") as log_file:
 
-    with open("/tmp/order_reminders_log.txt", "a") as log_file:
-        log_file.write(log_entry)
+        def flush():
+            log_file.writelines(format_reminder(order, timestamp) for order in batch)
+            log_file.flush()
+            os.fsync(log_file.fileno())
+            save_checkpoint(batch[-1], checkpoint_path)
+            batch.clear()
 
-
-def send_order_reminders():
+        for order in orders:
+            batch.append(order)
+            written += 1
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+    return written
+
+
+def send_order_reminders(
+    log_path=LOG_PATH,
+    checkpoint_path=CHECKPOINT_PATH,
+    batch_size=BATCH_SIZE,
+    page_size=PAGE_SIZE,
+):
     """
     Main function to process order reminders
     """
     try:
-        # Get pending orders from GraphQL
-        orders = get_pending_orders()
-
-        # Log each order
-        for order in orders:
-            log_order_reminder(order["id"], order["customer_email"])
+        checkpoint = load_checkpoint(checkpoint_path)
+        orders = iter_pending_orders(
+            after=checkpoint and checkpoint["cursor"], page_size=page_size
+        )
+        written = write_reminders(orders, log_path, checkpoint_path, batch_size)
 
         # Print confirmation
-        print("Order reminders processed!")
+        print(f"Order reminders processed! ({written} new)")
+        return written
 
     except Exception as e:
         print(f"Error processing order reminders: {e}")
@@ -74,4 +165,24 @@ def send_order_reminders():
 
 
 if __name__ == "__main__":
-    send_order_reminders()
+    import django
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--log", default=LOG_PATH)
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE)
+    parser.add_argument(
+        "--reset", action="store_true", help="Forget the checkpoint first."
+    )
+    args = parser.parse_args()
+
+    sys.path.insert(
+        0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    )
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "crm.settings")
+    django.setup()
+
+    if args.reset and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+    send_order_reminders(args.log, args.checkpoint, args.batch_size, args.page_size)
@@ -0,0 +1,165 @@
+"""
+CRM GraphQL Documents
+LRU cache of parsed and validated query documents, and the persisted query
+store behind Automatic Persisted Queries (APQ).
+"""
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from graphql import parse, validate
+from graphql.error import GraphQLError
+
+from crm import tracing
+
+DEFAULT_CACHE_SIZE = 1000
+
+
+def query_hash(query):
+    """The sha256 hex digest APQ clients use to identify a query."""
+    return hashlib.sha256(query.encode("utf-8")).hexdigest()
+
+
+class LRUCache:
+    """Thread-safe LRU mapping with hit, miss and eviction counters."""
+
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {
+            "size": len(self._data),
+            "maxSize": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class DocumentCache(LRUCache):
+    """
+    Parsed documents and their validation errors, keyed by query hash and
+    the validation rules and error limit they were validated with.
+    """
+
+    def get_document(self, schema, query, validation_rules=None, max_errors=None):
+        """
+        Return ``(document, errors)`` for ``query`` against ``schema``.
+
+        Syntax errors are returned as ``(None, [error])`` and are not cached.
+        """
+        key = (
+            id(schema),
+            query_hash(query),
+            tuple(validation_rules or ()),
+            max_errors,
+        )
+        try:
+            # One phase for the lookup and, on a miss, the parse.
+            with tracing.phase("parsing"):
+                cached = self.get(key)
+                if cached is None:
+                    document = parse(query)
+        except GraphQLError as e:
+            return None, [e]
+        if cached is not None:
+            with tracing.phase("validation"):
+                return cached
+
+        with tracing.phase("validation"):
+            errors = validate(schema, document, validation_rules, max_errors)
+        self.set(key, (document, errors))
+        return document, errors
+
+
+class PersistedQueryStore:
+    """
+    Queries registered by hash.
+
+    Queries loaded from the manifest are permanent; queries registered at
+    runtime through APQ live in a bounded LRU.
+    """
+
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE):
+        self.manifest = {}
+        self.registered = LRUCache(max_size)
+
+    def get(self, sha256):
+        if sha256 in self.manifest:
+            return self.manifest[sha256]
+        return self.registered.get(sha256)
+
+    def register(self, sha256, query):
+        if query_hash(query) != sha256:
+            raise ValueError("provided sha does not match query")
+        if sha256 not in self.manifest:
+            self.registered.set(sha256, query)
+
+    def load_manifest(self, path):
+        """
+        Load ``{"<sha256>": "<query>"}`` or ``["<query>", ...]`` from ``path``.
+        Returns the number of queries loaded.
+        """
+        with open(path) as manifest_file:
+            entries = json.load(manifest_file)
+        if isinstance(entries, list):
+            entries = {query_hash(query): query for query in entries}
+        for sha256, query in entries.items():
+            if query_hash(query) != sha256:
+                raise ValueError(f"Manifest hash does not match its query: {sha256}")
+            self.manifest[sha256] = query
+        return len(entries)
+
+
+def _cache_size():
+    return getattr(settings, "CRM_GRAPHQL_DOCUMENT_CACHE_SIZE", DEFAULT_CACHE_SIZE)
+
+
+document_cache = DocumentCache(_cache_size())
+persisted_queries = PersistedQueryStore(_cache_size())
+
+
+def load_persisted_queries():
+    """Load ``CRM_PERSISTED_QUERIES_MANIFEST`` into the persisted query store."""
+    path = getattr(settings, "CRM_PERSISTED_QUERIES_MANIFEST", None)
+    if path:
+        persisted_queries.load_manifest(path)
@@ -0,0 +1,192 @@
+"""
+CRM Export
+Streams customers, products and orders (with their line items) as CSV or
+NDJSON, filtered by the same ``crm.filters`` filtersets as the GraphQL
+connections.
+
+Rows are read with ``values_list().iterator(chunk_size=...)`` (a
+server-side cursor where the backend has one) and encoded into buffers of
+about ``BUFFER_SIZE`` characters that are sent as they fill, so memory
+stays flat and the first bytes leave before the query has finished,
+whatever the size of the export. Orders are read joined to their lines,
+one row per line in pk order; CSV repeats the order columns on each line,
+NDJSON nests the lines in one object per order.
+
+Configured by ``CRM_EXPORT``:
+
+- ``CHUNK_SIZE``: rows fetched from the database cursor at a time
+- ``BUFFER_SIZE``: characters encoded before a chunk is sent
+"""
+
+import csv
+import io
+import json
+from itertools import groupby
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from crm.filters import CustomerFilter, OrderFilter, ProductFilter
+from crm.models import Customer, Order, Product
+
+DEFAULTS = {
+    "CHUNK_SIZE": 2000,
+    "BUFFER_SIZE": 64 * 1024,
+}
+
+FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+ORDER_COLUMNS = ["id", "order_date", "customer_id", "customer_email", "total_amount"]
+LINE_COLUMNS = ["product_id", "product_name", "quantity", "unit_price"]
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, "CRM_EXPORT", {})}
+
+
+class Export:
+    """An exportable model: its filterset and ``(column, lookup)`` pairs."""
+
+    def __init__(self, model, filterset_class, columns):
+        self.model = model
+        self.filterset_class = filterset_class
+        self.columns = columns
+
+    @property
+    def header(self):
+        return [column for column, _ in self.columns]
+
+    def filter(self, params, using):
+        """Return the filterset for ``params``; check ``is_valid()`` first."""
+        return self.filterset_class(
+            params, queryset=self.model.objects.using(using).order_by("pk")
+        )
+
+    def rows(self, queryset, chunk_size):
+        lookups = [lookup for _, lookup in self.columns]
+        return queryset.values_list(*lookups).iterator(chunk_size=chunk_size)
+
+    def records(self, queryset, chunk_size):
+        header = self.header
+        for row in self.rows(queryset, chunk_size):
+            yield dict(zip(header, row))
+
+
+class OrderExport(Export):
+    def rows(self, queryset, chunk_size):
+        # LEFT JOIN to the lines: one row per line, orders without lines once.
+        return super().rows(queryset.order_by("pk", "lines__pk"), chunk_size)
+
+    def records(self, queryset, chunk_size):
+        split = len(ORDER_COLUMNS)
+        for _, rows in groupby(self.rows(queryset, chunk_size), key=lambda r: r[0]):
+            rows = list(rows)
+            record = dict(zip(ORDER_COLUMNS, rows[0][:split]))
+            record["lines"] = [
+                dict(zip(LINE_COLUMNS, row[split:]))
+                for row in rows
+                if row[split] is not None
+            ]
+            yield record
+
+
+EXPORTS = {
+    "customers": Export(
+        Customer,
+        CustomerFilter,
+        [(name, name) for name in ("id", "name", "email", "phone", "created_at")],
+    ),
+    "products": Export(
+        Product,
+        ProductFilter,
+        [(name, name) for name in ("id", "name", "price", "stock", "created_at")],
+    ),
+    "orders": OrderExport(
+        Order,
+        OrderFilter,
+        [
+            ("id", "id"),
+            ("order_date", "order_date"),
+            ("customer_id", "customer_id"),
+            ("customer_email", "customer__email"),
+            ("total_amount", "total_amount"),
+            ("product_id", "lines__product_id"),
+            ("product_name", "lines__product__name"),
+            ("quantity", "lines__quantity"),
+            ("unit_price", "lines__unit_price"),
+        ],
+    ),
+}
+
+
+def csv_value(value):
+    if value is None:
+        return ""
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return value
+
+
+def buffered(pieces, size):
+    """Join ``pieces`` into strings of at least ``size`` characters."""
+    buffer = []
+    length = 0
+    for piece in pieces:
+        buffer.append(piece)
+        length += len(piece)
+        if length >= size:
+            yield "".join(buffer)
+            buffer.clear()
+            length = 0
+    if buffer:
+        yield "".join(buffer)
+
+
+def encode_csv(export, queryset, chunk_size):
+    out = io.StringIO()
+    writer = csv.writer(out)
+
+    def line(row):
+        writer.writerow(row)
+        text = out.getvalue()
+        out.seek(0)
+        out.truncate()
+        return text
+
+    yield line(export.header)
+    for row in export.rows(queryset, chunk_size):
+        yield line([csv_value(value) for value in row])
+
+
+def encode_ndjson(export, queryset, chunk_size):
+    encoder = DjangoJSONEncoder(separators=(",", ":"))
+    for record in export.records(queryset, chunk_size):
+        yield encoder.encode(record) + "\n"
+
+
+ENCODERS = {"csv": encode_csv, "ndjson": encode_ndjson}
+
+
+def stream(export, queryset, fmt):
+    """Yield the encoded export of ``queryset`` in ``fmt`` chunk by chunk."""
+    config = get_config()
+    pieces = ENCODERS[fmt](export, queryset, config["CHUNK_SIZE"])
+    for chunk in buffered(pieces, config["BUFFER_SIZE"]):
+        yield chunk.encode()
+
+
+async def astream(chunks):
+    """
+    Serve a synchronous ``stream`` to ASGI without buffering it: Django
+    would otherwise consume a sync iterator whole before sending it.
+    """
+    chunks = iter(chunks)
+    # thread_sensitive keeps every step on one thread, and so on the
+    # connection holding the cursor.
+    step = sync_to_async(next, thread_sensitive=True)
+    while (chunk := await step(chunks, None)) is not None:
+        yield chunk
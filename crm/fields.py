@@ -0,0 +1,275 @@
+"""
+CRM Connection Fields
+Relay connection fields that cooperate with the per-request DataLoaders,
+and keyset pagination for the root list fields.
+"""
+
+import base64
+import json
+from functools import partial
+
+import graphene
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from graphene_django.filter import DjangoFilterConnectionField
+from promise import Promise
+
+from crm.loaders import get_loaders
+from crm.optimizer import (
+    PAGINATION_ARGS,
+    ensure_loaded,
+    optimize_queryset,
+    prefetched,
+)
+
+
+def has_filter_args(kwargs):
+    """True when a connection was called with any non-pagination argument."""
+    return any(
+        value is not None
+        for name, value in kwargs.items()
+        if name not in PAGINATION_ARGS
+    )
+
+
+def resolve_related_list(instance, info, kwargs, accessor, loader_name):
+    """
+    Resolve a to-many relation for a connection field.
+
+    Prefers the optimizer's prefetch cache, then the request's DataLoader, and
+    falls back to the related manager when the connection is filtered.
+    """
+    if has_filter_args(kwargs):
+        return getattr(instance, accessor).all()
+    cached = prefetched(instance, accessor)
+    if cached is not None:
+        return cached
+    loaders = get_loaders(info)
+    if loaders is None:
+        return getattr(instance, accessor).all()
+    return getattr(loaders, loader_name).load(instance.pk)
+
+
+class BatchedConnectionField(DjangoFilterConnectionField):
+    """
+    DjangoFilterConnectionField that primes the request's DataLoaders with the
+    nodes of every page it returns, and accepts plain lists produced by a
+    loader in place of a queryset.
+    """
+
+    @classmethod
+    def resolve_queryset(
+        cls, connection, iterable, info, args, filtering_args, filterset_class
+    ):
+        # Lists come from a DataLoader and are only returned when the
+        # connection was called without filter arguments.
+        if isinstance(iterable, list):
+            return iterable
+        queryset = super().resolve_queryset(
+            connection, iterable, info, args, filtering_args, filterset_class
+        )
+        return optimize_queryset(queryset, info)
+
+    @classmethod
+    def connection_resolver(
+        cls,
+        resolver,
+        connection,
+        default_manager,
+        queryset_resolver,
+        max_limit,
+        enforce_first_or_last,
+        root,
+        info,
+        **args,
+    ):
+        result = super().connection_resolver(
+            resolver,
+            connection,
+            default_manager,
+            queryset_resolver,
+            max_limit,
+            enforce_first_or_last,
+            root,
+            info,
+            **args,
+        )
+
+        def prime(resolved):
+            loaders = get_loaders(info)
+            if loaders is not None:
+                loaders.prime_page([edge.node for edge in resolved.edges])
+            return resolved
+
+        if Promise.is_thenable(result):
+            return Promise.resolve(result).then(prime)
+        return prime(result)
+
+
+class CountableConnection(graphene.relay.Connection):
+    """Connection with a ``totalCount`` that is only counted when selected."""
+
+    class Meta:
+        abstract = True
+
+    total_count = graphene.Int()
+
+    def resolve_total_count(self, info):
+        length = getattr(self, "length", None)
+        if length is not None:
+            return length
+        return self.iterable.count()
+
+
+def encode_cursor(sort_value, pk):
+    if hasattr(sort_value, "isoformat"):
+        sort_value = sort_value.isoformat()
+    elif sort_value is not None and not isinstance(sort_value, (int, float, str)):
+        sort_value = str(sort_value)
+    payload = json.dumps([sort_value, pk], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor, sort_field, pk_field):
+    try:
+        sort_value, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return sort_field.to_python(sort_value), pk_field.to_python(pk)
+    except (ValueError, TypeError, ValidationError):
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+
+class KeysetConnectionField(BatchedConnectionField):
+    """
+    Connection paginated on ``(sort_key, pk)`` instead of offsets.
+
+    Cursors encode the sort value and primary key of a row, so a page is
+    ``WHERE (sort_key, pk) > (...) ORDER BY sort_key, pk LIMIT n`` whatever
+    its depth, and no ``COUNT(*)`` runs unless ``totalCount`` is selected.
+    ``sort_key`` must be a non-nullable column, ideally indexed together with
+    the primary key.
+    """
+
+    def __init__(self, *args, sort_key="pk", **kwargs):
+        self.sort_key = sort_key
+        super().__init__(*args, **kwargs)
+
+    def wrap_resolve(self, parent_resolver):
+        return partial(self.keyset_resolver, self.resolver or parent_resolver)
+
+    def check_limits(self, info, args):
+        first = args.get("first")
+        last = args.get("last")
+        for name, value in (("first", first), ("last", last)):
+            if value is not None and value < 0:
+                raise ValueError(f"Argument `{name}` must be non-negative")
+            if self.max_limit and value and value > self.max_limit:
+                raise ValueError(
+                    f"Requesting {value} records on the `{info.field_name}` "
+                    f"connection exceeds the `{name}` limit of {self.max_limit} records."
+                )
+        if self.enforce_first_or_last and not (first or last):
+            raise ValueError(
+                "You must provide a `first` or `last` value to properly paginate "
+                f"the `{info.field_name}` connection."
+            )
+
+    def resolve_queryset_for(self, resolver, root, info, args):
+        iterable = resolver(root, info, **args)
+        if iterable is None:
+            iterable = self.get_manager()
+        return self.get_queryset_resolver()(self.connection_type, iterable, info, args)
+
+    def keyset_resolver(self, resolver, root, info, **args):
+        self.check_limits(info, args)
+        queryset = self.resolve_queryset_for(resolver, root, info, args)
+        connection = self.paginate(queryset, args)
+
+        loaders = get_loaders(info)
+        if loaders is not None:
+            loaders.prime_page([edge.node for edge in connection.edges])
+        return connection
+
+    def paginate(self, queryset, args):
+        page, window = self.page_queryset(queryset, args)
+        return self.make_connection(queryset, list(page), window)
+
+    def page_queryset(self, queryset, args):
+        """
+        Return the sliced queryset for one page, fetching one extra row to
+        detect a following page, and the window used to trim it.
+        """
+        model = queryset.model
+        sort_field = model._meta.get_field(self.sort_key)
+        pk_field = model._meta.pk
+        sort, pk = sort_field.attname, pk_field.attname
+
+        after, before = args.get("after"), args.get("before")
+        first, last = args.get("first"), args.get("last")
+        if first is None and last is None:
+            first = self.max_limit
+
+        page = ensure_loaded(queryset, sort_field.name)
+        if after:
+            value, key = decode_cursor(after, sort_field, pk_field)
+            page = page.filter(
+                Q(**{f"{sort}__gt": value}) | Q(**{sort: value, f"{pk}__gt": key})
+            )
+        if before:
+            value, key = decode_cursor(before, sort_field, pk_field)
+            page = page.filter(
+                Q(**{f"{sort}__lt": value}) | Q(**{sort: value, f"{pk}__lt": key})
+            )
+
+        offset = args.get("offset") or 0
+        backwards = last is not None and first is None
+        if backwards:
+            page = page.order_by(f"-{sort}", f"-{pk}")[offset : offset + last + 1]
+        else:
+            page = page.order_by(sort, pk)[offset : offset + first + 1]
+        window = {
+            "first": first,
+            "last": last,
+            "after": after,
+            "before": before,
+            "offset": offset,
+            "backwards": backwards,
+            "sort": sort,
+            "pk": pk,
+        }
+        return page, window
+
+    def make_connection(self, queryset, nodes, window):
+        """Build the connection from the rows fetched by ``page_queryset``."""
+        first, last = window["first"], window["last"]
+        sort, pk = window["sort"], window["pk"]
+        has_previous_page = bool(window["after"]) or window["offset"] > 0
+        has_next_page = bool(window["before"])
+        if window["backwards"]:
+            has_previous_page = len(nodes) > last
+            nodes = nodes[:last][::-1]
+        else:
+            has_next_page = len(nodes) > first
+            nodes = nodes[:first]
+            if last is not None and len(nodes) > last:
+                nodes = nodes[-last:]
+                has_previous_page = True
+
+        connection_type = self.connection_type
+        edges = [
+            connection_type.Edge(
+                node=node, cursor=encode_cursor(getattr(node, sort), getattr(node, pk))
+            )
+            for node in nodes
+        ]
+        connection = connection_type(
+            edges=edges,
+            page_info=graphene.relay.PageInfo(
+                start_cursor=edges[0].cursor if edges else None,
+                end_cursor=edges[-1].cursor if edges else None,
+                has_previous_page=has_previous_page,
+                has_next_page=has_next_page,
+            ),
+        )
+        connection.iterable = queryset
+        connection.length = None
+        return connection
@@ -1,10 +1,13 @@
 import django_filters
-from .models import Customer, Product, Order
+from django.db.models import Exists, OuterRef
+
+from .models import Customer, Product, Order, OrderLine
+from .search import search
 
 
 class CustomerFilter(django_filters.FilterSet):
     name_icontains = django_filters.CharFilter(
-        field_name="name", lookup_expr="icontains"
+        field_name="name", lookup_expr="icontains", method="search_name"
     )
     created_at_gte = django_filters.DateFilter(
         field_name="created_at", lookup_expr="gte"
@@ -14,6 +17,11 @@ class CustomerFilter(django_filters.FilterSet):
         model = Customer
         fields = ["name_icontains", "created_at_gte"]
 
+    def search_name(self, queryset, name, value):
+        # Callers order the rows themselves (keyset pages, exports by pk), so
+        # a relevance ranking would only be computed to be thrown away.
+        return search(queryset, "name", value, rank=False)
+
 
 class ProductFilter(django_filters.FilterSet):
     price_gte = django_filters.NumberFilter(field_name="price", lookup_expr="gte")
@@ -26,15 +34,35 @@ class ProductFilter(django_filters.FilterSet):
 
 class OrderFilter(django_filters.FilterSet):
     customer_name = django_filters.CharFilter(
-        field_name="customer__name", lookup_expr="icontains"
+        field_name="customer__name",
+        lookup_expr="icontains",
+        method="search_customer_name",
     )
     product_name = django_filters.CharFilter(
-        field_name="product__name", lookup_expr="icontains"
+        field_name="products__name",
+        lookup_expr="icontains",
+        method="search_product_name",
     )
     total_amount_gte = django_filters.NumberFilter(
         field_name="total_amount", lookup_expr="gte"
     )
+    order_date_gte = django_filters.DateFilter(
+        field_name="order_date", lookup_expr="gte"
+    )
 
     class Meta:
         model = Order
-        fields = ["customer_name", "product_name", "total_amount_gte"]
+        fields = ["customer_name", "product_name", "total_amount_gte", "order_date_gte"]
+
+    def search_customer_name(self, queryset, name, value):
+        customers = search(Customer.objects.all(), "name", value, rank=False)
+        return queryset.filter(customer__in=customers.values("pk"))
+
+    def search_product_name(self, queryset, name, value):
+        # A correlated EXISTS keeps one row per order (a join on the lines
+        # would repeat orders) and probes the (order, product) index.
+        products = search(Product.objects.all(), "name", value, rank=False)
+        lines = OrderLine.objects.filter(
+            order=OuterRef("pk"), product__in=products.values("pk")
+        )
+        return queryset.filter(Exists(lines))
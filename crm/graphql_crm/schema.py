@@ -3,7 +3,7 @@ from crm.schema import Query as CRMQuery, Mutation as CRMMutation
 
 
 class Query(CRMQuery, graphene.ObjectType):
-    pass
+    hello = graphene.String(default_value="Hello, GraphQL!")
 
 
 class Mutation(CRMMutation, graphene.ObjectType):
@@ -0,0 +1,197 @@
+"""
+CRM Idempotency
+``idempotencyKey`` for the mutations of ``crm.schema``, so that clients can
+retry a mutation without running it twice.
+
+The first successful run with a key stores the mutation's result, keyed by
+the root field and the key, in the same transaction as the mutation's
+writes. A retry with the same key and arguments is answered from that row,
+in one lookup on its unique index, without running the mutation or its
+validation again; reusing a key with other arguments is an error. Model
+instances in the result are stored as their field values and rebuilt
+without querying. Failed runs store nothing.
+
+``bulkCreateProducts`` and ``bulkCreateOrders`` take no key: they commit
+chunk by chunk, and storing a key with their writes would make the whole
+call one transaction, holding its locks until the last chunk is written.
+
+Keys are replayed for ``TTL`` seconds. ``purge_expired`` deletes expired
+keys in batches and runs on the ``crm.jobs`` schedule.
+
+Configured by ``CRM_IDEMPOTENCY``:
+
+- ``TTL``: seconds a stored result is replayed
+- ``PURGE_BATCH_SIZE``: expired keys deleted per statement
+"""
+
+import enum
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+import graphene
+from django.apps import apps
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, models, transaction
+from django.utils import timezone
+from graphql import get_named_type
+
+from crm.models import IdempotencyKey
+
+DEFAULTS = {
+    "TTL": 24 * 60 * 60,
+    "PURGE_BATCH_SIZE": 5000,
+}
+
+MAX_KEY_LENGTH = IdempotencyKey._meta.get_field("key").max_length
+
+# Keys of a model instance in a stored result.
+MODEL = "$model"
+FIELDS = "$fields"
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, "CRM_IDEMPOTENCY", {})}
+
+
+def key_argument():
+    return graphene.String(
+        description=(
+            "Retries with the same key and arguments return the stored result "
+            "instead of running the mutation again."
+        )
+    )
+
+
+class ArgumentsEncoder(DjangoJSONEncoder):
+    def default(self, o):
+        if isinstance(o, enum.Enum):
+            return o.value
+        return super().default(o)
+
+
+def request_hash(kwargs):
+    payload = json.dumps(kwargs, sort_keys=True, cls=ArgumentsEncoder)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def dump_fields(instance):
+    fields = {}
+    for field in instance._meta.concrete_fields:
+        value = field.value_from_object(instance)
+        # value_to_string keeps what JSON would lose (microseconds, decimals).
+        fields[field.attname] = (
+            None if value is None else field.value_to_string(instance)
+        )
+    return fields
+
+
+def dump(value):
+    """Return ``value`` as JSON, model instances as their field values."""
+    if isinstance(value, models.Model):
+        return {MODEL: value._meta.label, FIELDS: dump_fields(value)}
+    if isinstance(value, (list, tuple)):
+        return [dump(item) for item in value]
+    if isinstance(value, dict):
+        return {key: dump(item) for key, item in value.items()}
+    return value
+
+
+def load(value, using):
+    """Reverse ``dump``; model instances are rebuilt as rows of ``using``."""
+    if isinstance(value, list):
+        return [load(item, using) for item in value]
+    if isinstance(value, dict):
+        if MODEL in value:
+            model = apps.get_model(value[MODEL])
+            fields = model._meta.concrete_fields
+            stored = value[FIELDS]
+            return model.from_db(
+                using,
+                [field.attname for field in fields],
+                [field.to_python(stored[field.attname]) for field in fields],
+            )
+        return {key: load(item, using) for key, item in value.items()}
+    return value
+
+
+def lookup(mutation, key, fingerprint):
+    """Return the live ``IdempotencyKey`` of ``key``, or None."""
+    try:
+        record = IdempotencyKey.objects.get(mutation=mutation, key=key)
+    except IdempotencyKey.DoesNotExist:
+        return None
+    if record.expires_at <= timezone.now():
+        # Expired but not purged yet: the key is free again.
+        record.delete()
+        return None
+    if record.request_hash != fingerprint:
+        raise Exception("idempotencyKey was already used with different arguments")
+    return record
+
+
+def replay(output_type, record):
+    return output_type(**load(record.response, record._state.db))
+
+
+def run(info, key, mutate, kwargs):
+    mutation = info.field_name
+    output_type = get_named_type(info.return_type).graphene_type
+    fingerprint = request_hash(kwargs)
+
+    record = lookup(mutation, key, fingerprint)
+    if record is not None:
+        return replay(output_type, record)
+
+    try:
+        with transaction.atomic():
+            result = mutate()
+            IdempotencyKey.objects.create(
+                mutation=mutation,
+                key=key,
+                request_hash=fingerprint,
+                response={
+                    name: dump(getattr(result, name, None))
+                    for name in output_type._meta.fields
+                },
+                expires_at=timezone.now() + timedelta(seconds=get_config()["TTL"]),
+            )
+    except IntegrityError:
+        # A concurrent call with this key committed first; ours rolled back.
+        record = lookup(mutation, key, fingerprint)
+        if record is None:
+            raise
+        return replay(output_type, record)
+    return result
+
+
+def idempotent(mutate):
+    """
+    Give a mutation's ``mutate`` an optional ``idempotency_key`` argument,
+    declared with ``key_argument()`` in its ``Arguments``.
+    """
+
+    @wraps(mutate)
+    def wrapper(root, info, idempotency_key=None, **kwargs):
+        if idempotency_key is None:
+            return mutate(root, info, **kwargs)
+        if not 0 < len(idempotency_key) <= MAX_KEY_LENGTH:
+            raise Exception(
+                f"idempotencyKey must be 1 to {MAX_KEY_LENGTH} characters long"
+            )
+        return run(info, idempotency_key, lambda: mutate(root, info, **kwargs), kwargs)
+
+    return wrapper
+
+
+def purge_expired():
+    """Delete expired keys, ``PURGE_BATCH_SIZE`` rows per statement."""
+    size = get_config()["PURGE_BATCH_SIZE"]
+    expired = IdempotencyKey.objects.filter(expires_at__lte=timezone.now())
+    deleted = 0
+    while pks := list(expired.values_list("pk", flat=True)[:size]):
+        count, _ = IdempotencyKey.objects.filter(pk__in=pks).delete()
+        deleted += count
+    return {"deleted": deleted}
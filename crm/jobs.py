@@ -0,0 +1,320 @@
+"""
+CRM Jobs
+A database-backed job queue for heavy mutations and scheduled maintenance.
+
+Jobs are rows of ``crm.models.Job`` naming a task function by its dotted
+path. Workers claim them with a conditional ``UPDATE`` on the row's status,
+so any number of worker threads and processes can share the table without
+running a job twice; a claim holds a lease, renewed while the job runs,
+and a job whose worker died is claimed again once its lease expires. Failed jobs are retried with
+exponential backoff until ``max_attempts`` is reached. ``SCHEDULE`` replaces
+crontab: the worker enqueues each entry once per interval, deduplicated by
+a key derived from the interval slot, in place of a forked Django process.
+
+Configured by ``CRM_JOBS``:
+
+- ``QUEUES``: ``{"<queue>": max concurrent jobs}`` run by each worker
+- ``POLL_INTERVAL``: seconds an idle worker waits before polling again
+- ``LEASE_SECONDS``: how long a claim lasts unless renewed; a running job
+  renews it every third of that
+- ``MAX_ATTEMPTS`` / ``RETRY_DELAY``: retry defaults for undecorated tasks
+- ``RETENTION_DAYS``: finished jobs older than this are pruned
+- ``SCHEDULE``: ``[(interval in seconds, "dotted.path"), ...]``
+"""
+
+import os
+import socket
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from crm.models import Job
+
+DEFAULTS = {
+    "QUEUES": {"default": 4},
+    "POLL_INTERVAL": 1.0,
+    "LEASE_SECONDS": 600,
+    "MAX_ATTEMPTS": 3,
+    "RETRY_DELAY": 30,
+    "RETENTION_DAYS": 7,
+    "SCHEDULE": [],
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, "CRM_JOBS", {})}
+
+
+def task(queue="default", max_attempts=None, retry_delay=None):
+    """Attach queue and retry options to a task function."""
+
+    def decorator(fn):
+        fn.job_options = {
+            "queue": queue,
+            "max_attempts": max_attempts,
+            "retry_delay": retry_delay,
+        }
+        return fn
+
+    return decorator
+
+
+def task_path(fn):
+    return fn if isinstance(fn, str) else f"{fn.__module__}.{fn.__qualname__}"
+
+
+def task_options(name):
+    config = get_config()
+    options = getattr(import_string(name), "job_options", {})
+    return {
+        "queue": options.get("queue") or "default",
+        "max_attempts": options.get("max_attempts") or config["MAX_ATTEMPTS"],
+        "retry_delay": (
+            config["RETRY_DELAY"]
+            if options.get("retry_delay") is None
+            else options["retry_delay"]
+        ),
+    }
+
+
+def enqueue(fn, kwargs=None, run_at=None, dedupe_key=None):
+    """
+    Queue ``fn`` (a task function or its dotted path) to run with ``kwargs``.
+
+    ``kwargs`` must be JSON-serializable. When ``dedupe_key`` is given and a
+    job with that key exists, that job is returned instead.
+    """
+    name = task_path(fn)
+    options = task_options(name)
+    fields = {
+        "name": name,
+        "queue": options["queue"],
+        "kwargs": kwargs or {},
+        "max_attempts": options["max_attempts"],
+        "run_at": run_at or timezone.now(),
+    }
+    if dedupe_key is None:
+        return Job.objects.create(**fields)
+    try:
+        with transaction.atomic():
+            return Job.objects.create(dedupe_key=dedupe_key, **fields)
+    except IntegrityError:
+        return Job.objects.get(dedupe_key=dedupe_key)
+
+
+def schedule_slot(interval, now):
+    """Index of the ``interval``-second run of a schedule entry due at ``now``."""
+    return int(now.timestamp() // interval)
+
+
+def enqueue_due(schedule, now=None):
+    """Enqueue the current run of every ``(interval, path)`` schedule entry."""
+    now = now or timezone.now()
+    jobs = []
+    for interval, name in schedule:
+        slot = schedule_slot(interval, now)
+        jobs.append(enqueue(name, dedupe_key=f"schedule:{name}:{slot}"))
+    return jobs
+
+
+def prune_jobs(days=None):
+    """Delete finished jobs older than ``RETENTION_DAYS``."""
+    days = get_config()["RETENTION_DAYS"] if days is None else days
+    deleted, _ = Job.objects.filter(
+        status__in=[Job.SUCCEEDED, Job.FAILED],
+        finished_at__lt=timezone.now() - timedelta(days=days),
+    ).delete()
+    return {"deleted": deleted}
+
+
+# ==========================
+# Claiming and running
+# ==========================
+def claimable(now):
+    return Q(status=Job.QUEUED, run_at__lte=now) | Q(
+        status=Job.RUNNING, lease_expires_at__lt=now
+    )
+
+
+def claim(queue, worker_id):
+    """Atomically take the next due job of ``queue``, or return None."""
+    now = timezone.now()
+    lease = now + timedelta(seconds=get_config()["LEASE_SECONDS"])
+    candidates = (
+        Job.objects.filter(claimable(now), queue=queue)
+        .order_by("run_at", "pk")
+        .values_list("pk", flat=True)[:10]
+    )
+    for pk in candidates:
+        # Only one worker's UPDATE still matches once the status changed.
+        claimed = Job.objects.filter(claimable(now), pk=pk).update(
+            status=Job.RUNNING,
+            attempts=F("attempts") + 1,
+            worker=worker_id,
+            started_at=now,
+            lease_expires_at=lease,
+        )
+        if claimed:
+            return Job.objects.get(pk=pk)
+    return None
+
+
+def owned(job):
+    """The row of ``job`` while this claim of it still holds."""
+    # Another worker may have reclaimed the job after its lease expired; the
+    # attempt number also tells apart claims made by the same thread.
+    return Job.objects.filter(
+        pk=job.pk, worker=job.worker, attempts=job.attempts, status=Job.RUNNING
+    )
+
+
+def renew_lease(job, seconds):
+    """Extend the lease of a claimed job; returns 0 if it was lost."""
+    return owned(job).update(
+        lease_expires_at=timezone.now() + timedelta(seconds=seconds)
+    )
+
+
+@contextmanager
+def renewing_lease(job):
+    """Renew the lease of ``job`` from a heartbeat thread while the block runs."""
+    seconds = get_config()["LEASE_SECONDS"]
+    stopped = threading.Event()
+
+    def heartbeat():
+        try:
+            while not stopped.wait(seconds / 3):
+                if not renew_lease(job, seconds):
+                    return
+        finally:
+            connections.close_all()
+
+    thread = threading.Thread(
+        target=heartbeat, name=f"crm-job-{job.pk}-lease", daemon=True
+    )
+    thread.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        thread.join()
+
+
+def run_job(job):
+    """Run a claimed job and record its result, retry or failure."""
+    mine = owned(job)
+    try:
+        with renewing_lease(job):
+            result = import_string(job.name)(**job.kwargs)
+    except Exception:
+        error = traceback.format_exc()
+        now = timezone.now()
+        if job.attempts < job.max_attempts:
+            delay = task_options(job.name)["retry_delay"] * 2 ** (job.attempts - 1)
+            mine.update(
+                status=Job.QUEUED,
+                run_at=now + timedelta(seconds=delay),
+                lease_expires_at=None,
+                error=error,
+            )
+        else:
+            mine.update(status=Job.FAILED, finished_at=now, error=error)
+    else:
+        mine.update(
+            status=Job.SUCCEEDED,
+            result=result,
+            finished_at=timezone.now(),
+            lease_expires_at=None,
+            error="",
+        )
+
+
+class Worker:
+    """
+    Runs due jobs from ``queues`` (``{"<queue>": concurrency}``) on a thread
+    pool, never more than a queue's concurrency at a time, and enqueues the
+    scheduled jobs as they come due.
+    """
+
+    def __init__(self, queues=None, poll_interval=None, schedule=None):
+        config = get_config()
+        self.queues = queues or config["QUEUES"]
+        self.poll_interval = poll_interval or config["POLL_INTERVAL"]
+        schedule = config["SCHEDULE"] if schedule is None else schedule
+        self.schedule = [tuple(entry) for entry in schedule]
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.slots = {
+            queue: threading.BoundedSemaphore(concurrency)
+            for queue, concurrency in self.queues.items()
+        }
+        self.stopping = threading.Event()
+        # Last slot enqueued per schedule entry, so polls between runs skip
+        # the dedupe lookups of enqueue_due.
+        self.enqueued = {}
+
+    def enqueue_scheduled(self, now=None):
+        """Enqueue the schedule entries whose next slot has come due."""
+        now = now or timezone.now()
+        slots = {entry: schedule_slot(entry[0], now) for entry in self.schedule}
+        due = [
+            entry for entry, slot in slots.items() if self.enqueued.get(entry) != slot
+        ]
+        if not due:
+            return []
+        jobs = enqueue_due(due, now)
+        self.enqueued.update((entry, slots[entry]) for entry in due)
+        return jobs
+
+    def claimant(self):
+        """The worker id recorded on a claim: process and claiming thread."""
+        return f"{self.worker_id}:{threading.get_ident()}"
+
+    def run_pending(self):
+        """Run every due job in this thread and return how many ran."""
+        self.enqueue_scheduled()
+        ran = 0
+        for queue in self.queues:
+            while (job := claim(queue, self.claimant())) is not None:
+                run_job(job)
+                ran += 1
+        return ran
+
+    def run(self):
+        """Poll and run jobs until ``stop()`` is called."""
+        workers = sum(self.queues.values())
+        with ThreadPoolExecutor(workers, thread_name_prefix="crm-job") as pool:
+            while not self.stopping.is_set():
+                self.enqueue_scheduled()
+                if not self.dispatch(pool):
+                    close_old_connections()
+                    self.stopping.wait(self.poll_interval)
+
+    def dispatch(self, pool):
+        submitted = 0
+        for queue, slot in self.slots.items():
+            while slot.acquire(blocking=False):
+                job = claim(queue, self.claimant())
+                if job is None:
+                    slot.release()
+                    break
+                pool.submit(self.execute, job, slot)
+                submitted += 1
+        return submitted
+
+    def execute(self, job, slot):
+        try:
+            run_job(job)
+        finally:
+            close_old_connections()
+            slot.release()
+
+    def stop(self):
+        self.stopping.set()
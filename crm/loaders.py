@@ -0,0 +1,162 @@
+"""
+CRM DataLoaders
+Per-request batching of foreign-key and many-to-many lookups.
+
+Every relation resolved through a loader is fetched with a single
+``IN (...)`` query per request: connection fields prime the loaders with the
+keys of the page they return, and the first ``load()`` flushes the whole
+queue at once.
+"""
+
+from collections import defaultdict
+
+from django.conf import settings
+
+from crm.models import Customer, Order, OrderLine, Product
+
+
+class DataLoader:
+    """
+    Synchronous DataLoader.
+
+    ``batch_load_fn`` receives a list of keys and returns a dict mapping each
+    key to its value. Keys missing from the dict resolve to ``default()``.
+    """
+
+    def __init__(self, batch_load_fn, default=None):
+        self.batch_load_fn = batch_load_fn
+        self.default = default
+        self._cache = {}
+        self._queue = {}
+
+    def prime(self, keys):
+        """Queue keys so they are fetched with the next batch."""
+        for key in keys:
+            if key is not None and key not in self._cache:
+                self._queue[key] = None
+
+    def load(self, key):
+        if key is None:
+            return self.default() if self.default else None
+        if key not in self._cache:
+            self._queue[key] = None
+            self.dispatch()
+        return self._cache[key]
+
+    def load_many(self, keys):
+        self.prime(keys)
+        return [self.load(key) for key in keys]
+
+    def dispatch(self):
+        # Pop rather than clear(): under the async view, root fields running
+        # in other threads may prime keys while a batch is being fetched.
+        keys = list(self._queue)
+        for key in keys:
+            self._queue.pop(key, None)
+        if not keys:
+            return
+        results = self.batch_load_fn(keys)
+        for key in keys:
+            value = results.get(key)
+            if value is None and self.default:
+                value = self.default()
+            self._cache[key] = value
+
+    def clear(self, key=None):
+        if key is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(key, None)
+
+
+# ==========================
+# Batch functions
+# ==========================
+def batch_customers(keys):
+    return Customer.objects.in_bulk(keys)
+
+
+def batch_orders_by_customer(keys):
+    grouped = defaultdict(list)
+    for order in Order.objects.filter(customer_id__in=keys).order_by("pk"):
+        grouped[order.customer_id].append(order)
+    return grouped
+
+
+def batch_products_by_order(keys):
+    grouped = defaultdict(list)
+    lines = OrderLine.objects.filter(order_id__in=keys)
+    for line in lines.select_related("product").order_by("product_id"):
+        grouped[line.order_id].append(line.product)
+    return grouped
+
+
+def batch_lines_by_order(keys):
+    grouped = defaultdict(list)
+    lines = OrderLine.objects.filter(order_id__in=keys)
+    for line in lines.select_related("product").order_by("pk"):
+        grouped[line.order_id].append(line)
+    return grouped
+
+
+def batch_orders_by_product(keys):
+    grouped = defaultdict(list)
+    lines = OrderLine.objects.filter(product_id__in=keys)
+    for line in lines.select_related("order").order_by("order_id"):
+        grouped[line.product_id].append(line.order)
+    return grouped
+
+
+class Loaders:
+    """The set of loaders shared by every resolver of one request."""
+
+    def __init__(self):
+        self.customer = DataLoader(batch_customers)
+        self.customer_orders = DataLoader(batch_orders_by_customer, default=list)
+        self.order_products = DataLoader(batch_products_by_order, default=list)
+        self.order_lines = DataLoader(batch_lines_by_order, default=list)
+        self.product_orders = DataLoader(batch_orders_by_product, default=list)
+
+    def prime_page(self, nodes):
+        """Queue the relation keys of a page of nodes returned by a connection."""
+        orders = [n for n in nodes if isinstance(n, Order)]
+        if orders:
+            # Skip foreign keys the optimizer deferred; reading them would
+            # cost one query per row.
+            if "customer_id" not in orders[0].get_deferred_fields():
+                self.customer.prime(o.customer_id for o in orders)
+            self.order_products.prime(o.pk for o in orders)
+            self.order_lines.prime(o.pk for o in orders)
+        customers = [n for n in nodes if isinstance(n, Customer)]
+        if customers:
+            self.customer_orders.prime(c.pk for c in customers)
+        products = [n for n in nodes if isinstance(n, Product)]
+        if products:
+            self.product_orders.prime(p.pk for p in products)
+
+
+def dataloaders_enabled():
+    return getattr(settings, "CRM_DATALOADERS", True)
+
+
+def reset_loaders(context):
+    """Drop the loaders cached on ``context`` so later reads see fresh rows."""
+    if getattr(context, "dataloaders", None) is not None:
+        context.dataloaders = None
+
+
+def get_loaders(info):
+    """
+    Return the loaders attached to the request in ``info.context``.
+
+    Returns None when batching is disabled or there is no context to hold the
+    per-request cache, in which case callers fall back to plain ORM access.
+    """
+    context = info.context
+    if context is None or not dataloaders_enabled():
+        return None
+    loaders = getattr(context, "dataloaders", None)
+    if loaders is None:
+        loaders = Loaders()
+        setattr(context, "dataloaders", loaders)
+    return loaders
@@ -0,0 +1,66 @@
+import time
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from crm import services
+from crm.models import Customer
+
+
+def legacy_bulk_create(rows):
+    """The original per-row BulkCreateCustomers loop, kept as a baseline."""
+    created = []
+    errors = []
+    for c in rows:
+        if Customer.objects.filter(email=c.email).exists():
+            errors.append(f"Email already exists: {c.email}")
+            continue
+        if c.phone and not services.PHONE_RE.match(c.phone):
+            errors.append(f"Invalid phone: {c.phone}")
+            continue
+        created.append(
+            Customer.objects.create(name=c.name, email=c.email, phone=c.phone)
+        )
+    return created, errors
+
+
+class Command(BaseCommand):
+    help = "Compare rows/sec of the per-row and bulk customer import paths."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=10000)
+        parser.add_argument(
+            "--chunk-size", type=int, default=services.DEFAULT_CHUNK_SIZE
+        )
+
+    def handle(self, *args, **options):
+        rows = [
+            SimpleNamespace(
+                name=f"Bench {i}",
+                email=f"bench-{i}@example.com",
+                phone="+1234567890" if i % 10 else "bad-phone",
+            )
+            for i in range(options["rows"])
+        ]
+
+        runs = [
+            ("per-row", lambda: legacy_bulk_create(rows)),
+            (
+                "bulk",
+                lambda: services.bulk_create_customers(
+                    rows, chunk_size=options["chunk_size"]
+                ),
+            ),
+        ]
+        for label, run in runs:
+            # Each run is rolled back so both paths insert the same rows.
+            with transaction.atomic():
+                start = time.perf_counter()
+                created, errors = run()
+                elapsed = time.perf_counter() - start
+                transaction.set_rollback(True)
+            self.stdout.write(
+                f"{label:>8}: {len(rows) / elapsed:12.0f} rows/sec "
+                f"({len(created)} created, {len(errors)} errors, {elapsed:.3f}s)"
+            )
@@ -0,0 +1,190 @@
+import json
+import statistics
+import time
+import tracemalloc
+from contextlib import ExitStack
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.http import HttpRequest
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from graphql import execute
+from graphql_relay import to_global_id
+
+from crm.documents import document_cache
+from crm.graphql_crm.schema import schema
+from crm.management.commands.loadtest_graphql import percentile
+from crm.models import CustomerSales
+
+ORDER_FIELDS = """
+    totalAmount
+    orderDate
+    customer { name email }
+    lines { quantity unitPrice product { name price } }
+"""
+
+# name -> (query, variables); variables may be a callable run before timing.
+OPERATIONS = {
+    "customers_page": (
+        "{ allCustomers(first: 50) { edges { node { name email createdAt } } } }",
+        None,
+    ),
+    "customers_search": (
+        "query ($q: String) { allCustomers(first: 20, nameIcontains: $q) "
+        "{ totalCount edges { node { name email } } } }",
+        {"q": "ali"},
+    ),
+    "customers_with_orders": (
+        "{ allCustomers(first: 20) { edges { node { name "
+        "orders(first: 5) { edges { node { totalAmount orderDate } } } } } } }",
+        None,
+    ),
+    "products_filtered": (
+        "{ allProducts(first: 50, priceGte: 100, priceLte: 1000) "
+        "{ totalCount edges { node { name price stock } } } }",
+        None,
+    ),
+    "orders_with_lines": (
+        f"{{ allOrders(first: 50) {{ edges {{ node {{ {ORDER_FIELDS} }} }} }} }}",
+        None,
+    ),
+    "orders_recent": (
+        "query ($since: Date) { allOrders(first: 50, orderDateGte: $since) "
+        f"{{ edges {{ node {{ {ORDER_FIELDS} }} }} }} }}",
+        lambda: {"since": (timezone.localdate() - timedelta(days=7)).isoformat()},
+    ),
+    "orders_by_product_name": (
+        '{ allOrders(first: 20, productName: "laptop") '
+        "{ edges { node { totalAmount customer { name } } } } }",
+        None,
+    ),
+    "sales_summary": (
+        "query ($since: Date) { salesSummary(dateFrom: $since) "
+        "{ orderCount revenue averageOrderValue days { date orderCount revenue } } }",
+        lambda: {"since": (timezone.localdate() - timedelta(days=30)).isoformat()},
+    ),
+    "top_products": (
+        "{ topProducts(first: 20) { product { name price } unitsSold revenue } }",
+        None,
+    ),
+    "customer_lifetime_value": (
+        "query ($id: ID!) { customerLifetimeValue(customerId: $id) "
+        "{ customer { name } orderCount totalSpent averageOrderValue } }",
+        lambda: {
+            "id": to_global_id(
+                "CustomerType",
+                CustomerSales.objects.order_by("-total_spent")
+                .values_list("customer_id", flat=True)
+                .first()
+                or 0,
+            )
+        },
+    ),
+}
+
+
+def run_operation(document, variables):
+    """Execute ``document`` as a fresh request and return the result."""
+    result = execute(
+        schema.graphql_schema,
+        document,
+        context_value=HttpRequest(),
+        variable_values=variables,
+    )
+    if result.errors:
+        raise CommandError("; ".join(e.message for e in result.errors))
+    return result
+
+
+def count_queries(fn):
+    # Only connections already open; capturing the others would open them.
+    with ExitStack() as stack:
+        contexts = [
+            stack.enter_context(CaptureQueriesContext(connection))
+            for connection in connections.all(initialized_only=True)
+            if connection.connection is not None
+        ]
+        fn()
+    return sum(len(context.captured_queries) for context in contexts)
+
+
+def peak_memory(fn):
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark(name, repeat=20, warmup=3):
+    """Return latency, query count and peak memory of operation ``name``."""
+    query, variables = OPERATIONS[name]
+    if callable(variables):
+        variables = variables()
+    document, errors = document_cache.get_document(schema.graphql_schema, query)
+    if errors:
+        raise CommandError(f"{name}: {errors[0].message}")
+
+    def run():
+        run_operation(document, variables)
+
+    for _ in range(warmup):
+        run()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        timings.append((time.perf_counter() - start) * 1000)
+    # Counted and traced on separate runs so neither skews the timings.
+    return {
+        "operation": name,
+        "p50_ms": percentile(timings, 50),
+        "p95_ms": percentile(timings, 95),
+        "mean_ms": statistics.mean(timings),
+        "queries": count_queries(run),
+        "peak_kib": peak_memory(run) / 1024,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Run a fixed set of GraphQL operations in-process against the CRM "
+        "schema and report latency, SQL query count and peak memory for "
+        "each. Seed a dataset first with `manage.py seed_data`."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--operation",
+            action="append",
+            choices=sorted(OPERATIONS),
+            help="Run only this operation; repeat to select several.",
+        )
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument("--warmup", type=int, default=3)
+        parser.add_argument(
+            "--json", dest="json_path", help="Also write the results to this file."
+        )
+
+    def handle(self, *args, **options):
+        if options["repeat"] < 1:
+            raise CommandError("--repeat must be at least 1")
+        self.stdout.write(
+            f"{'operation':<24} {'p50 ms':>9} {'p95 ms':>9} {'mean ms':>9} "
+            f"{'queries':>8} {'peak KiB':>9}"
+        )
+        results = []
+        for name in options["operation"] or OPERATIONS:
+            result = benchmark(name, options["repeat"], options["warmup"])
+            results.append(result)
+            self.stdout.write(
+                f"{name:<24} {result['p50_ms']:9.2f} {result['p95_ms']:9.2f} "
+                f"{result['mean_ms']:9.2f} {result['queries']:>8} "
+                f"{result['peak_kib']:9.1f}"
+            )
+        if options["json_path"]:
+            with open(options["json_path"], "w") as f:
+                json.dump(results, f, indent=2)
@@ -0,0 +1,82 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from crm import search
+from crm.models import Customer
+from crm.services import chunked
+
+FIRST_NAMES = ["Alice", "Bob", "Carol", "David", "Malika", "Yusuf", "Ines", "Omar"]
+LAST_NAMES = ["Martin", "Stone", "Alison", "King", "Haddad", "Benali", "Moreau"]
+EMAIL_DOMAIN = "search-bench.example.com"
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a large customer table and compare name search latency between "
+        "icontains and the configured search backend."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1_000_000)
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument(
+            "--terms", nargs="+", default=["ali", "stone", "yusuf ben", "zzz"]
+        )
+        parser.add_argument(
+            "--keep", action="store_true", help="Keep the seeded customers."
+        )
+
+    def seed(self, rows, seed):
+        existing = Customer.objects.filter(email__endswith=EMAIL_DOMAIN).count()
+        rng = random.Random(seed)
+        customers = (
+            Customer(
+                name=f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {i}",
+                email=f"{i}@{EMAIL_DOMAIN}",
+            )
+            for i in range(existing, rows)
+        )
+        start = time.perf_counter()
+        for chunk in chunked(customers, 5000):
+            Customer.objects.bulk_create(chunk)
+        if rows > existing:
+            self.stdout.write(
+                f"Seeded {rows - existing} customers in "
+                f"{time.perf_counter() - start:.1f}s"
+            )
+
+    def time_search(self, backend, term, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            matches = len(
+                list(
+                    backend.search(Customer.objects.all(), "name", term).values_list(
+                        "pk", flat=True
+                    )
+                )
+            )
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings), matches
+
+    def handle(self, *args, **options):
+        self.seed(options["rows"], options["seed"])
+        backends = [
+            search.BACKENDS["icontains"],
+            search.get_backend(Customer.objects.all()),
+        ]
+        try:
+            for term in options["terms"]:
+                for backend in backends:
+                    median, matches = self.time_search(backend, term, options["repeat"])
+                    self.stdout.write(
+                        f"{term!r:>12} {backend.name:>10}: {median:9.1f} ms "
+                        f"({matches} matches)"
+                    )
+        finally:
+            if not options["keep"]:
+                Customer.objects.filter(email__endswith=EMAIL_DOMAIN).delete()
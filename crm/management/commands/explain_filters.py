@@ -0,0 +1,91 @@
+import datetime
+import re
+from itertools import combinations
+
+import django_filters
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router
+
+from crm.filters import CustomerFilter, OrderFilter, ProductFilter
+
+FILTERSETS = [CustomerFilter, ProductFilter, OrderFilter]
+
+# Full table scans, as reported by SQLite and PostgreSQL query plans.
+SCAN_PATTERNS = [
+    re.compile(r"\bSCAN (?P<table>\w+)\b(?! VIRTUAL TABLE)(?!.*\bUSING\b.*\bINDEX\b)"),
+    re.compile(r"\bSeq Scan on (?P<table>\w+)"),
+]
+
+
+def sample_value(filter_field):
+    """A representative value for one filter, used to build EXPLAIN queries."""
+    if isinstance(filter_field, django_filters.DateFilter):
+        return datetime.date.today().isoformat()
+    if isinstance(filter_field, django_filters.NumberFilter):
+        return "10"
+    if isinstance(filter_field, django_filters.CharFilter):
+        return "abc"
+    return "1"
+
+
+def scanned_tables(plan):
+    tables = []
+    for pattern in SCAN_PATTERNS:
+        tables.extend(match.group("table") for match in pattern.finditer(plan))
+    return tables
+
+
+class Command(BaseCommand):
+    help = (
+        "Run EXPLAIN for every combination of the filters in crm.filters "
+        "and flag query plans that still scan a whole table."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--fail-on-scan",
+            action="store_true",
+            help="Exit with an error when any plan contains a full table scan.",
+        )
+        parser.add_argument(
+            "--verbose-plans", action="store_true", help="Print every query plan."
+        )
+
+    def handle(self, *args, **options):
+        flagged = 0
+        for filterset_class in FILTERSETS:
+            model = filterset_class._meta.model
+            vendor = connections[router.db_for_read(model)].vendor
+            filters = filterset_class.base_filters
+            self.stdout.write(f"{filterset_class.__name__} ({vendor})")
+
+            for size in range(1, len(filters) + 1):
+                for names in combinations(filters, size):
+                    data = {name: sample_value(filters[name]) for name in names}
+                    label = ", ".join(names)
+                    try:
+                        filterset = filterset_class(
+                            data=data, queryset=model._default_manager.all()
+                        )
+                        plan = filterset.qs.explain()
+                    except Exception as e:
+                        flagged += 1
+                        self.stdout.write(self.style.ERROR(f"  ERROR {label}: {e}"))
+                        continue
+
+                    tables = scanned_tables(plan)
+                    if tables:
+                        flagged += 1
+                        self.stdout.write(
+                            self.style.WARNING(
+                                f"  SCAN  {label}: {', '.join(sorted(set(tables)))}"
+                            )
+                        )
+                    else:
+                        self.stdout.write(self.style.SUCCESS(f"  OK    {label}"))
+                    if options["verbose_plans"]:
+                        for line in plan.splitlines():
+                            self.stdout.write(f"        {line}")
+
+        if flagged and options["fail_on_scan"]:
+            raise CommandError(f"{flagged} filter combination(s) need attention")
@@ -0,0 +1,104 @@
+import json
+import statistics
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+DEFAULT_QUERY = """
+{
+  allProducts(first: 20) { edges { node { name price stock } } }
+  allCustomers(first: 20) { edges { node { name email } } }
+  allOrders(first: 20) { edges { node { totalAmount customer { name } } } }
+}
+"""
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test running GraphQL deployments and compare p50/p99 latency "
+        "and requests/sec. Start each server first, e.g. "
+        "`gunicorn crm.wsgi -w 4 --threads 8` and "
+        "`uvicorn crm.asgi:application --workers 4 --port 8001`, then pass "
+        "--target wsgi=http://127.0.0.1:8000/graphql/ "
+        "--target asgi=http://127.0.0.1:8001/graphql/"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--target",
+            action="append",
+            required=True,
+            help="label=url of a GraphQL endpoint; repeat to compare.",
+        )
+        parser.add_argument("--requests", type=int, default=1000)
+        parser.add_argument("--concurrency", type=int, default=32)
+        parser.add_argument("--warmup", type=int, default=50)
+        parser.add_argument("--query", default=DEFAULT_QUERY)
+        parser.add_argument("--timeout", type=float, default=30)
+        parser.add_argument(
+            "--allow-cache",
+            action="store_true",
+            help="Send identical requests so the response cache can answer them.",
+        )
+
+    def request(self, url, n, options):
+        payload = {"query": options["query"]}
+        if not options["allow_cache"]:
+            # Unused variables are ignored by execution but are part of the
+            # response cache key, so every request reaches the resolvers.
+            payload["variables"] = {"loadtestRequest": n}
+        request = urllib.request.Request(
+            url,
+            data=json.dumps(payload).encode(),
+            headers={"Content-Type": "application/json"},
+        )
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=options["timeout"]) as r:
+                ok = r.status == 200 and "errors" not in json.loads(r.read())
+        except (urllib.error.URLError, OSError, ValueError):
+            ok = False
+        return time.perf_counter() - start, ok
+
+    def run(self, url, count, options, offset=0):
+        with ThreadPoolExecutor(options["concurrency"]) as pool:
+            start = time.perf_counter()
+            results = list(
+                pool.map(lambda n: self.request(url, offset + n, options), range(count))
+            )
+            elapsed = time.perf_counter() - start
+        return results, elapsed
+
+    def handle(self, *args, **options):
+        targets = []
+        for target in options["target"]:
+            label, sep, url = target.partition("=")
+            if not sep:
+                raise CommandError(f"Expected label=url, got {target!r}")
+            targets.append((label, url))
+
+        self.stdout.write(
+            f"{'target':>10} {'p50 ms':>9} {'p99 ms':>9} {'mean ms':>9} "
+            f"{'req/s':>9} {'errors':>7}"
+        )
+        for label, url in targets:
+            if options["warmup"]:
+                self.run(url, options["warmup"], options, offset=-options["warmup"])
+            results, elapsed = self.run(url, options["requests"], options)
+            latencies = [latency * 1000 for latency, _ in results]
+            errors = sum(1 for _, ok in results if not ok)
+            self.stdout.write(
+                f"{label:>10} {percentile(latencies, 50):9.1f} "
+                f"{percentile(latencies, 99):9.1f} "
+                f"{statistics.mean(latencies):9.1f} "
+                f"{len(results) / elapsed:9.1f} {errors:>7}"
+            )
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from crm import analytics
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the DailySales, ProductSales and CustomerSales summary "
+        "tables from the order history."
+    )
+
+    def handle(self, *args, **options):
+        counts = analytics.rebuild()
+        self.stdout.write(
+            f"Rebuilt {counts['days']} day(s), {counts['customers']} customer(s) "
+            f"and {counts['products']} product(s)."
+        )
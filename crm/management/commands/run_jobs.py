@@ -0,0 +1,55 @@
+import signal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from crm.jobs import Worker, get_config
+
+
+class Command(BaseCommand):
+    help = (
+        "Run background jobs and the CRM_JOBS schedule from the database "
+        "queue until interrupted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--queue",
+            action="append",
+            help="queue=concurrency to run; repeat for several. "
+            "Defaults to CRM_JOBS['QUEUES'].",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Run the jobs that are due, then exit.",
+        )
+        parser.add_argument(
+            "--no-schedule",
+            action="store_true",
+            help="Do not enqueue scheduled jobs from this worker.",
+        )
+
+    def handle(self, *args, **options):
+        queues = None
+        if options["queue"]:
+            queues = {}
+            for queue in options["queue"]:
+                name, _, concurrency = queue.partition("=")
+                try:
+                    queues[name] = int(concurrency or 1)
+                except ValueError:
+                    raise CommandError(f"Expected queue=concurrency, got {queue!r}")
+        schedule = [] if options["no_schedule"] else None
+        worker = Worker(queues=queues, schedule=schedule)
+
+        if options["once"]:
+            ran = worker.run_pending()
+            self.stdout.write(f"Ran {ran} job(s).")
+            return
+
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: worker.stop())
+        self.stdout.write(
+            f"Running queues {worker.queues} every {get_config()['POLL_INTERVAL']}s"
+        )
+        worker.run()
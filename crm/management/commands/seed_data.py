@@ -0,0 +1,65 @@
+from datetime import datetime, time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from crm import seeding
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk-generate a deterministic synthetic dataset of customers, "
+        "products and orders, e.g. `seed_data --customers 1000000 "
+        "--products 10000 --orders 5000000 --flush`."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--customers", type=int, default=10000)
+        parser.add_argument("--products", type=int, default=1000)
+        parser.add_argument("--orders", type=int, default=50000)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument(
+            "--days", type=int, default=365, help="Spread orders over this many days."
+        )
+        parser.add_argument(
+            "--end",
+            help="Last order date (YYYY-MM-DD); defaults to today. Fix it to "
+            "reproduce a dataset exactly.",
+        )
+        parser.add_argument(
+            "--flush",
+            action="store_true",
+            help="Empty the customer, product and order tables first.",
+        )
+
+    def handle(self, *args, **options):
+        if min(options["customers"], options["products"], options["orders"]) < 0:
+            raise CommandError("Counts cannot be negative.")
+        if options["batch_size"] < 1 or options["days"] < 1:
+            raise CommandError("--batch-size and --days must be at least 1.")
+        end = None
+        if options["end"]:
+            try:
+                day = datetime.strptime(options["end"], "%Y-%m-%d").date()
+            except ValueError:
+                raise CommandError("--end must be a YYYY-MM-DD date.")
+            end = timezone.make_aware(datetime.combine(day, time.min))
+
+        if options["flush"]:
+            seeding.flush()
+        seeder = seeding.Seeder(
+            options["customers"],
+            options["products"],
+            options["orders"],
+            seed=options["seed"],
+            batch_size=options["batch_size"],
+            end=end,
+            days=options["days"],
+        )
+        start = timezone.now()
+        for label, inserted, total in seeder.run():
+            elapsed = (timezone.now() - start).total_seconds()
+            self.stdout.write(f"{label:>9}: {inserted}/{total} ({elapsed:.1f}s)")
+        elapsed = (timezone.now() - start).total_seconds()
+        self.stdout.write(self.style.SUCCESS(f"Seeded in {elapsed:.1f}s"))
@@ -0,0 +1,35 @@
+import sqlite3
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from crm.routing import get_config
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy the primary SQLite database over a replica's file, standing in "
+        "for replication when trying replica routing locally. Run it with "
+        "CRM_DB_REPLICAS=replica and repeat it to simulate replication lag."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--replica", default="replica")
+
+    def handle(self, *args, **options):
+        primary = connections[get_config()["PRIMARY"]]
+        replica = connections[options["replica"]]
+        if primary.vendor != "sqlite" or replica.vendor != "sqlite":
+            raise CommandError("Both databases must be SQLite.")
+
+        replica.close()
+        primary.ensure_connection()
+        target = sqlite3.connect(replica.settings_dict["NAME"])
+        try:
+            primary.connection.backup(target)
+        finally:
+            target.close()
+        self.stdout.write(
+            f"Copied {primary.settings_dict['NAME']} to "
+            f"{replica.settings_dict['NAME']}."
+        )
@@ -0,0 +1,84 @@
+from django.db import migrations
+
+FTS_TABLE = "crm_customer_fts"
+
+SQLITE_FORWARD = [
+    f"""
+    CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+        name, content='crm_customer', content_rowid='id', tokenize='trigram'
+    )
+    """,
+    f"""
+    CREATE TRIGGER crm_customer_fts_ai AFTER INSERT ON crm_customer BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name) VALUES (new.id, new.name);
+    END
+    """,
+    f"""
+    CREATE TRIGGER crm_customer_fts_ad AFTER DELETE ON crm_customer BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name)
+        VALUES ('delete', old.id, old.name);
+    END
+    """,
+    f"""
+    CREATE TRIGGER crm_customer_fts_au AFTER UPDATE OF name ON crm_customer BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name)
+        VALUES ('delete', old.id, old.name);
+        INSERT INTO {FTS_TABLE}(rowid, name) VALUES (new.id, new.name);
+    END
+    """,
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+]
+
+SQLITE_REVERSE = [
+    "DROP TRIGGER IF EXISTS crm_customer_fts_au",
+    "DROP TRIGGER IF EXISTS crm_customer_fts_ad",
+    "DROP TRIGGER IF EXISTS crm_customer_fts_ai",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+# Matches the UPPER(name::text) LIKE expression Django emits for icontains.
+POSTGRES_FORWARD = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS crm_customer_name_trgm ON crm_customer "
+    'USING gin ((UPPER("name"::text)) gin_trgm_ops)',
+]
+
+POSTGRES_REVERSE = ["DROP INDEX IF EXISTS crm_customer_name_trgm"]
+
+
+def sqlite_supports_trigram_fts(cursor):
+    cursor.execute("SELECT sqlite_version()")
+    version = tuple(int(part) for part in cursor.fetchone()[0].split("."))
+    cursor.execute("PRAGMA compile_options")
+    options = {row[0] for row in cursor.fetchall()}
+    return version >= (3, 34, 0) and "ENABLE_FTS5" in options
+
+
+def run(statements_by_vendor):
+    def apply(apps, schema_editor):
+        connection = schema_editor.connection
+        statements = statements_by_vendor.get(connection.vendor, [])
+        with connection.cursor() as cursor:
+            if connection.vendor == "sqlite" and not sqlite_supports_trigram_fts(
+                cursor
+            ):
+                # crm.search falls back to icontains without the table.
+                return
+            for statement in statements:
+                cursor.execute(statement)
+
+    return apply
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("crm", "0003_filter_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run({"sqlite": SQLITE_FORWARD, "postgresql": POSTGRES_FORWARD}),
+            run({"sqlite": SQLITE_REVERSE, "postgresql": POSTGRES_REVERSE}),
+        ),
+    ]
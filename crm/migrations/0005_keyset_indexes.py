@@ -0,0 +1,29 @@
+# Generated by Django 5.2.5 on 2026-10-18 03:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("crm", "0004_customer_name_search"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="customer",
+            name="crm_customer_created_idx",
+        ),
+        migrations.AddIndex(
+            model_name="customer",
+            index=models.Index(
+                fields=["created_at", "id"], name="crm_customer_created_id_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                fields=["order_date", "id"], name="crm_order_date_id_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,81 @@
+# Generated by Django 5.2.5 on 2026-10-18 03:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("crm", "0006_job"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CustomerSales",
+            fields=[
+                (
+                    "customer",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="sales",
+                        serialize=False,
+                        to="crm.customer",
+                    ),
+                ),
+                ("order_count", models.PositiveIntegerField(default=0)),
+                (
+                    "total_spent",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=14),
+                ),
+                ("first_order_at", models.DateTimeField(blank=True, null=True)),
+                ("last_order_at", models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="DailySales",
+            fields=[
+                ("date", models.DateField(primary_key=True, serialize=False)),
+                ("order_count", models.PositiveIntegerField(default=0)),
+                (
+                    "revenue",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=14),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="ProductSales",
+            fields=[
+                (
+                    "product",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="sales",
+                        serialize=False,
+                        to="crm.product",
+                    ),
+                ),
+                ("order_count", models.PositiveIntegerField(default=0)),
+                ("units_sold", models.PositiveIntegerField(default=0)),
+                (
+                    "revenue",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=14),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["revenue"], name="crm_productsales_revenue_idx"
+                    ),
+                    models.Index(
+                        fields=["units_sold"], name="crm_productsales_units_idx"
+                    ),
+                    models.Index(
+                        fields=["order_count"], name="crm_productsales_orders_idx"
+                    ),
+                ],
+            },
+        ),
+    ]
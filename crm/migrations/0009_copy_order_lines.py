@@ -0,0 +1,80 @@
+from django.db import migrations, transaction
+
+BATCH_SIZE = 5000
+
+
+def copy_order_products(apps, schema_editor):
+    """
+    Copy ``Order.products`` rows into ``OrderLine`` in keyset-paginated
+    batches, one transaction per batch, so memory and lock time stay bounded
+    on large tables. The old rows carry neither quantity nor price: each
+    becomes one unit at the product's current price. Conflicting rows are
+    ignored, so an interrupted run can simply be migrated again.
+    """
+    Order = apps.get_model("crm", "Order")
+    OrderLine = apps.get_model("crm", "OrderLine")
+    Through = Order.products.through
+    db = schema_editor.connection.alias
+
+    last = 0
+    while True:
+        rows = list(
+            Through.objects.using(db)
+            .filter(pk__gt=last)
+            .order_by("pk")
+            .values_list("pk", "order_id", "product_id", "product__price")[:BATCH_SIZE]
+        )
+        if not rows:
+            return
+        with transaction.atomic(using=db):
+            OrderLine.objects.using(db).bulk_create(
+                [
+                    OrderLine(
+                        order_id=order_id,
+                        product_id=product_id,
+                        quantity=1,
+                        unit_price=price,
+                    )
+                    for _, order_id, product_id, price in rows
+                ],
+                ignore_conflicts=True,
+            )
+        last = rows[-1][0]
+
+
+def copy_order_lines_back(apps, schema_editor):
+    Order = apps.get_model("crm", "Order")
+    OrderLine = apps.get_model("crm", "OrderLine")
+    Through = Order.products.through
+    db = schema_editor.connection.alias
+
+    last = 0
+    while True:
+        rows = list(
+            OrderLine.objects.using(db)
+            .filter(pk__gt=last)
+            .order_by("pk")
+            .values_list("pk", "order_id", "product_id")[:BATCH_SIZE]
+        )
+        if not rows:
+            break
+        with transaction.atomic(using=db):
+            Through.objects.using(db).bulk_create(
+                [Through(order_id=o, product_id=p) for _, o, p in rows],
+                ignore_conflicts=True,
+            )
+        last = rows[-1][0]
+    OrderLine.objects.using(db).all().delete()
+
+
+class Migration(migrations.Migration):
+    # Each batch commits on its own.
+    atomic = False
+
+    dependencies = [
+        ("crm", "0008_orderline"),
+    ]
+
+    operations = [
+        migrations.RunPython(copy_order_products, copy_order_lines_back),
+    ]
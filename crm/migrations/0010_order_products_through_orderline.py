@@ -0,0 +1,28 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    """
+    Point ``Order.products`` at ``OrderLine``. Django cannot add ``through``
+    to an existing many-to-many field, so the auto-created table (already
+    copied by 0009) is dropped and the field re-added over ``OrderLine``,
+    which needs no schema change of its own.
+    """
+
+    dependencies = [
+        ("crm", "0009_copy_order_lines"),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name="order",
+            name="products",
+        ),
+        migrations.AddField(
+            model_name="order",
+            name="products",
+            field=models.ManyToManyField(
+                related_name="orders", through="crm.OrderLine", to="crm.product"
+            ),
+        ),
+    ]
@@ -1,3 +1,4 @@
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from django.utils import timezone
 
@@ -8,6 +9,14 @@ class Customer(models.Model):
     phone = models.CharField(max_length=20, blank=True, null=True)
     created_at = models.DateTimeField(default=timezone.now)
 
+    class Meta:
+        indexes = [
+            # Serves created_at_gte and keyset pagination on (created_at, id).
+            models.Index(
+                fields=["created_at", "id"], name="crm_customer_created_id_idx"
+            ),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -18,6 +27,13 @@ class Product(models.Model):
     stock = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(default=timezone.now)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["price"], name="crm_product_price_idx"),
+            # Also serves the exact `stock` filter on its own.
+            models.Index(fields=["stock", "price"], name="crm_product_stock_price_idx"),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -26,9 +42,163 @@ class Order(models.Model):
     customer = models.ForeignKey(
         Customer, on_delete=models.CASCADE, related_name="orders"
     )
-    products = models.ManyToManyField(Product, related_name="orders")
+    products = models.ManyToManyField(
+        Product, through="OrderLine", related_name="orders"
+    )
     total_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     order_date = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["total_amount"], name="crm_order_total_idx"),
+            models.Index(
+                fields=["order_date", "customer"], name="crm_order_date_customer_idx"
+            ),
+            # Keyset pagination on (order_date, id).
+            models.Index(fields=["order_date", "id"], name="crm_order_date_id_idx"),
+        ]
+
     def __str__(self):
         return f"Order {self.id} - {self.customer.name}"
+
+
+class OrderLine(models.Model):
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="lines")
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="order_lines"
+    )
+    quantity = models.PositiveIntegerField(default=1)
+    # The product's price when the order was placed.
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+
+    class Meta:
+        constraints = [
+            # Also serves order -> lines lookups.
+            models.UniqueConstraint(
+                fields=["order", "product"], name="crm_orderline_order_product_uniq"
+            ),
+        ]
+        indexes = [
+            # Serves product -> orders lookups and the product_name EXISTS filter.
+            models.Index(fields=["product", "order"], name="crm_orderline_product_idx"),
+        ]
+
+    @property
+    def amount(self):
+        return self.unit_price * self.quantity
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} @ {self.unit_price}"
+
+
+# ==========================
+# Sales summaries (maintained by crm.analytics)
+# ==========================
+class DailySales(models.Model):
+    date = models.DateField(primary_key=True)
+    order_count = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"{self.date}: {self.order_count} orders, {self.revenue}"
+
+
+class ProductSales(models.Model):
+    product = models.OneToOneField(
+        Product, on_delete=models.CASCADE, primary_key=True, related_name="sales"
+    )
+    order_count = models.PositiveIntegerField(default=0)
+    units_sold = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        indexes = [
+            # Serve the topProducts orderings.
+            models.Index(fields=["revenue"], name="crm_productsales_revenue_idx"),
+            models.Index(fields=["units_sold"], name="crm_productsales_units_idx"),
+            models.Index(fields=["order_count"], name="crm_productsales_orders_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id}: {self.units_sold} units, {self.revenue}"
+
+
+class CustomerSales(models.Model):
+    customer = models.OneToOneField(
+        Customer, on_delete=models.CASCADE, primary_key=True, related_name="sales"
+    )
+    order_count = models.PositiveIntegerField(default=0)
+    total_spent = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    first_order_at = models.DateTimeField(blank=True, null=True)
+    last_order_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.customer_id}: {self.order_count} orders, {self.total_spent}"
+
+
+class Job(models.Model):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (SUCCEEDED, "Succeeded"),
+        (FAILED, "Failed"),
+    ]
+
+    name = models.CharField(max_length=200)  # dotted path of the task function
+    queue = models.CharField(max_length=50, default="default")
+    kwargs = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_at = models.DateTimeField(default=timezone.now)
+    lease_expires_at = models.DateTimeField(blank=True, null=True)
+    worker = models.CharField(max_length=100, blank=True)
+    # Set for scheduled runs so every worker enqueues a given run only once.
+    dedupe_key = models.CharField(max_length=200, unique=True, blank=True, null=True)
+    result = models.JSONField(blank=True, null=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            # Serves the worker's claim query.
+            models.Index(
+                fields=["queue", "status", "run_at"], name="crm_job_claim_idx"
+            ),
+        ]
+
+    def __str__(self):
+        return f"Job {self.id} - {self.name} ({self.status})"
+
+
+class IdempotencyKey(models.Model):
+    """The stored result of a mutation run with an ``idempotencyKey``."""
+
+    mutation = models.CharField(max_length=100)  # root field name
+    key = models.CharField(max_length=255)
+    # Hash of the mutation arguments, so a key cannot be reused for another call.
+    request_hash = models.CharField(max_length=64)
+    response = models.JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            # Also the index serving the lookup of a retried request.
+            models.UniqueConstraint(
+                fields=["mutation", "key"], name="crm_idempotency_key_uniq"
+            ),
+        ]
+        indexes = [
+            # Serves the purge of expired keys.
+            models.Index(fields=["expires_at"], name="crm_idempotency_expires_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.mutation} {self.key}"
@@ -0,0 +1,149 @@
+"""
+CRM Query Optimizer
+Builds only()/select_related()/prefetch_related() calls from a GraphQL
+selection set so list queries load just the columns and relations the
+client asked for.
+"""
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from graphene.utils.str_converters import to_snake_case
+from graphql.language import FieldNode, FragmentSpreadNode, InlineFragmentNode
+
+PAGINATION_ARGS = {"first", "last", "before", "after", "offset"}
+
+
+def optimizer_enabled():
+    return getattr(settings, "CRM_QUERY_OPTIMIZER", True)
+
+
+def iter_fields(selection_set, fragments):
+    """Yield the FieldNodes of a selection set, expanding fragments."""
+    if selection_set is None:
+        return
+    for selection in selection_set.selections:
+        if isinstance(selection, FieldNode):
+            yield selection
+        elif isinstance(selection, InlineFragmentNode):
+            yield from iter_fields(selection.selection_set, fragments)
+        elif isinstance(selection, FragmentSpreadNode):
+            fragment = fragments.get(selection.name.value)
+            if fragment is not None:
+                yield from iter_fields(fragment.selection_set, fragments)
+
+
+def connection_node_fields(field_node, fragments):
+    """Return the fields selected under ``edges { node { ... } }``."""
+    selected = []
+    for edges in iter_fields(field_node.selection_set, fragments):
+        if edges.name.value != "edges":
+            continue
+        for node in iter_fields(edges.selection_set, fragments):
+            if node.name.value == "node":
+                selected.extend(iter_fields(node.selection_set, fragments))
+    return selected
+
+
+def related_fields(field_node, fragments):
+    """Return the fields selected on the items of a connection or a list."""
+    fields = list(iter_fields(field_node.selection_set, fragments))
+    if any(f.name.value == "edges" for f in fields):
+        return connection_node_fields(field_node, fragments)
+    return fields
+
+
+def has_filter_arguments(field_node):
+    return any(arg.name.value not in PAGINATION_ARGS for arg in field_node.arguments)
+
+
+class QueryPlan:
+    """The only/select_related/prefetch_related calls for one model."""
+
+    def __init__(self, model):
+        self.model = model
+        self.only = {model._meta.pk.name}
+        self.select_related = set()
+        self.prefetch = {}
+
+    def apply(self, queryset):
+        queryset = queryset.only(*self.only)
+        if self.select_related:
+            queryset = queryset.select_related(*self.select_related)
+        if self.prefetch:
+            queryset = queryset.prefetch_related(*self.prefetch.values())
+        return queryset
+
+
+def build_plan(model, fields, fragments, plan=None, prefix=""):
+    """
+    Walk the selected ``fields`` of ``model`` and record what to load.
+
+    Forward foreign keys are joined with select_related and restricted with
+    ``only("fk__column")``; reverse and many-to-many connections and lists
+    become a Prefetch whose queryset is planned recursively.
+    """
+    if plan is None:
+        plan = QueryPlan(model)
+    for field_node in fields:
+        name = to_snake_case(field_node.name.value)
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            continue
+
+        if not field.is_relation:
+            plan.only.add(prefix + field.name)
+        elif field.concrete and (field.many_to_one or field.one_to_one):
+            plan.only.add(prefix + field.name)
+            plan.select_related.add(prefix + field.name)
+            build_plan(
+                field.related_model,
+                iter_fields(field_node.selection_set, fragments),
+                fragments,
+                plan=plan,
+                prefix=prefix + field.name + "__",
+            )
+        elif not prefix and not has_filter_arguments(field_node):
+            # Filtered nested connections are resolved with their own
+            # queryset, so a prefetch would never be used.
+            accessor = field.get_accessor_name() if field.auto_created else field.name
+            nested = build_plan(
+                field.related_model,
+                related_fields(field_node, fragments),
+                fragments,
+            )
+            if field.one_to_many:
+                nested.only.add(field.field.name)
+            queryset = nested.apply(field.related_model._default_manager.order_by("pk"))
+            plan.prefetch[accessor] = Prefetch(accessor, queryset=queryset)
+    return plan
+
+
+def optimize_queryset(queryset, info):
+    """Restrict a connection's queryset to the selection in ``info``."""
+    if not optimizer_enabled():
+        return queryset
+    fields = []
+    for field_node in info.field_nodes:
+        fields.extend(connection_node_fields(field_node, info.fragments))
+    if not fields:
+        return queryset
+    plan = build_plan(queryset.model, fields, info.fragments)
+    return plan.apply(queryset)
+
+
+def ensure_loaded(queryset, *names):
+    """Add ``names`` to the columns kept by an earlier only() call."""
+    immediate, defer = queryset.query.deferred_loading
+    if defer or not immediate:
+        return queryset
+    return queryset.only(*immediate, *names)
+
+
+def prefetched(instance, accessor):
+    """Return the prefetched list for ``accessor`` or None if not prefetched."""
+    cache = getattr(instance, "_prefetched_objects_cache", {})
+    if accessor not in cache:
+        return None
+    return list(cache[accessor])
@@ -0,0 +1,157 @@
+"""
+CRM Pub/Sub
+Topics feeding the GraphQL subscriptions, and the channel layer that
+carries their messages.
+
+Model signals publish small messages (``{"pks": [...]}``) once the writing
+transaction commits. The channel layer delivers a topic's messages to
+every event loop subscribed to it. Within an event loop all subscribers of
+a topic share one ``Topic``: it holds the only channel layer subscription,
+runs ``load`` once per message (fetching the changed rows; messages that
+arrived meanwhile are merged into one load) and hands the rows to each
+listener's queue, so the cost of an event does not grow with the number
+of subscribers. A listener that falls more than ``QUEUE_SIZE`` events
+behind loses its oldest events.
+
+``InMemoryChannelLayer`` connects the threads and event loops of one
+process, which is enough for a single ASGI process and for local testing;
+deployments running several processes plug in a layer with the same
+``publish`` / ``subscribe`` / ``unsubscribe`` methods backed by a broker.
+
+Configured by ``CRM_SUBSCRIPTIONS``:
+
+- ``CHANNEL_LAYER``: dotted path of the channel layer class
+- ``QUEUE_SIZE``: events buffered per subscriber
+- ``CONNECTION_INIT_TIMEOUT``: seconds a WebSocket client has to send
+  ``connection_init`` (``crm.websocket``)
+"""
+
+import asyncio
+import threading
+import weakref
+from collections import defaultdict
+from contextlib import asynccontextmanager
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+DEFAULTS = {
+    "CHANNEL_LAYER": "crm.pubsub.InMemoryChannelLayer",
+    "QUEUE_SIZE": 100,
+    "CONNECTION_INIT_TIMEOUT": 10,
+}
+
+ORDER_CREATED = "orders.created"
+PRODUCT_STOCK_CHANGED = "products.stock"
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, "CRM_SUBSCRIPTIONS", {})}
+
+
+class InMemoryChannelLayer:
+    """Delivers messages to subscribers in this process, from any thread."""
+
+    def __init__(self):
+        self.subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def publish(self, topic, message):
+        with self._lock:
+            subscribers = list(self.subscribers[topic])
+        for subscriber in subscribers:
+            loop, callback = subscriber
+            try:
+                loop.call_soon_threadsafe(callback, message)
+            except RuntimeError:
+                # The subscriber's event loop has been closed.
+                self.unsubscribe(topic, subscriber)
+
+    def subscribe(self, topic, callback):
+        """Call ``callback(message)`` on the running event loop; returns a token."""
+        subscriber = (asyncio.get_running_loop(), callback)
+        with self._lock:
+            self.subscribers[topic].add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, topic, token):
+        with self._lock:
+            self.subscribers[topic].discard(token)
+
+
+_layer = None
+_layer_lock = threading.Lock()
+
+
+def get_channel_layer():
+    global _layer
+    with _layer_lock:
+        if _layer is None:
+            _layer = import_string(get_config()["CHANNEL_LAYER"])()
+        return _layer
+
+
+def publish(topic, message):
+    get_channel_layer().publish(topic, message)
+
+
+class Topic:
+    """The subscribers of one topic on one event loop."""
+
+    def __init__(self, name, load):
+        self.name = name
+        self.load = load
+        self.listeners = set()
+        self.inbox = asyncio.Queue()
+        self.token = None
+        self.task = None
+
+    def add(self, queue):
+        self.listeners.add(queue)
+        if self.task is None:
+            self.token = get_channel_layer().subscribe(self.name, self.inbox.put_nowait)
+            self.task = asyncio.get_running_loop().create_task(self.fan_out())
+
+    def remove(self, queue):
+        self.listeners.discard(queue)
+        if not self.listeners and self.task is not None:
+            get_channel_layer().unsubscribe(self.name, self.token)
+            self.task.cancel()
+            self.task = None
+            self.inbox = asyncio.Queue()
+
+    async def fan_out(self):
+        while True:
+            pks = dict.fromkeys((await self.inbox.get())["pks"])
+            while not self.inbox.empty():
+                pks.update(dict.fromkeys(self.inbox.get_nowait()["pks"]))
+            try:
+                event = await self.load(list(pks))
+            except Exception:
+                # A failed load drops this event, not the subscriptions.
+                continue
+            for queue in list(self.listeners):
+                if queue.full():
+                    queue.get_nowait()
+                queue.put_nowait(event)
+
+
+_topics = weakref.WeakKeyDictionary()
+
+
+@asynccontextmanager
+async def listen(name, load):
+    """
+    Yield a queue receiving ``await load(pks)`` for the pks of each message
+    published to topic ``name`` while the block runs.
+    """
+    topics = _topics.setdefault(asyncio.get_running_loop(), {})
+    topic = topics.get(name)
+    if topic is None:
+        topic = topics[name] = Topic(name, load)
+    queue = asyncio.Queue(maxsize=get_config()["QUEUE_SIZE"])
+    topic.add(queue)
+    try:
+        yield queue
+    finally:
+        topic.remove(queue)
@@ -0,0 +1,257 @@
+"""
+CRM Response Cache
+Caches the data of read-only GraphQL operations, tagged by the models they
+read. Each model tag carries a version number that signals bump on writes;
+versions are part of the cache key, so a write makes every entry that read
+that model unreachable and leaves entries for other models untouched.
+
+Configured by ``CRM_RESPONSE_CACHE``:
+
+- ``ENABLED``: turn caching on or off
+- ``BACKEND``: ``"django"`` (``CACHE_ALIAS``) or ``"lru"`` (in-process)
+- ``MAX_SIZE``: LRU capacity; ``TIMEOUT``: entry lifetime in seconds
+- ``ROOT_FIELDS``: root query fields whose results may be cached
+
+The tag versions must be seen by every process that writes: web workers,
+``run_jobs`` and management commands such as ``seed_data``. The
+``"django"`` backend keeps them in a cache all of these share. The
+``"lru"`` backend keeps them in memory and is only safe when a single
+process serves and writes; elsewhere, entries read data written by other
+processes until ``TIMEOUT`` expires them.
+"""
+
+import hashlib
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from graphql import TypeInfo, TypeInfoVisitor, Visitor, get_named_type, visit
+from graphql.language import (
+    FieldNode,
+    FragmentDefinitionNode,
+    InlineFragmentNode,
+    OperationDefinitionNode,
+)
+
+from crm.documents import LRUCache
+
+DEFAULTS = {
+    "ENABLED": True,
+    "BACKEND": "django",
+    "CACHE_ALIAS": "default",
+    "MAX_SIZE": 1000,
+    "TIMEOUT": 300,
+    "ROOT_FIELDS": [
+        "allCustomers",
+        "allProducts",
+        "allOrders",
+        "customer",
+        "product",
+        "order",
+    ],
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, "CRM_RESPONSE_CACHE", {})}
+
+
+def model_tag(model):
+    return model._meta.label_lower
+
+
+class LRUBackend:
+    def __init__(self, max_size):
+        self.entries = LRUCache(max_size)
+        self.versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires is not None and expires <= time.monotonic():
+            return None
+        return value
+
+    def set(self, key, value, timeout):
+        expires = None if timeout is None else time.monotonic() + timeout
+        self.entries.set(key, (expires, value))
+
+    def get_versions(self, tags):
+        return {tag: self.versions.get(tag, 0) for tag in tags}
+
+    def bump(self, tag):
+        with self._lock:
+            self.versions[tag] = self.versions.get(tag, 0) + 1
+
+    def clear(self):
+        self.entries.clear()
+        self.versions.clear()
+
+
+class DjangoCacheBackend:
+    """Entries and tag versions in a Django cache shared by all workers."""
+
+    prefix = "crm:response:"
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get(self, key):
+        return self.cache.get(self.prefix + key)
+
+    def set(self, key, value, timeout):
+        self.cache.set(self.prefix + key, value, timeout)
+
+    def get_versions(self, tags):
+        keys = {self.prefix + "tag:" + tag: tag for tag in tags}
+        found = self.cache.get_many(list(keys))
+        return {tag: found.get(key, 0) for key, tag in keys.items()}
+
+    def bump(self, tag):
+        key = self.prefix + "tag:" + tag
+        self.cache.add(key, 0, None)
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            self.cache.set(key, 1, None)
+
+    def clear(self):
+        self.cache.clear()
+
+
+class ResponseCache:
+    def __init__(self, backend, timeout):
+        self.backend = backend
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def make_key(self, query_hash, operation_name, variables, tags):
+        versions = self.backend.get_versions(sorted(tags))
+        payload = json.dumps(
+            [query_hash, operation_name, variables, versions],
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key):
+        value = self.backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, data):
+        self.backend.set(key, data, self.timeout)
+
+    def invalidate(self, *models):
+        for model in models:
+            self.backend.bump(model_tag(model))
+        with self._lock:
+            self.invalidations += len(models)
+
+    def clear(self):
+        self.backend.clear()
+        with self._lock:
+            self.hits = self.misses = self.invalidations = 0
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+        }
+
+
+def build_response_cache():
+    config = get_config()
+    if config["BACKEND"] == "django":
+        backend = DjangoCacheBackend(config["CACHE_ALIAS"])
+    else:
+        backend = LRUBackend(config["MAX_SIZE"])
+    return ResponseCache(backend, config["TIMEOUT"])
+
+
+response_cache = build_response_cache()
+
+
+def root_field_names(selection_set, fragments, expanding=frozenset()):
+    """
+    Yield the root field names of a selection set, expanding fragments;
+    None stands for a fragment that cannot be expanded.
+    """
+    for selection in selection_set.selections:
+        if isinstance(selection, FieldNode):
+            yield selection.name.value
+        elif isinstance(selection, InlineFragmentNode):
+            yield from root_field_names(selection.selection_set, fragments, expanding)
+        else:
+            name = selection.name.value
+            if name not in fragments or name in expanding:
+                yield None
+            else:
+                yield from root_field_names(
+                    fragments[name].selection_set, fragments, expanding | {name}
+                )
+
+
+def operation_tags(schema, document, operation_name=None):
+    """
+    Return the model tags read by an operation, or None if it must not be
+    cached (not a query, or a root field outside ``ROOT_FIELDS``).
+    """
+    operations = [
+        d for d in document.definitions if isinstance(d, OperationDefinitionNode)
+    ]
+    if operation_name:
+        operations = [
+            o for o in operations if o.name and o.name.value == operation_name
+        ]
+    if len(operations) != 1 or operations[0].operation.value != "query":
+        return None
+    operation = operations[0]
+
+    allowed = set(get_config()["ROOT_FIELDS"])
+    fragments = {
+        d.name.value: d
+        for d in document.definitions
+        if isinstance(d, FragmentDefinitionNode)
+    }
+    root_fields = list(root_field_names(operation.selection_set, fragments))
+    if not root_fields or any(name not in allowed for name in root_fields):
+        return None
+
+    tags = set()
+    type_info = TypeInfo(schema)
+
+    class TagCollector(Visitor):
+        def enter_field(self, node, *args):
+            named = get_named_type(type_info.get_type())
+            graphene_type = getattr(named, "graphene_type", None)
+            meta = getattr(graphene_type, "_meta", None)
+            # Connections read the model of their node, e.g. for totalCount.
+            node = getattr(meta, "node", None)
+            if node is not None:
+                meta = getattr(node, "_meta", None)
+            model = getattr(meta, "model", None)
+            if model is not None:
+                tags.add(model_tag(model))
+
+    # Visit the whole document so fragment definitions are included; a
+    # fragment used by another operation can only add tags, never hide one.
+    visit(document, TypeInfoVisitor(type_info, TagCollector()))
+    return tags
@@ -0,0 +1,252 @@
+"""
+CRM Database Routing
+Sends the reads of GraphQL queries to read replicas and everything else to
+the primary, with read-your-writes stickiness.
+
+Reads go to a replica only inside ``route_operation`` for a query
+operation or inside ``use_replica()``; mutations, jobs and management commands always use the
+primary, as does code wrapped in ``use_primary()``. A request that wrote to
+the primary gets a cookie pinning its client's reads to the primary for
+``STICKY_SECONDS``, long enough for the replicas to catch up. A replica's
+health is checked at most once per ``HEALTH_CHECK_INTERVAL`` seconds; a
+replica that failed its check, or raised an ``OperationalError`` on a
+read, is skipped until the next one. An operation whose read failed on a
+replica is run again on the primary.
+
+Configured by ``CRM_DATABASE_ROUTING``:
+
+- ``PRIMARY``: alias of the primary database
+- ``REPLICAS``: aliases of the read replicas (none disables routing)
+- ``STICKY_SECONDS``: how long reads stay on the primary after a write
+- ``COOKIE``: name of the stickiness cookie
+- ``HEALTH_CHECK_INTERVAL``: seconds between checks of a replica
+"""
+
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DatabaseError, OperationalError, connections
+from django.utils.connection import ConnectionDoesNotExist
+from graphql import OperationType
+
+DEFAULTS = {
+    "PRIMARY": "default",
+    "REPLICAS": [],
+    "STICKY_SECONDS": 10,
+    "COOKIE": "crm_read_primary",
+    "HEALTH_CHECK_INTERVAL": 30,
+}
+
+PRIMARY = "primary"
+REPLICA = "replica"
+
+current_route = ContextVar("crm_db_route", default=None)
+request_state = ContextVar("crm_db_request_state", default=None)
+operation_route = ContextVar("crm_db_operation_route", default=None)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, "CRM_DATABASE_ROUTING", {})}
+
+
+class RequestState:
+    """Mutable so writes made in ``sync_to_async`` threads are seen here."""
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+
+
+class OperationRoute:
+    """Mutable so failures seen in ``sync_to_async`` threads are seen here."""
+
+    def __init__(self):
+        self.replica_failed = False
+
+
+class ReplicaHealth:
+    """The last health check of each replica, trusted for ``interval`` seconds."""
+
+    def __init__(self):
+        # alias -> (available, monotonic time of the next check)
+        self.checked = {}
+
+    def available(self, alias, interval):
+        now = time.monotonic()
+        checked = self.checked.get(alias)
+        if checked is not None and checked[1] > now:
+            return checked[0]
+        available = self.check(alias)
+        self.checked[alias] = (available, now + interval)
+        return available
+
+    def mark_unavailable(self, alias, interval):
+        self.checked[alias] = (False, time.monotonic() + interval)
+
+    def check(self, alias):
+        try:
+            connection = connections[alias]
+        except ConnectionDoesNotExist:
+            return False
+        try:
+            connection.ensure_connection()
+            if connection.is_usable():
+                return True
+        except DatabaseError:
+            pass
+        connection.close()
+        return False
+
+
+replica_health = ReplicaHealth()
+
+
+def replica_error_wrapper(execute, sql, params, many, context):
+    """
+    Mark a replica unhealthy on the first ``OperationalError`` of a read, so
+    later reads go to the primary, and flag the operation for a retry there.
+    """
+    try:
+        return execute(sql, params, many, context)
+    except OperationalError:
+        alias = context["connection"].alias
+        config = get_config()
+        if alias in config["REPLICAS"]:
+            replica_health.mark_unavailable(alias, config["HEALTH_CHECK_INTERVAL"])
+            route = operation_route.get()
+            if route is not None:
+                route.replica_failed = True
+        raise
+
+
+def install_replica_wrapper(connection, **kwargs):
+    """``connection_created`` receiver adding ``replica_error_wrapper`` once."""
+    if replica_error_wrapper not in connection.execute_wrappers:
+        # Outermost, so errors raised by the other wrappers are seen too.
+        connection.execute_wrappers.insert(0, replica_error_wrapper)
+
+
+def choose_replica(config):
+    replicas = list(config["REPLICAS"])
+    random.shuffle(replicas)
+    for alias in replicas:
+        if replica_health.available(alias, config["HEALTH_CHECK_INTERVAL"]):
+            return alias
+    return None
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        config = get_config()
+        primary = config["PRIMARY"]
+        if current_route.get() != REPLICA or not config["REPLICAS"]:
+            return primary
+        state = request_state.get()
+        if state is not None and (state.pinned or state.wrote):
+            return primary
+        return choose_replica(config) or primary
+
+    def db_for_write(self, model, **hints):
+        state = request_state.get()
+        if state is not None:
+            state.wrote = True
+        return get_config()["PRIMARY"]
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas receive the schema through replication.
+        return db not in get_config()["REPLICAS"]
+
+
+@contextmanager
+def use_primary():
+    token = current_route.set(PRIMARY)
+    try:
+        yield
+    finally:
+        current_route.reset(token)
+
+
+@contextmanager
+def use_replica():
+    token = current_route.set(REPLICA)
+    try:
+        yield
+    finally:
+        current_route.reset(token)
+
+
+@contextmanager
+def route_operation(operation_ast):
+    """
+    Route the reads of a query operation to a replica. Yields the
+    ``OperationRoute``, whose ``replica_failed`` tells the caller to run the
+    operation again inside ``use_primary()``.
+    """
+    is_query = (
+        operation_ast is not None and operation_ast.operation == OperationType.QUERY
+    )
+    route = OperationRoute()
+    token = current_route.set(REPLICA if is_query else PRIMARY)
+    route_token = operation_route.set(route)
+    try:
+        yield route
+    finally:
+        operation_route.reset(route_token)
+        current_route.reset(token)
+
+
+class ReadYourWritesMiddleware:
+    """
+    Tracks whether a request wrote to the primary, and pins the reads of
+    requests carrying the stickiness cookie to the primary.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state, token = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            request_state.reset(token)
+        return self.finish(state, response)
+
+    async def __acall__(self, request):
+        state, token = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            request_state.reset(token)
+        return self.finish(state, response)
+
+    def start(self, request):
+        state = RequestState(pinned=get_config()["COOKIE"] in request.COOKIES)
+        return state, request_state.set(state)
+
+    def finish(self, state, response):
+        config = get_config()
+        if state.wrote and config["REPLICAS"]:
+            response.set_cookie(
+                config["COOKIE"],
+                "1",
+                max_age=config["STICKY_SECONDS"],
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
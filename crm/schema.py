@@ -1,38 +1,106 @@
-import re
+from decimal import Decimal
+
 import graphene
 from graphene_django import DjangoObjectType
 from django.db import transaction
-from django.core.exceptions import ValidationError
-from graphene_django.filter import DjangoFilterConnectionField
+from graphql_relay import from_global_id
 
 from crm.models import Customer
 from crm.models import Product
 from crm.models import Order
+from crm.models import OrderLine
+from crm.models import Job
+from crm.models import CustomerSales, DailySales, ProductSales
+from crm import analytics, jobs, services, tasks
+from crm.idempotency import idempotent, key_argument
 from crm.filters import CustomerFilter, ProductFilter, OrderFilter
+from crm.fields import (
+    BatchedConnectionField,
+    CountableConnection,
+    KeysetConnectionField,
+    resolve_related_list,
+)
+from crm.loaders import get_loaders
+from crm.documents import document_cache
+from crm.response_cache import response_cache
 
 
 # ==========================
 # GraphQL Types
 # ==========================
 class CustomerType(DjangoObjectType):
+    orders = BatchedConnectionField(lambda: OrderType, required=True)
+
     class Meta:
         model = Customer
         interfaces = (graphene.relay.Node,)
         filterset_class = CustomerFilter  # connect custom filter
+        connection_class = CountableConnection
+
+    def resolve_orders(self, info, **kwargs):
+        return resolve_related_list(self, info, kwargs, "orders", "customer_orders")
 
 
 class ProductType(DjangoObjectType):
+    orders = BatchedConnectionField(lambda: OrderType, required=True)
+
     class Meta:
         model = Product
         interfaces = (graphene.relay.Node,)
         filterset_class = ProductFilter  # connect custom filter
+        connection_class = CountableConnection
+
+    def resolve_orders(self, info, **kwargs):
+        return resolve_related_list(self, info, kwargs, "orders", "product_orders")
+
+
+class OrderLineType(DjangoObjectType):
+    class Meta:
+        model = OrderLine
+        fields = ("product", "quantity", "unit_price")
 
 
 class OrderType(DjangoObjectType):
+    products = BatchedConnectionField(ProductType, required=True)
+    lines = graphene.List(graphene.NonNull(OrderLineType), required=True)
+
     class Meta:
         model = Order
         interfaces = (graphene.relay.Node,)
         filterset_class = OrderFilter  # connect custom filter
+        connection_class = CountableConnection
+
+    def resolve_customer(self, info):
+        loaders = get_loaders(info)
+        if loaders is None or Order.customer.is_cached(self):
+            return self.customer
+        return loaders.customer.load(self.customer_id)
+
+    def resolve_products(self, info, **kwargs):
+        return resolve_related_list(self, info, kwargs, "products", "order_products")
+
+    def resolve_lines(self, info):
+        return resolve_related_list(self, info, {}, "lines", "order_lines")
+
+
+class JobType(DjangoObjectType):
+    class Meta:
+        model = Job
+        interfaces = (graphene.relay.Node,)
+        fields = (
+            "id",
+            "name",
+            "queue",
+            "status",
+            "attempts",
+            "max_attempts",
+            "run_at",
+            "result",
+            "error",
+            "created_at",
+            "started_at",
+            "finished_at",
+        )
 
 
 # ==========================
@@ -44,6 +112,29 @@ class CustomerInput(graphene.InputObjectType):
     phone = graphene.String()
 
 
+class ProductInput(graphene.InputObjectType):
+    name = graphene.String(required=True)
+    price = graphene.Float(required=True)
+    stock = graphene.Int()
+
+
+class OrderItemInput(graphene.InputObjectType):
+    product_id = graphene.ID(required=True)
+    quantity = graphene.Int(default_value=1)
+
+
+class OrderInput(graphene.InputObjectType):
+    customer_id = graphene.ID(required=True)
+    product_ids = graphene.List(graphene.ID, required=True)
+
+
+class ChunkResult(graphene.ObjectType):
+    index = graphene.Int()
+    created = graphene.Int()
+    ids = graphene.List(graphene.ID)
+    errors = graphene.List(graphene.String)
+
+
 # ==========================
 # Mutations
 # ==========================
@@ -52,15 +143,17 @@ class CreateCustomer(graphene.Mutation):
         name = graphene.String(required=True)
         email = graphene.String(required=True)
         phone = graphene.String(required=False)
+        idempotency_key = key_argument()
 
     customer = graphene.Field(CustomerType)
     message = graphene.String()
 
+    @idempotent
     def mutate(self, info, name, email, phone=None):
         if Customer.objects.filter(email=email).exists():
             raise Exception("Email already exists")
 
-        if phone and not re.match(r"^\+?\d{7,15}$|^\d{3}-\d{3}-\d{4}$", phone):
+        if phone and not services.PHONE_RE.match(phone):
             raise Exception("Invalid phone format. Use +1234567890 or 123-456-7890")
 
         customer = Customer.objects.create(name=name, email=email, phone=phone)
@@ -69,34 +162,49 @@ class CreateCustomer(graphene.Mutation):
         )
 
 
+class OnConflict(graphene.Enum):
+    ERROR = services.ON_CONFLICT_ERROR
+    IGNORE = services.ON_CONFLICT_IGNORE
+    UPDATE = services.ON_CONFLICT_UPDATE
+
+
 class BulkCreateCustomers(graphene.Mutation):
     class Arguments:
         customers = graphene.List(CustomerInput, required=True)
+        on_conflict = OnConflict(default_value=OnConflict.ERROR.value)
+        chunk_size = graphene.Int(default_value=services.DEFAULT_CHUNK_SIZE)
+        background = graphene.Boolean(default_value=False)
+        idempotency_key = key_argument()
 
     customers = graphene.List(CustomerType)
     errors = graphene.List(graphene.String)
+    job = graphene.Field(JobType)
 
+    @idempotent
     @transaction.atomic
-    def mutate(self, info, customers):
-        created = []
-        errors = []
-
-        for c in customers:
-            try:
-                if Customer.objects.filter(email=c.email).exists():
-                    raise ValidationError(f"Email already exists: {c.email}")
-                if c.phone and not re.match(
-                    r"^\+?\d{7,15}$|^\d{3}-\d{3}-\d{4}$", c.phone
-                ):
-                    raise ValidationError(f"Invalid phone: {c.phone}")
-
-                customer = Customer.objects.create(
-                    name=c.name, email=c.email, phone=c.phone
-                )
-                created.append(customer)
-            except Exception as e:
-                errors.append(str(e))
-
+    def mutate(self, info, customers, on_conflict, chunk_size, background):
+        if chunk_size < 1:
+            raise Exception("chunkSize must be positive")
+
+        if background:
+            job = jobs.enqueue(
+                tasks.bulk_create_customers,
+                {
+                    "customers": [
+                        {"name": c.name, "email": c.email, "phone": c.phone}
+                        for c in customers
+                    ],
+                    "on_conflict": getattr(on_conflict, "value", on_conflict),
+                    "chunk_size": chunk_size,
+                },
+            )
+            return BulkCreateCustomers(job=job)
+
+        created, errors = services.bulk_create_customers(
+            customers,
+            on_conflict=getattr(on_conflict, "value", on_conflict),
+            chunk_size=chunk_size,
+        )
         return BulkCreateCustomers(customers=created, errors=errors)
 
 
@@ -105,9 +213,11 @@ class CreateProduct(graphene.Mutation):
         name = graphene.String(required=True)
         price = graphene.Float(required=True)
         stock = graphene.Int(required=False, default_value=0)
+        idempotency_key = key_argument()
 
     product = graphene.Field(ProductType)
 
+    @idempotent
     def mutate(self, info, name, price, stock):
         if price <= 0:
             raise Exception("Price must be positive")
@@ -118,48 +228,96 @@ class CreateProduct(graphene.Mutation):
         return CreateProduct(product=product)
 
 
+class BulkCreateProducts(graphene.Mutation):
+    class Arguments:
+        products = graphene.List(ProductInput, required=True)
+        chunk_size = graphene.Int(default_value=services.DEFAULT_CHUNK_SIZE)
+
+    chunks = graphene.List(ChunkResult)
+    created = graphene.Int()
+
+    def mutate(self, info, products, chunk_size):
+        if chunk_size < 1:
+            raise Exception("chunkSize must be positive")
+
+        chunks = services.bulk_create_products(products, chunk_size=chunk_size)
+        return BulkCreateProducts(
+            chunks=chunks, created=sum(c["created"] for c in chunks)
+        )
+
+
 class CreateOrder(graphene.Mutation):
     class Arguments:
         customer_id = graphene.ID(required=True)
-        product_ids = graphene.List(graphene.ID, required=True)
+        product_ids = graphene.List(graphene.ID)
+        items = graphene.List(OrderItemInput)
+        idempotency_key = key_argument()
 
     order = graphene.Field(OrderType)
 
-    def mutate(self, info, customer_id, product_ids):
+    @idempotent
+    def mutate(self, info, customer_id, product_ids=None, items=None):
+        quantities = {}
+        for pk in product_ids or []:
+            quantities[str(pk)] = quantities.get(str(pk), 0) + 1
+        for item in items or []:
+            pk = str(item.product_id)
+            quantities[pk] = quantities.get(pk, 0) + item.quantity
+
         try:
-            customer = Customer.objects.get(pk=customer_id)
-        except Customer.DoesNotExist:
-            raise Exception("Invalid customer ID")
+            order = services.create_order(customer_id, quantities)
+        except services.OrderError as e:
+            raise Exception(str(e))
 
-        if not product_ids:
-            raise Exception("At least one product must be selected")
+        return CreateOrder(order=order)
 
-        products = Product.objects.filter(id__in=product_ids)
-        if products.count() != len(product_ids):
-            raise Exception("One or more invalid product IDs")
 
-        total_amount = sum([p.price for p in products])
+class BulkCreateOrders(graphene.Mutation):
+    class Arguments:
+        orders = graphene.List(OrderInput, required=True)
+        chunk_size = graphene.Int(default_value=services.DEFAULT_CHUNK_SIZE)
 
-        order = Order.objects.create(customer=customer, total_amount=total_amount)
-        order.products.set(products)
-        order.save()
+    chunks = graphene.List(ChunkResult)
+    created = graphene.Int()
 
-        return CreateOrder(order=order)
+    def mutate(self, info, orders, chunk_size):
+        if chunk_size < 1:
+            raise Exception("chunkSize must be positive")
+
+        chunks = services.bulk_create_orders(orders, chunk_size=chunk_size)
+        return BulkCreateOrders(
+            chunks=chunks, created=sum(c["created"] for c in chunks)
+        )
 
 
 class UpdateLowStockProducts(graphene.Mutation):
+    class Arguments:
+        threshold = graphene.Int(default_value=services.LOW_STOCK_THRESHOLD)
+        increment = graphene.Int(default_value=services.RESTOCK_INCREMENT)
+        background = graphene.Boolean(default_value=False)
+        idempotency_key = key_argument()
+
     products = graphene.List(lambda: ProductType)
     message = graphene.String()
-
-    def mutate(self, info):
-        # Find products with stock < 10
-        low_stock_products = Product.objects.filter(stock__lt=10)
-
-        updated_products = []
-        for product in low_stock_products:
-            product.stock += 10  # Simulate restocking
-            product.save()
-            updated_products.append(product)
+    job = graphene.Field(JobType)
+
+    @idempotent
+    def mutate(self, info, threshold, increment, background):
+        if threshold < 0:
+            raise Exception("Threshold cannot be negative")
+        if increment <= 0:
+            raise Exception("Increment must be positive")
+
+        if background:
+            job = jobs.enqueue(
+                tasks.restock_low_stock,
+                {"threshold": threshold, "increment": increment},
+            )
+            return UpdateLowStockProducts(job=job, message="Restock queued.")
+
+        updated_products = services.restock_low_stock(
+            threshold=threshold, increment=increment
+        )
 
         message = (
             "Low stock products updated successfully."
@@ -170,6 +328,70 @@ class UpdateLowStockProducts(graphene.Mutation):
         return UpdateLowStockProducts(products=updated_products, message=message)
 
 
+# ==========================
+# Analytics
+# ==========================
+class DailySalesType(DjangoObjectType):
+    class Meta:
+        model = DailySales
+        fields = ("date", "order_count", "revenue")
+
+
+class SalesSummaryType(graphene.ObjectType):
+    order_count = graphene.Int(required=True)
+    revenue = graphene.Decimal(required=True)
+    average_order_value = graphene.Decimal()
+    days = graphene.List(graphene.NonNull(DailySalesType), required=True)
+
+    def resolve_average_order_value(self, info):
+        if not self.order_count:
+            return None
+        return (self.revenue / self.order_count).quantize(Decimal("0.01"))
+
+
+class ProductSalesType(DjangoObjectType):
+    class Meta:
+        model = ProductSales
+        fields = ("product", "order_count", "units_sold", "revenue")
+
+
+class CustomerSalesType(DjangoObjectType):
+    average_order_value = graphene.Decimal()
+
+    class Meta:
+        model = CustomerSales
+        fields = (
+            "customer",
+            "order_count",
+            "total_spent",
+            "first_order_at",
+            "last_order_at",
+        )
+
+    def resolve_average_order_value(self, info):
+        if not self.order_count:
+            return None
+        return (self.total_spent / self.order_count).quantize(Decimal("0.01"))
+
+
+class TopProductsOrder(graphene.Enum):
+    REVENUE = "revenue"
+    UNITS_SOLD = "units_sold"
+    ORDER_COUNT = "order_count"
+
+
+# ==========================
+# Cache Statistics
+# ==========================
+class CacheStatsType(graphene.ObjectType):
+    name = graphene.String(required=True)
+    hits = graphene.Int(required=True)
+    misses = graphene.Int(required=True)
+    evictions = graphene.Int()
+    invalidations = graphene.Int()
+    size = graphene.Int()
+
+
 # ==========================
 # Queries
 # ==========================
@@ -178,9 +400,71 @@ class Query(graphene.ObjectType):
     product = graphene.relay.Node.Field(ProductType)
     order = graphene.relay.Node.Field(OrderType)
 
-    all_customers = DjangoFilterConnectionField(CustomerType)
-    all_products = DjangoFilterConnectionField(ProductType)
-    all_orders = DjangoFilterConnectionField(OrderType)
+    all_customers = KeysetConnectionField(CustomerType, sort_key="created_at")
+    all_products = KeysetConnectionField(ProductType, sort_key="id")
+    all_orders = KeysetConnectionField(OrderType, sort_key="order_date")
+
+    cache_stats = graphene.List(graphene.NonNull(CacheStatsType), required=True)
+    job_status = graphene.Field(JobType, id=graphene.ID(required=True))
+
+    sales_summary = graphene.Field(
+        SalesSummaryType,
+        required=True,
+        date_from=graphene.Date(),
+        date_to=graphene.Date(),
+    )
+    top_products = graphene.List(
+        graphene.NonNull(ProductSalesType),
+        required=True,
+        first=graphene.Int(default_value=10),
+        order_by=TopProductsOrder(default_value=TopProductsOrder.REVENUE.value),
+    )
+    customer_lifetime_value = graphene.Field(
+        CustomerSalesType, customer_id=graphene.ID(required=True)
+    )
+
+    def resolve_job_status(root, info, id):
+        return graphene.relay.Node.get_node_from_global_id(info, id, only_type=JobType)
+
+    def resolve_sales_summary(root, info, date_from=None, date_to=None):
+        order_count, revenue, days = analytics.summarize(date_from, date_to)
+        return SalesSummaryType(order_count=order_count, revenue=revenue, days=days)
+
+    def resolve_top_products(root, info, first, order_by):
+        if not 1 <= first <= 100:
+            raise Exception("first must be between 1 and 100")
+        order_by = getattr(order_by, "value", order_by)
+        return list(
+            ProductSales.objects.select_related("product").order_by(
+                f"-{order_by}", "product_id"
+            )[:first]
+        )
+
+    def resolve_customer_lifetime_value(root, info, customer_id):
+        # A CustomerType global ID; anything else names no customer.
+        type_name, pk = from_global_id(customer_id)
+        if type_name != CustomerType._meta.name or not pk.isdigit():
+            return None
+        customer = Customer.objects.filter(pk=pk).first()
+        if customer is None:
+            return None
+        try:
+            return CustomerSales.objects.get(customer=customer)
+        except CustomerSales.DoesNotExist:
+            return CustomerSales(customer=customer, total_spent=Decimal("0.00"))
+
+    def resolve_cache_stats(root, info):
+        documents = document_cache.stats()
+        return [
+            CacheStatsType(
+                name="documents",
+                hits=documents["hits"],
+                misses=documents["misses"],
+                evictions=documents["evictions"],
+                size=documents["size"],
+            ),
+            CacheStatsType(name="responses", **response_cache.stats()),
+        ]
 
 
 # ==========================
@@ -190,7 +474,9 @@ class Mutation(graphene.ObjectType):
     create_customer = CreateCustomer.Field()
     bulk_create_customers = BulkCreateCustomers.Field()
     create_product = CreateProduct.Field()
+    bulk_create_products = BulkCreateProducts.Field()
     create_order = CreateOrder.Field()
+    bulk_create_orders = BulkCreateOrders.Field()
     update_low_stock_products = UpdateLowStockProducts.Field()
 
 
@@ -0,0 +1,125 @@
+"""
+CRM Search
+Pluggable substring search behind the name filters in crm.filters.
+
+- ``fts5``: SQLite FTS5 table with the trigram tokenizer (migration 0004)
+- ``trigram``: PostgreSQL pg_trgm similarity over a GIN trigram index
+- ``icontains``: plain ``LIKE '%x%'``, used as the fallback everywhere
+
+Set ``CRM_SEARCH_BACKEND`` to one of the names above, or ``auto`` (default)
+to pick the best backend for the database serving the queryset.
+"""
+
+from django.conf import settings
+from django.db import connections
+from django.db.models.expressions import RawSQL
+
+from crm.models import Customer
+
+CUSTOMER_FTS_TABLE = "crm_customer_fts"
+
+# Trigram indexes cannot match fewer than three characters.
+MIN_TRIGRAM_LENGTH = 3
+
+
+class IContainsBackend:
+    name = "icontains"
+
+    def search(self, queryset, field, value, rank=True):
+        return queryset.filter(**{f"{field}__icontains": value})
+
+
+class SQLiteFTSBackend(IContainsBackend):
+    """Customer name search through the ``crm_customer_fts`` FTS5 table."""
+
+    name = "fts5"
+
+    def search(self, queryset, field, value, rank=True):
+        if (
+            queryset.model is not Customer
+            or field != "name"
+            or len(value) < MIN_TRIGRAM_LENGTH
+        ):
+            return super().search(queryset, field, value)
+
+        # A quoted phrase makes the trigram tokenizer match a substring.
+        phrase = '"{}"'.format(value.replace('"', '""'))
+        if not rank:
+            return queryset.filter(
+                pk__in=RawSQL(
+                    f"SELECT rowid FROM {CUSTOMER_FTS_TABLE} "
+                    f"WHERE {CUSTOMER_FTS_TABLE} MATCH %s",
+                    [phrase],
+                )
+            )
+
+        # Join the FTS table so bm25 rank is read once per matching row.
+        table = Customer._meta.db_table
+        return queryset.extra(
+            tables=[CUSTOMER_FTS_TABLE],
+            where=[
+                f"{CUSTOMER_FTS_TABLE} MATCH %s",
+                f'{CUSTOMER_FTS_TABLE}.rowid = "{table}"."id"',
+            ],
+            params=[phrase],
+            select={"search_rank": f"{CUSTOMER_FTS_TABLE}.rank"},
+        ).order_by("search_rank", "pk")
+
+
+class PostgresTrigramBackend(IContainsBackend):
+    """ILIKE served by a GIN ``gin_trgm_ops`` index, ranked by similarity."""
+
+    name = "trigram"
+
+    def search(self, queryset, field, value, rank=True):
+        queryset = super().search(queryset, field, value)
+        if rank and len(value) >= MIN_TRIGRAM_LENGTH:
+            from django.contrib.postgres.search import TrigramSimilarity
+
+            queryset = queryset.annotate(
+                search_rank=TrigramSimilarity(field, value)
+            ).order_by("-search_rank", "pk")
+        return queryset
+
+
+BACKENDS = {
+    backend.name: backend
+    for backend in (IContainsBackend(), SQLiteFTSBackend(), PostgresTrigramBackend())
+}
+
+_fts_tables = {}
+
+
+def has_fts_table(connection):
+    """Whether migration 0004 managed to create the FTS5 table on this database."""
+    if connection.alias not in _fts_tables:
+        with connection.cursor() as cursor:
+            tables = connection.introspection.table_names(cursor)
+        _fts_tables[connection.alias] = CUSTOMER_FTS_TABLE in tables
+    return _fts_tables[connection.alias]
+
+
+def get_backend(queryset):
+    """Return the search backend for the database ``queryset`` reads from."""
+    connection = connections[queryset.db]
+    name = getattr(settings, "CRM_SEARCH_BACKEND", "auto")
+    if name == "auto":
+        if connection.vendor == "postgresql":
+            name = PostgresTrigramBackend.name
+        elif connection.vendor == "sqlite":
+            name = SQLiteFTSBackend.name
+        else:
+            name = IContainsBackend.name
+
+    if name == SQLiteFTSBackend.name and not (
+        connection.vendor == "sqlite" and has_fts_table(connection)
+    ):
+        name = IContainsBackend.name
+    if name == PostgresTrigramBackend.name and connection.vendor != "postgresql":
+        name = IContainsBackend.name
+    return BACKENDS[name]
+
+
+def search(queryset, field, value, rank=True):
+    """Filter ``queryset`` to rows whose ``field`` contains ``value``."""
+    return get_backend(queryset).search(queryset, field, value, rank=rank)
@@ -7,7 +7,7 @@ from datetime import datetime
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "alx_backend_graphql_crm.settings")
 django.setup()
 
-from crm.models import Customer, Product, Order
+from crm.models import Customer, Product, Order, OrderLine
 
 
 def seed_customers():
@@ -58,7 +58,10 @@ def seed_orders():
         order = Order.objects.create(
             customer=customer, total_amount=total_amount, order_date=datetime.now()
         )
-        order.products.set(selected_products)
+        OrderLine.objects.bulk_create(
+            OrderLine(order=order, product=p, unit_price=p.price)
+            for p in selected_products
+        )
         print(f"Created order {order.id} for {customer.name} (${total_amount:.2f})")
 
 
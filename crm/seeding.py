@@ -0,0 +1,255 @@
+"""
+CRM Seeding
+Generates large synthetic datasets for reproducing production-scale
+performance locally.
+
+The generator is deterministic: the same seed, sizes and ``end`` date
+produce the same customers, products, orders and order lines. Rows are
+produced lazily and written in chunks of ``batch_size`` with
+``bulk_create`` (orders, then their ``OrderLine`` rows), one transaction
+per chunk, so memory stays bounded by a chunk plus the customer and
+product keys; ``Seeder.run`` yields progress after every chunk.
+
+Popularity is skewed the way real order histories are: customers and
+products are drawn from a Zipf distribution over a shuffled ranking, so a
+few customers place many orders and a few products dominate sales; order
+dates lean towards ``end``. The sales summaries are rebuilt once at the
+end instead of being maintained per chunk.
+"""
+
+import random
+from array import array
+from bisect import bisect
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.color import no_style
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from crm import analytics
+from crm.models import (
+    Customer,
+    CustomerSales,
+    DailySales,
+    Order,
+    OrderLine,
+    Product,
+    ProductSales,
+)
+from crm.services import chunked
+from crm.signals import bulk_changed
+
+FIRST_NAMES = [
+    "Alice", "Bob", "Carol", "David", "Malika", "Yusuf", "Ines", "Omar",
+    "Chloe", "Hugo", "Amina", "Lucas", "Sofia", "Karim", "Lea", "Noah",
+]  # fmt: skip
+LAST_NAMES = [
+    "Martin", "Stone", "Alison", "King", "Haddad", "Benali", "Moreau",
+    "Garcia", "Dubois", "Nguyen", "Rossi", "Smith", "Laurent", "Diallo",
+]  # fmt: skip
+ADJECTIVES = [
+    "Compact", "Wireless", "Pro", "Ultra", "Classic", "Smart", "Portable",
+    "Ergonomic", "Rugged", "Slim",
+]  # fmt: skip
+PRODUCT_KINDS = [
+    ("Laptop", 600, 2500), ("Phone", 150, 1200), ("Headphones", 20, 400),
+    ("Monitor", 120, 900), ("Keyboard", 15, 200), ("Mouse", 10, 120),
+    ("Tablet", 150, 1100), ("Speaker", 25, 500), ("Camera", 200, 2000),
+    ("Charger", 8, 80),
+]  # fmt: skip
+EMAIL_DOMAIN = "seed.example.com"
+
+# Zipf exponents: a long tail of occasional customers, a few hit products.
+CUSTOMER_SKEW = 0.6
+PRODUCT_SKEW = 1.1
+
+
+class Zipf:
+    """Draws items with probability proportional to ``1 / rank ** exponent``."""
+
+    def __init__(self, items, rng, exponent):
+        # Shuffled so popularity does not follow insertion order.
+        self.items = array("q", items)
+        rng.shuffle(self.items)
+        self.cumulative = array("d")
+        total = 0.0
+        for rank in range(1, len(self.items) + 1):
+            total += rank**-exponent
+            self.cumulative.append(total)
+
+    def draw(self, rng):
+        index = bisect(self.cumulative, rng.random() * self.cumulative[-1])
+        return self.items[min(index, len(self.items) - 1)]
+
+
+def generate_customers(rng, count, end, days):
+    span = days * 86400
+    for i in range(count):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        yield Customer(
+            name=f"{first} {last}",
+            email=f"{first.lower()}.{last.lower()}.{i}@{EMAIL_DOMAIN}",
+            phone=f"+1{rng.randrange(10**9, 10**10)}" if rng.random() < 0.7 else None,
+            created_at=end - timedelta(seconds=rng.randrange(span)),
+        )
+
+
+def generate_products(rng, count, end, days):
+    span = days * 86400
+    for i in range(count):
+        kind, low, high = rng.choice(PRODUCT_KINDS)
+        yield Product(
+            name=f"{rng.choice(ADJECTIVES)} {kind} {i}",
+            price=Decimal(rng.randrange(low * 100, high * 100)) / 100,
+            # One product in twenty is low on stock.
+            stock=rng.randrange(10) if rng.random() < 0.05 else rng.randrange(10, 500),
+            created_at=end - timedelta(seconds=rng.randrange(span)),
+        )
+
+
+def generate_orders(rng, count, customers, products, prices, end, days):
+    """Yield ``(order, [line, ...])`` pairs; lines are unsaved and unlinked."""
+    span = days * 86400
+    for _ in range(count):
+        wanted = min(len(products.items), 1 + int(rng.expovariate(0.8)))
+        quantities = {}
+        while len(quantities) < wanted:
+            quantities[products.draw(rng)] = 1 + int(rng.expovariate(1.5))
+        lines = [
+            OrderLine(product_id=pk, quantity=quantity, unit_price=prices[pk])
+            for pk, quantity in quantities.items()
+        ]
+        order = Order(
+            customer_id=customers.draw(rng),
+            total_amount=sum(line.amount for line in lines),
+            # Squaring leans the dates towards ``end``, as for a growing shop.
+            order_date=end - timedelta(seconds=int(span * rng.random() ** 2)),
+        )
+        yield order, lines
+
+
+def restore_order_dates(orders, dates):
+    """Set the dates that ``auto_now_add`` overwrote when ``orders`` were inserted."""
+    # One prepared UPDATE run per row; bulk_update's CASE is far slower here.
+    connection = connections[router.db_for_write(Order)]
+    qn = connection.ops.quote_name
+    opts = Order._meta
+    field = opts.get_field("order_date")
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"UPDATE {qn(opts.db_table)} SET {qn(field.column)} = %s "
+            f"WHERE {qn(opts.pk.column)} = %s",
+            [
+                (field.get_db_prep_save(order_date, connection), order.pk)
+                for order, order_date in zip(orders, dates)
+            ],
+        )
+    for order, order_date in zip(orders, dates):
+        order.order_date = order_date
+
+
+class Seeder:
+    """
+    Bulk-inserts ``customers``, ``products`` and ``orders`` generated from
+    ``seed``, with order dates in the ``days`` days before ``end``.
+    """
+
+    def __init__(
+        self,
+        customers,
+        products,
+        orders,
+        seed=0,
+        batch_size=5000,
+        end=None,
+        days=365,
+    ):
+        self.counts = {"customers": customers, "products": products, "orders": orders}
+        self.seed = seed
+        self.batch_size = batch_size
+        self.end = end or timezone.now().replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
+        self.days = days
+
+    def run(self):
+        """Insert everything, yielding ``(label, rows inserted, total)`` per chunk."""
+        rng = random.Random(self.seed)
+        customer_pks = yield from self.insert(
+            "customers",
+            generate_customers(rng, self.counts["customers"], self.end, self.days),
+        )
+        product_pks = yield from self.insert(
+            "products",
+            generate_products(rng, self.counts["products"], self.end, self.days),
+        )
+        if self.counts["orders"] and customer_pks and product_pks:
+            prices = {
+                pk: product.price
+                for pk, product in Product.objects.only("price")
+                .in_bulk(list(product_pks))
+                .items()
+            }
+            yield from self.insert_orders(
+                generate_orders(
+                    rng,
+                    self.counts["orders"],
+                    Zipf(customer_pks, rng, CUSTOMER_SKEW),
+                    Zipf(product_pks, rng, PRODUCT_SKEW),
+                    prices,
+                    self.end,
+                    self.days,
+                )
+            )
+        analytics.rebuild()
+        bulk_changed.send(sender=Seeder, models=[Customer, Product, Order, OrderLine])
+
+    def insert(self, label, objs):
+        pks = array("q")
+        for chunk in chunked(objs, self.batch_size):
+            model = type(chunk[0])
+            with transaction.atomic():
+                created = model.objects.bulk_create(chunk)
+            pks.extend(obj.pk for obj in created)
+            yield label, len(pks), self.counts[label]
+        return pks
+
+    def insert_orders(self, pairs):
+        inserted = 0
+        for chunk in chunked(pairs, self.batch_size):
+            orders = [order for order, _ in chunk]
+            dates = [order.order_date for order in orders]
+            with transaction.atomic():
+                Order.objects.bulk_create(orders)
+                restore_order_dates(orders, dates)
+                lines = []
+                for order, order_lines in chunk:
+                    for line in order_lines:
+                        line.order_id = order.pk
+                        lines.append(line)
+                OrderLine.objects.bulk_create(lines)
+            inserted += len(orders)
+            yield "orders", inserted, self.counts["orders"]
+
+
+def flush():
+    """Empty the customer, product, order and sales summary tables."""
+    # Model.delete() would load every row to send post_delete.
+    connection = connections[router.db_for_write(Order)]
+    tables = [
+        model._meta.db_table
+        for model in (
+            OrderLine,
+            Order,
+            Customer,
+            Product,
+            DailySales,
+            ProductSales,
+            CustomerSales,
+        )
+    ]
+    connection.ops.execute_sql_flush(
+        connection.ops.sql_flush(no_style(), tables, allow_cascade=True)
+    )
+    bulk_changed.send(sender=Seeder, models=[Customer, Product, Order, OrderLine])
@@ -0,0 +1,411 @@
+"""
+CRM Services
+Set-based write paths used by the GraphQL mutations.
+"""
+
+import re
+from collections import Counter
+from decimal import Decimal
+
+from django.db import DatabaseError, connections, router, transaction
+from django.db.models import Case, F, Value, When
+from django.db.models.sql import UpdateQuery
+
+from crm import analytics
+from crm.models import Customer, Order, OrderLine, Product
+from crm.signals import bulk_changed
+
+PHONE_RE = re.compile(r"^\+?\d{7,15}$|^\d{3}-\d{3}-\d{4}$")
+
+ON_CONFLICT_ERROR = "error"
+ON_CONFLICT_IGNORE = "ignore"
+ON_CONFLICT_UPDATE = "update"
+
+DEFAULT_CHUNK_SIZE = 1000
+
+LOW_STOCK_THRESHOLD = 10
+RESTOCK_INCREMENT = 10
+
+
+def chunked(items, size):
+    """Yield successive lists of at most ``size`` items from ``items``."""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def max_query_params(model):
+    """Largest number of parameters the model's database accepts in one query."""
+    connection = connections[router.db_for_read(model)]
+    return connection.features.max_query_params or 100000
+
+
+def parse_pk(value):
+    """Return ``value`` as an integer primary key, or None if it is not one."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def existing_emails(emails):
+    """Return the subset of ``emails`` already used by a customer."""
+    found = set()
+    for batch in chunked(emails, max_query_params(Customer)):
+        found.update(
+            Customer.objects.filter(email__in=batch).values_list("email", flat=True)
+        )
+    return found
+
+
+def bulk_create_customers(
+    rows, on_conflict=ON_CONFLICT_ERROR, chunk_size=DEFAULT_CHUNK_SIZE
+):
+    """
+    Insert customers with bulk_create and return ``(customers, errors)``.
+
+    ``rows`` are objects with ``name``, ``email`` and ``phone`` attributes.
+    Phones are validated in memory and existing emails are found with
+    ``email__in`` lookups instead of one query per row. ``on_conflict``
+    decides what happens to rows whose email already exists:
+
+    - ``error``: report the row as an error (default)
+    - ``ignore``: skip the row silently
+    - ``update``: overwrite the existing customer's name and phone
+    """
+    errors = []
+    valid = {}
+    for row in rows:
+        if row.phone and not PHONE_RE.match(row.phone):
+            errors.append(f"Invalid phone: {row.phone}")
+            continue
+        if row.email in valid:
+            errors.append(f"Duplicate email in input: {row.email}")
+            continue
+        valid[row.email] = Customer(name=row.name, email=row.email, phone=row.phone)
+
+    if on_conflict != ON_CONFLICT_UPDATE:
+        for email in existing_emails(list(valid)):
+            del valid[email]
+            if on_conflict == ON_CONFLICT_ERROR:
+                errors.append(f"Email already exists: {email}")
+
+    created = []
+    for chunk in chunked(valid.values(), chunk_size):
+        if on_conflict == ON_CONFLICT_UPDATE:
+            chunk = Customer.objects.bulk_create(
+                chunk,
+                update_conflicts=True,
+                unique_fields=["email"],
+                update_fields=["name", "phone"],
+            )
+        else:
+            chunk = Customer.objects.bulk_create(
+                chunk, ignore_conflicts=on_conflict == ON_CONFLICT_IGNORE
+            )
+        if any(customer.pk is None for customer in chunk):
+            # Backends that cannot return ids from conflict-handling inserts.
+            by_email = Customer.objects.in_bulk(
+                [customer.email for customer in chunk], field_name="email"
+            )
+            chunk = [by_email[c.email] for c in chunk if c.email in by_email]
+        created.extend(chunk)
+
+    if created:
+        bulk_changed.send(sender=Customer, models=[Customer])
+    return created, errors
+
+
+def run_chunks(rows, chunk_size, insert_chunk):
+    """
+    Feed ``rows`` to ``insert_chunk`` in chunks, one transaction per chunk.
+
+    ``insert_chunk(offset, chunk)`` returns ``(ids, errors)`` and reports
+    invalid rows as errors itself. A database error rolls back only the chunk
+    that raised it. Returns one result dict per chunk with its index, created
+    ids and errors.
+    """
+    results = []
+    for index, chunk in enumerate(chunked(rows, chunk_size)):
+        offset = index * chunk_size
+        try:
+            with transaction.atomic():
+                ids, errors = insert_chunk(offset, chunk)
+        except DatabaseError as e:
+            ids, errors = [], [f"Chunk {index} rolled back: {e}"]
+        results.append(
+            {"index": index, "created": len(ids), "ids": ids, "errors": errors}
+        )
+    return results
+
+
+def bulk_create_products(rows, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Insert products from objects with ``name``, ``price`` and ``stock``."""
+
+    def insert_chunk(offset, chunk):
+        errors = []
+        products = []
+        for position, row in enumerate(chunk, start=offset):
+            stock = row.stock or 0
+            if row.price <= 0:
+                errors.append(f"Row {position}: Price must be positive")
+            elif stock < 0:
+                errors.append(f"Row {position}: Stock cannot be negative")
+            else:
+                products.append(
+                    Product(name=row.name, price=Decimal(str(row.price)), stock=stock)
+                )
+        products = Product.objects.bulk_create(products)
+        if products:
+            bulk_changed.send(
+                sender=Product, models=[Product], pks=[p.pk for p in products]
+            )
+        return [p.pk for p in products], errors
+
+    return run_chunks(rows, chunk_size, insert_chunk)
+
+
+def bulk_create_orders(rows, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Insert orders from objects with ``customer_id`` and ``product_ids``.
+
+    A product id repeated in ``product_ids`` adds to its line's quantity.
+    As in ``create_order``, the chunk's products are locked with
+    select_for_update and a row ordering more than the stock left after the
+    rows before it is reported as an error. Each chunk costs two lookups
+    (customers, locked products), one ``F("stock") - CASE ...`` update and
+    two inserts (orders, then their ``OrderLine`` rows).
+    """
+
+    def insert_chunk(offset, chunk):
+        # Ids that are not integers become None, which no lookup below finds.
+        parsed = [
+            (parse_pk(row.customer_id), [parse_pk(pk) for pk in row.product_ids or []])
+            for row in chunk
+        ]
+        customer_ids = {customer_id for customer_id, _ in parsed} - {None}
+        product_ids = {pk for _, pks in parsed for pk in pks} - {None}
+        known_customers = set(
+            Customer.objects.filter(pk__in=customer_ids).values_list("pk", flat=True)
+        )
+        products = {
+            p.pk: p
+            for p in Product.objects.select_for_update()
+            .filter(pk__in=product_ids)
+            .only("pk", "name", "price", "stock")
+        }
+        prices = {pk: p.price for pk, p in products.items()}
+        remaining = {pk: p.stock for pk, p in products.items()}
+
+        errors = []
+        orders = []
+        order_quantities = []
+        for position, (customer_id, row_products) in enumerate(parsed, start=offset):
+            if customer_id not in known_customers:
+                errors.append(f"Row {position}: Invalid customer ID")
+            elif not row_products:
+                errors.append(f"Row {position}: At least one product must be selected")
+            elif any(pk not in prices for pk in row_products):
+                errors.append(f"Row {position}: One or more invalid product IDs")
+            else:
+                quantities = Counter(row_products)
+                short = [pk for pk, qty in quantities.items() if remaining[pk] < qty]
+                if short:
+                    name = products[short[0]].name
+                    errors.append(f"Row {position}: Insufficient stock for {name}")
+                    continue
+                for pk, qty in quantities.items():
+                    remaining[pk] -= qty
+                orders.append(
+                    Order(
+                        customer_id=customer_id,
+                        total_amount=sum(
+                            prices[pk] * qty for pk, qty in quantities.items()
+                        ),
+                    )
+                )
+                order_quantities.append(quantities)
+
+        ordered = {
+            pk: products[pk].stock - remaining[pk]
+            for pk in products
+            if remaining[pk] != products[pk].stock
+        }
+        if ordered:
+            Product.objects.filter(pk__in=ordered).update(
+                stock=F("stock")
+                - Case(*[When(pk=pk, then=Value(qty)) for pk, qty in ordered.items()])
+            )
+        orders = Order.objects.bulk_create(orders)
+        lines = OrderLine.objects.bulk_create(
+            OrderLine(
+                order_id=order.pk,
+                product_id=pk,
+                quantity=quantity,
+                unit_price=prices[pk],
+            )
+            for order, quantities in zip(orders, order_quantities)
+            for pk, quantity in quantities.items()
+        )
+        analytics.record_orders(orders)
+        analytics.record_lines(lines)
+        if orders:
+            bulk_changed.send(
+                sender=Order,
+                models=[Order, OrderLine],
+                pks=[order.pk for order in orders],
+            )
+            bulk_changed.send(sender=Product, models=[Product], pks=list(ordered))
+        return [order.pk for order in orders], errors
+
+    return run_chunks(rows, chunk_size, insert_chunk)
+
+
+def supports_update_returning(connection):
+    """True when ``UPDATE ... RETURNING`` is available on ``connection``."""
+    return (
+        connection.vendor in ("postgresql", "sqlite")
+        and connection.features.can_return_columns_from_insert
+    )
+
+
+def update_returning(queryset, values):
+    """
+    Run ``queryset.update(**values)`` as one ``UPDATE ... RETURNING`` statement
+    and return the updated rows as model instances.
+    """
+    model = queryset.model
+    db = queryset.db
+    connection = connections[db]
+    query = queryset.query.chain(UpdateQuery)
+    query.add_update_values(values)
+    sql, params = query.get_compiler(db).as_sql()
+
+    fields = model._meta.concrete_fields
+    columns = ", ".join(connection.ops.quote_name(f.column) for f in fields)
+    with connection.cursor() as cursor:
+        cursor.execute(f"{sql} RETURNING {columns}", params)
+        rows = cursor.fetchall()
+
+    names = [f.attname for f in fields]
+    cols = [f.get_col(model._meta.db_table) for f in fields]
+    converters = [
+        (
+            i,
+            col,
+            connection.ops.get_db_converters(col) + col.get_db_converters(connection),
+        )
+        for i, col in enumerate(cols)
+    ]
+    instances = []
+    for row in rows:
+        row = list(row)
+        for i, col, funcs in converters:
+            for func in funcs:
+                row[i] = func(row[i], col, connection)
+        instances.append(model.from_db(db, names, row))
+    return instances
+
+
+def restock_low_stock(
+    threshold=LOW_STOCK_THRESHOLD,
+    increment=RESTOCK_INCREMENT,
+    batch_size=DEFAULT_CHUNK_SIZE,
+):
+    """
+    Add ``increment`` to the stock of every product below ``threshold``.
+
+    The increment is applied with ``F("stock") + increment`` so concurrent
+    writes are never overwritten. Where the backend supports it the update
+    and the returned rows cost one ``UPDATE ... RETURNING`` statement;
+    otherwise the matching ids are locked and updated in batches.
+    """
+    low_stock = Product.objects.using(router.db_for_write(Product)).filter(
+        stock__lt=threshold
+    )
+    values = {"stock": F("stock") + increment}
+
+    with transaction.atomic():
+        if supports_update_returning(connections[low_stock.db]):
+            updated = sorted(update_returning(low_stock, values), key=lambda p: p.pk)
+        else:
+            ids = list(
+                low_stock.select_for_update()
+                .order_by("pk")
+                .values_list("pk", flat=True)
+            )
+            updated = []
+            for batch in chunked(ids, batch_size):
+                Product.objects.filter(pk__in=batch).update(**values)
+                updated.extend(Product.objects.filter(pk__in=batch).order_by("pk"))
+        if updated:
+            bulk_changed.send(
+                sender=Product, models=[Product], pks=[p.pk for p in updated]
+            )
+        return updated
+
+
+class OrderError(Exception):
+    pass
+
+
+def create_order(customer_id, quantities):
+    """
+    Create an order from ``{product_id: quantity}`` in a fixed number of queries.
+
+    The ordered products are locked with select_for_update, their stock is
+    decremented with a single ``F("stock") - CASE ...`` update and the total
+    is computed from the prices read under that lock, so the query count does
+    not grow with the basket size.
+    """
+    quantities = {str(pk): quantity for pk, quantity in quantities.items()}
+    if not quantities:
+        raise OrderError("At least one product must be selected")
+    if any(quantity < 1 for quantity in quantities.values()):
+        raise OrderError("Quantity must be positive")
+    if not Customer.objects.filter(pk=customer_id).exists():
+        raise OrderError("Invalid customer ID")
+    # GraphQL IDs arrive as strings; the customer loader is keyed by int pks.
+    customer_id = int(customer_id)
+
+    with transaction.atomic():
+        products = list(
+            Product.objects.select_for_update()
+            .filter(pk__in=quantities)
+            .only("pk", "name", "price", "stock")
+        )
+        if len(products) != len(quantities):
+            raise OrderError("One or more invalid product IDs")
+
+        quantities = {p.pk: quantities[str(p.pk)] for p in products}
+        for product in products:
+            if product.stock < quantities[product.pk]:
+                raise OrderError(f"Insufficient stock for {product.name}")
+
+        Product.objects.filter(pk__in=quantities).update(
+            stock=F("stock")
+            - Case(*[When(pk=pk, then=Value(qty)) for pk, qty in quantities.items()])
+        )
+        total_amount = sum(p.price * quantities[p.pk] for p in products)
+
+        order = Order.objects.create(customer_id=customer_id, total_amount=total_amount)
+        lines = OrderLine.objects.bulk_create(
+            OrderLine(
+                order_id=order.pk,
+                product_id=p.pk,
+                quantity=quantities[p.pk],
+                unit_price=p.price,
+            )
+            for p in products
+        )
+        # The order itself was recorded by the post_save receiver.
+        analytics.record_lines(lines)
+        bulk_changed.send(
+            sender=Product, models=[Product, OrderLine], pks=list(quantities)
+        )
+    return order
@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -40,7 +42,6 @@ INSTALLED_APPS = [
     "graphene_django",
     "django_filters",
     "crm",
-    "django_crontab",
 ]
 
 MIDDLEWARE = [
@@ -51,6 +52,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "crm.routing.ReadYourWritesMiddleware",
 ]
 
 ROOT_URLCONF = "crm.urls"
@@ -76,11 +78,50 @@ WSGI_APPLICATION = "crm.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# Persistent connections, health-checked before reuse. ASGI deployments
+# disable them (crm/asgi.py); pool at the backend there instead.
+CONN_MAX_AGE = int(os.environ.get("CRM_CONN_MAX_AGE", 60))
+
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
-    }
+        "CONN_MAX_AGE": CONN_MAX_AGE,
+        "CONN_HEALTH_CHECKS": True,
+    },
+    # A second SQLite file standing in for a read replica, refreshed from
+    # the primary with `manage.py sync_sqlite_replica`. Only read from when
+    # listed in CRM_DATABASE_ROUTING["REPLICAS"].
+    "replica": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": BASE_DIR / "db_replica.sqlite3",
+        "CONN_MAX_AGE": CONN_MAX_AGE,
+        "CONN_HEALTH_CHECKS": True,
+        "OPTIONS": {"init_command": "PRAGMA query_only = ON"},
+        "TEST": {"MIRROR": "default"},
+    },
+}
+
+DATABASE_ROUTERS = ["crm.routing.ReplicaRouter"]
+
+# Query reads on replicas, read-your-writes after a write (crm.routing)
+CRM_DATABASE_ROUTING = {
+    "REPLICAS": [
+        alias for alias in os.environ.get("CRM_DB_REPLICAS", "").split(",") if alias
+    ],
+    "STICKY_SECONDS": 10,
+}
+
+# Shared by every process on this host (web workers, run_jobs, commands),
+# which the response cache's tag versions rely on. Use memcached or Redis
+# when several hosts serve the API.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.environ.get(
+            "CRM_CACHE_DIR", os.path.join(tempfile.gettempdir(), "crm-cache")
+        ),
+    },
 }
 
 
@@ -125,9 +166,109 @@ STATIC_URL = "static/"
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
-GRAPHENE = {"SCHEMA": "graphql_crm.schema.schema"}  # points to schema.py
+GRAPHENE = {
+    "SCHEMA": "crm.graphql_crm.schema.schema",  # points to schema.py
+    # Under DEBUG graphene-django would add DjangoDebugMiddleware, which wraps
+    # the cursor of every connection, replicas included, for a _debug field
+    # the schema does not have.
+    "MIDDLEWARE": [],
+}
 
-CRONJOBS = [
-    ("*/5 * * * *", "crm.cron.log_crm_heartbeat"),
-    ("0 */12 * * *", "crm.cron.update_low_stock"),
-]
+# Background jobs and the schedule run by `manage.py run_jobs` (crm.jobs)
+CRM_JOBS = {
+    "QUEUES": {"default": 4, "heavy": 1},
+    "SCHEDULE": [
+        (5 * 60, "crm.cron.log_crm_heartbeat"),
+        (12 * 60 * 60, "crm.cron.update_low_stock"),
+        (60 * 60, "crm.jobs.prune_jobs"),
+        (60 * 60, "crm.idempotency.purge_expired"),
+    ],
+}
+
+# Batch relation lookups per request through crm.loaders
+CRM_DATALOADERS = True
+
+# Derive only()/select_related()/prefetch_related() from the selection set
+CRM_QUERY_OPTIMIZER = True
+
+# Parsed/validated documents kept per process, and the APQ store size
+CRM_GRAPHQL_DOCUMENT_CACHE_SIZE = 1000
+
+# Optional JSON file of persisted queries loaded at startup:
+# {"<sha256>": "<query>"} or ["<query>", ...]
+CRM_PERSISTED_QUERIES_MANIFEST = None
+
+# Cache read-only query responses, invalidated by crm.signals on writes.
+# BACKEND is "django" (CACHES[CACHE_ALIAS]) or "lru" (one process only).
+CRM_RESPONSE_CACHE = {
+    "ENABLED": True,
+    "BACKEND": "django",
+    "CACHE_ALIAS": "default",
+    "MAX_SIZE": 1000,
+    "TIMEOUT": 300,
+}
+
+# Serve /graphql/ with the async view; crm.asgi turns this on for ASGI
+# servers. The async view is always reachable at /graphql/async/.
+CRM_ASYNC_GRAPHQL = os.environ.get("CRM_ASYNC_GRAPHQL") == "1"
+
+# Run the root query fields of one async request in separate threads (and
+# database connections) so independent fields really overlap.
+CRM_ASYNC_PARALLEL_FIELDS = True
+
+# Static query cost limits enforced by the GraphQL views (crm.cost).
+# BUDGETS maps the CLIENT_HEADER value to that client's max cost.
+CRM_QUERY_COST = {
+    "ENABLED": True,
+    "MAX_COST": 50_000,
+    "MAX_DEPTH": 6,
+    "CLIENT_HEADER": "X-Client-Id",
+    "BUDGETS": {},
+}
+
+# Request tracing (crm.tracing): send "X-CRM-Trace: 1" to get the trace in
+# the response extensions (DEBUG or staff users only); SAMPLE_RATE traces
+# other requests for the sinks.
+CRM_TRACING = {
+    "ENABLED": True,
+    "HEADER": "X-CRM-Trace",
+    "SAMPLE_RATE": 0.0,
+    "JSONL_PATH": None,
+    "PROMETHEUS_PATH": None,
+}
+
+# Client used by cron jobs (crm.client): "inprocess" runs operations on the
+# schema directly; "http" posts to URL over a kept-alive connection.
+CRM_GRAPHQL_CLIENT = {
+    "TRANSPORT": "inprocess",
+    "URL": "http://localhost:8000/graphql/",
+    "TIMEOUT": 30,
+}
+
+# Batched operations: a JSON array POSTed to /graphql/ runs as one request
+# sharing DataLoaders and the database connection (crm.views).
+CRM_GRAPHQL_BATCH = {
+    "ENABLED": True,
+    "MAX_SIZE": 20,
+}
+
+# Results of mutations run with an idempotencyKey, replayed to retries for
+# TTL seconds and then purged by the job schedule (crm.idempotency)
+CRM_IDEMPOTENCY = {
+    "TTL": 24 * 60 * 60,
+    "PURGE_BATCH_SIZE": 5000,
+}
+
+# Streaming CSV/NDJSON exports at /export/<resource>.<format> (crm.export)
+CRM_EXPORT = {
+    "CHUNK_SIZE": 2000,
+    "BUFFER_SIZE": 64 * 1024,
+}
+
+# GraphQL subscriptions over WebSocket at /graphql/ under ASGI (crm.pubsub).
+# The in-memory channel layer only reaches subscribers in the same process.
+CRM_SUBSCRIPTIONS = {
+    "CHANNEL_LAYER": "crm.pubsub.InMemoryChannelLayer",
+    "QUEUE_SIZE": 100,
+    "CONNECTION_INIT_TIMEOUT": 10,
+}
@@ -0,0 +1,108 @@
+"""
+CRM Signals
+Model signal receivers, and ``bulk_changed`` for writes that bypass them
+(bulk_create, queryset.update()).
+
+``bulk_changed`` is sent with ``models``, the models whose cached
+responses are stale, and optionally ``pks``, the sender's rows that were
+created or changed.
+"""
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import Signal, receiver
+
+from crm import analytics, pubsub
+from crm.models import Customer, Order, OrderLine, Product
+from crm.response_cache import response_cache
+
+# Sent by crm.services after set-based writes with ``models=[...]``.
+bulk_changed = Signal()
+
+# Subscription topic of the rows sent with bulk_changed, by sender.
+BULK_TOPICS = {
+    Order: pubsub.ORDER_CREATED,
+    Product: pubsub.PRODUCT_STOCK_CHANGED,
+}
+
+
+def invalidate_on_commit(*models):
+    transaction.on_commit(lambda: response_cache.invalidate(*models))
+
+
+@receiver(post_save, sender=Customer)
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Customer)
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Order)
+def invalidate_model(sender, **kwargs):
+    invalidate_on_commit(sender)
+
+
+@receiver(post_save, sender=OrderLine)
+@receiver(post_delete, sender=OrderLine)
+def invalidate_order_line(sender, **kwargs):
+    invalidate_on_commit(Order, Product, OrderLine)
+
+
+@receiver(m2m_changed, sender=OrderLine)
+def invalidate_order_products(sender, action, **kwargs):
+    if action.startswith("post_"):
+        invalidate_on_commit(Order, Product, OrderLine)
+
+
+@receiver(bulk_changed)
+def invalidate_bulk(sender, models, **kwargs):
+    invalidate_on_commit(*models)
+
+
+@receiver(post_save, sender=Order)
+def record_new_order(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        analytics.record_orders([instance])
+
+
+@receiver(post_save, sender=OrderLine)
+def record_new_order_line(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        analytics.record_lines([instance])
+
+
+@receiver(m2m_changed, sender=OrderLine)
+def record_order_products(sender, instance, action, reverse, pk_set, **kwargs):
+    # order.products.add(..., through_defaults=...) bulk-inserts its lines.
+    if action != "post_add" or not pk_set:
+        return
+    if reverse:
+        lines = OrderLine.objects.filter(product=instance, order_id__in=pk_set)
+    else:
+        lines = OrderLine.objects.filter(order=instance, product_id__in=pk_set)
+    analytics.record_lines(lines)
+
+
+# ==========================
+# Subscriptions
+# ==========================
+def publish_on_commit(topic, pks):
+    pks = list(pks)
+    transaction.on_commit(lambda: pubsub.publish(topic, {"pks": pks}))
+
+
+@receiver(post_save, sender=Order)
+def publish_new_order(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        publish_on_commit(pubsub.ORDER_CREATED, [instance.pk])
+
+
+@receiver(post_save, sender=Product)
+def publish_product_stock(sender, instance, raw=False, **kwargs):
+    if not raw:
+        publish_on_commit(pubsub.PRODUCT_STOCK_CHANGED, [instance.pk])
+
+
+@receiver(bulk_changed)
+def publish_bulk_changes(sender, pks=None, **kwargs):
+    topic = BULK_TOPICS.get(sender)
+    if topic is not None and pks:
+        publish_on_commit(topic, pks)
@@ -0,0 +1,82 @@
+"""
+CRM Subscriptions
+``orderCreated`` and ``productStockChanged``, the GraphQL subscriptions of
+``crm.async_schema``, served over WebSocket by ``crm.websocket``.
+
+Each subscription listens to a ``crm.pubsub`` topic fed by the model
+signals in ``crm.signals``: ``CreateOrder``, ``BulkCreateOrders``,
+``CreateProduct``, ``BulkCreateProducts`` and ``UpdateLowStockProducts``
+all publish once their transaction commits. The changed rows are loaded
+once per event for all subscribers, with the relations the order fields
+read, and filtered per subscriber by its arguments.
+"""
+
+import graphene
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from django.db.models import Prefetch
+
+from crm import pubsub
+from crm.models import Order, OrderLine, Product
+from crm.schema import OrderType, ProductType
+
+
+def fetch(queryset, pks):
+    try:
+        rows = queryset.in_bulk(pks)
+    finally:
+        close_old_connections()
+    return [rows[pk] for pk in pks if pk in rows]
+
+
+async def load_orders(pks):
+    queryset = Order.objects.select_related("customer").prefetch_related(
+        Prefetch("lines", queryset=OrderLine.objects.select_related("product"))
+    )
+    # Loads are shared by every subscriber, not tied to one connection.
+    return await sync_to_async(fetch, thread_sensitive=False)(queryset, pks)
+
+
+async def load_products(pks):
+    return await sync_to_async(fetch, thread_sensitive=False)(
+        Product.objects.all(), pks
+    )
+
+
+def int_or_none(value):
+    return None if value is None else int(value)
+
+
+class Subscription(graphene.ObjectType):
+    order_created = graphene.Field(
+        graphene.NonNull(OrderType),
+        customer_id=graphene.ID(description="Only orders of this customer."),
+    )
+    product_stock_changed = graphene.Field(
+        graphene.NonNull(ProductType),
+        product_ids=graphene.List(
+            graphene.NonNull(graphene.ID), description="Only these products."
+        ),
+        stock_lt=graphene.Int(description="Only products left with less stock."),
+    )
+
+    async def subscribe_order_created(root, info, customer_id=None):
+        customer_id = int_or_none(customer_id)
+        async with pubsub.listen(pubsub.ORDER_CREATED, load_orders) as events:
+            while True:
+                for order in await events.get():
+                    if customer_id is None or order.customer_id == customer_id:
+                        yield order
+
+    async def subscribe_product_stock_changed(
+        root, info, product_ids=None, stock_lt=None
+    ):
+        product_ids = product_ids and {int(pk) for pk in product_ids}
+        async with pubsub.listen(pubsub.PRODUCT_STOCK_CHANGED, load_products) as events:
+            while True:
+                for product in await events.get():
+                    if product_ids and product.pk not in product_ids:
+                        continue
+                    if stock_lt is not None and product.stock >= stock_lt:
+                        continue
+                    yield product
@@ -0,0 +1,53 @@
+"""
+CRM Tasks
+Background versions of the heavy mutations, run by ``crm.jobs`` workers.
+
+Arguments and results are JSON so they can be stored on the job row;
+results carry relay global IDs that clients can query directly.
+"""
+
+from types import SimpleNamespace
+
+from django.db import transaction
+from graphql_relay import to_global_id
+
+from crm import services
+from crm.jobs import task
+
+
+@task(queue="heavy")
+def bulk_create_customers(
+    customers, on_conflict=services.ON_CONFLICT_ERROR, chunk_size=None
+):
+    """``customers`` are ``{"name", "email", "phone"}`` dicts."""
+    rows = [
+        SimpleNamespace(name=c["name"], email=c["email"], phone=c.get("phone"))
+        for c in customers
+    ]
+    with transaction.atomic():
+        created, errors = services.bulk_create_customers(
+            rows,
+            on_conflict=on_conflict,
+            chunk_size=chunk_size or services.DEFAULT_CHUNK_SIZE,
+        )
+    return {
+        "customers": [to_global_id("CustomerType", c.pk) for c in created],
+        "errors": errors,
+    }
+
+
+@task(queue="heavy")
+def restock_low_stock(
+    threshold=services.LOW_STOCK_THRESHOLD, increment=services.RESTOCK_INCREMENT
+):
+    updated = services.restock_low_stock(threshold=threshold, increment=increment)
+    return {
+        "products": [
+            {
+                "id": to_global_id("ProductType", p.pk),
+                "name": p.name,
+                "stock": p.stock,
+            }
+            for p in updated
+        ]
+    }
@@ -1,3 +1,2631 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest.mock import mock_open, patch
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections
+from django.test import (
+    RequestFactory,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from graphene.validation import depth_limit_validator
+from graphql import parse, validate
+from graphql_relay import to_global_id
+
+from crm import (
+    analytics,
+    cost,
+    documents,
+    idempotency,
+    jobs,
+    pubsub,
+    routing,
+    search,
+    seeding,
+    services,
+    subscriptions,
+    tracing,
+)
+from crm.async_schema import AsyncKeysetConnectionField
+from crm.cron_jobs import send_order_reminders as reminders
+from crm.client import (
+    GraphQLClient,
+    GraphQLClientError,
+    HTTPTransport,
+    InProcessTransport,
+)
+from crm.documents import document_cache, persisted_queries
+from crm.management.commands import benchmark_graphql
+from crm.response_cache import (
+    LRUBackend,
+    ResponseCache,
+    operation_tags,
+    response_cache,
+)
+from crm.websocket import GraphQLWebSocketApp
+from crm.graphql_crm.schema import schema
+from crm.models import (
+    Customer,
+    CustomerSales,
+    DailySales,
+    IdempotencyKey,
+    Job,
+    Order,
+    OrderLine,
+    Product,
+    ProductSales,
+)
+
+# Keep responses cached by the tests out of the cache the project shares.
+test_caches = override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+)
+
+
+def setUpModule():
+    test_caches.enable()
+
+
+def tearDownModule():
+    test_caches.disable()
+
+
+def execute(query, variables=None, context=None):
+    if context is None:
+        context = RequestFactory().post("/graphql/")
+    return schema.execute(query, variable_values=variables, context_value=context)
+
+
+def count_queries(query, variables=None):
+    with CaptureQueriesContext(connection) as ctx:
+        result = execute(query, variables)
+    assert result.errors is None, result.errors
+    return len(ctx.captured_queries), result
+
+
+@override_settings(CRM_QUERY_OPTIMIZER=False)
+class DataLoaderTests(TestCase):
+    ORDERS_QUERY = """
+        query ($first: Int) {
+            allOrders(first: $first) {
+                edges {
+                    node {
+                        customer { name }
+                        products { edges { node { name } } }
+                    }
+                }
+            }
+        }
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        products = [
+            Product.objects.create(name=f"P{i}", price=Decimal("10.00"), stock=5)
+            for i in range(3)
+        ]
+        for i in range(12):
+            customer = Customer.objects.create(name=f"C{i}", email=f"c{i}@x.com")
+            order = Order.objects.create(customer=customer, total_amount=20)
+            order.products.set(
+                products[: (i % 3) + 1], through_defaults={"unit_price": 10}
+            )
+
+    def test_query_count_is_independent_of_page_size(self):
+        small, result = count_queries(self.ORDERS_QUERY, {"first": 2})
+        large, result_large = count_queries(self.ORDERS_QUERY, {"first": 12})
+
+        self.assertEqual(len(result.data["allOrders"]["edges"]), 2)
+        self.assertEqual(len(result_large.data["allOrders"]["edges"]), 12)
+        self.assertEqual(small, large)
+        # page + customers + products
+        self.assertEqual(large, 3)
+
+    def test_nested_reverse_relations_are_batched(self):
+        query = """
+            query ($first: Int) {
+                allCustomers(first: $first) {
+                    edges { node { name orders { edges { node { totalAmount } } } } }
+                }
+                allProducts {
+                    edges { node { name orders { edges { node { id } } } } }
+                }
+            }
+        """
+        small, _ = count_queries(query, {"first": 3})
+        large, result = count_queries(query, {"first": 12})
+
+        self.assertEqual(small, large)
+        edges = result.data["allCustomers"]["edges"]
+        self.assertTrue(all(len(e["node"]["orders"]["edges"]) == 1 for e in edges))
+
+    def test_filtered_nested_connection_falls_back_to_queryset(self):
+        query = """
+            {
+                allCustomers(first: 1) {
+                    edges { node { orders(totalAmountGte: 100) { edges { node { id } } } } }
+                }
+            }
+        """
+        result = execute(query)
+
+        self.assertIsNone(result.errors)
+        node = result.data["allCustomers"]["edges"][0]["node"]
+        self.assertEqual(node["orders"]["edges"], [])
+
+    def test_resolves_without_request_context(self):
+        result = schema.execute(self.ORDERS_QUERY, variable_values={"first": 2})
+
+        self.assertIsNone(result.errors)
+        self.assertEqual(len(result.data["allOrders"]["edges"]), 2)
+
+
+class QueryOptimizerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        product = Product.objects.create(name="Desk", price=Decimal("99.00"), stock=3)
+        for i in range(5):
+            customer = Customer.objects.create(
+                name=f"C{i}", email=f"c{i}@x.com", phone="+1234567890"
+            )
+            order = Order.objects.create(customer=customer, total_amount=99)
+            order.products.set([product], through_defaults={"unit_price": 99})
+
+    def test_only_selected_columns_are_loaded(self):
+        query = "{ allCustomers { edges { node { name } } } }"
+        with CaptureQueriesContext(connection) as ctx:
+            result = execute(query)
+
+        self.assertIsNone(result.errors)
+        page_sql = ctx.captured_queries[-1]["sql"]
+        self.assertIn('"crm_customer"."name"', page_sql)
+        self.assertNotIn('"crm_customer"."email"', page_sql)
+        self.assertNotIn('"crm_customer"."phone"', page_sql)
+
+    def test_forward_foreign_key_is_joined(self):
+        query = "{ allOrders { edges { node { totalAmount customer { email } } } } }"
+        with CaptureQueriesContext(connection) as ctx:
+            result = execute(query)
+
+        self.assertIsNone(result.errors)
+        # one joined page query
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertIn("JOIN", ctx.captured_queries[-1]["sql"])
+        emails = [
+            e["node"]["customer"]["email"] for e in result.data["allOrders"]["edges"]
+        ]
+        self.assertEqual(len(emails), 5)
+
+    def test_nested_connections_are_prefetched(self):
+        query = """
+            {
+                allCustomers {
+                    edges { node {
+                        orders { edges { node {
+                            totalAmount
+                            products { edges { node { name } } }
+                        } } }
+                    } }
+                }
+            }
+        """
+        with CaptureQueriesContext(connection) as ctx:
+            result = execute(query)
+
+        self.assertIsNone(result.errors)
+        # customers + orders prefetch + products prefetch
+        self.assertEqual(len(ctx.captured_queries), 3)
+        orders_sql = ctx.captured_queries[1]["sql"]
+        self.assertNotIn('"crm_order"."order_date"', orders_sql)
+        node = result.data["allCustomers"]["edges"][0]["node"]
+        products = node["orders"]["edges"][0]["node"]["products"]["edges"]
+        self.assertEqual(products[0]["node"]["name"], "Desk")
+
+    def test_fragments_are_expanded(self):
+        query = """
+            { allProducts { edges { node { ...ProductFields } } } }
+            fragment ProductFields on ProductType { price stock }
+        """
+        with CaptureQueriesContext(connection) as ctx:
+            result = execute(query)
+
+        self.assertIsNone(result.errors)
+        page_sql = ctx.captured_queries[-1]["sql"]
+        self.assertIn('"crm_product"."stock"', page_sql)
+        self.assertNotIn('"crm_product"."name"', page_sql)
+
+
+class BulkCreateCustomersTests(TestCase):
+    MUTATION = """
+        mutation ($customers: [CustomerInput]!, $onConflict: OnConflict) {
+            bulkCreateCustomers(customers: $customers, onConflict: $onConflict) {
+                customers { name email phone }
+                errors
+            }
+        }
+    """
+
+    def setUp(self):
+        Customer.objects.create(name="Old", email="taken@x.com")
+
+    def run_mutation(self, customers, on_conflict="ERROR"):
+        variables = {"customers": customers, "onConflict": on_conflict}
+        with CaptureQueriesContext(connection) as ctx:
+            result = execute(self.MUTATION, variables)
+        self.assertIsNone(result.errors)
+        return result.data["bulkCreateCustomers"], len(ctx.captured_queries)
+
+    def test_reports_per_row_errors_with_constant_queries(self):
+        customers = [
+            {"name": f"N{i}", "email": f"n{i}@x.com", "phone": "123-456-7890"}
+            for i in range(50)
+        ]
+        customers += [
+            {"name": "Dup", "email": "taken@x.com"},
+            {"name": "Bad", "email": "bad@x.com", "phone": "12"},
+            {"name": "Again", "email": "n0@x.com"},
+        ]
+        data, queries = self.run_mutation(customers)
+
+        self.assertEqual(len(data["customers"]), 50)
+        self.assertCountEqual(
+            data["errors"],
+            [
+                "Email already exists: taken@x.com",
+                "Invalid phone: 12",
+                "Duplicate email in input: n0@x.com",
+            ],
+        )
+        # savepoint + email lookup + insert + release
+        self.assertLessEqual(queries, 4)
+        self.assertEqual(Customer.objects.count(), 51)
+
+    def test_ignore_skips_existing_rows(self):
+        data, _ = self.run_mutation(
+            [
+                {"name": "Dup", "email": "taken@x.com"},
+                {"name": "New", "email": "new@x.com"},
+            ],
+            on_conflict="IGNORE",
+        )
+
+        self.assertEqual(data["errors"], [])
+        self.assertEqual([c["email"] for c in data["customers"]], ["new@x.com"])
+        self.assertEqual(Customer.objects.get(email="taken@x.com").name, "Old")
+
+    def test_update_overwrites_existing_rows(self):
+        data, _ = self.run_mutation(
+            [{"name": "Renamed", "email": "taken@x.com", "phone": "+1234567890"}],
+            on_conflict="UPDATE",
+        )
+
+        self.assertEqual(data["errors"], [])
+        customer = Customer.objects.get(email="taken@x.com")
+        self.assertEqual((customer.name, customer.phone), ("Renamed", "+1234567890"))
+        self.assertEqual(Customer.objects.count(), 1)
+
+
+class BulkImportTests(TestCase):
+    def test_products_are_imported_per_chunk(self):
+        mutation = """
+            mutation ($products: [ProductInput]!) {
+                bulkCreateProducts(products: $products, chunkSize: 2) {
+                    created
+                    chunks { index created errors }
+                }
+            }
+        """
+        products = [{"name": f"P{i}", "price": 1.5, "stock": i} for i in range(4)]
+        products.append({"name": "Free", "price": 0})
+        result = execute(mutation, {"products": products})
+
+        self.assertIsNone(result.errors)
+        data = result.data["bulkCreateProducts"]
+        self.assertEqual(data["created"], 4)
+        self.assertEqual([c["created"] for c in data["chunks"]], [2, 2, 0])
+        self.assertEqual(data["chunks"][2]["errors"], ["Row 4: Price must be positive"])
+        self.assertEqual(Product.objects.count(), 4)
+
+    def test_orders_insert_through_rows_in_bulk(self):
+        customer = Customer.objects.create(name="A", email="a@x.com")
+        p1 = Product.objects.create(name="P1", price=Decimal("2.50"), stock=30)
+        p2 = Product.objects.create(name="P2", price=Decimal("4.00"), stock=30)
+        mutation = """
+            mutation ($orders: [OrderInput]!) {
+                bulkCreateOrders(orders: $orders, chunkSize: 50) {
+                    created
+                    chunks { ids errors }
+                }
+            }
+        """
+        orders = [
+            {"customerId": customer.pk, "productIds": [p1.pk, p2.pk]} for _ in range(30)
+        ]
+        orders.append({"customerId": 999, "productIds": [p1.pk]})
+        orders.append({"customerId": customer.pk, "productIds": [p1.pk, 999]})
+
+        with CaptureQueriesContext(connection) as ctx:
+            result = execute(mutation, {"orders": orders})
+
+        self.assertIsNone(result.errors)
+        data = result.data["bulkCreateOrders"]
+        self.assertEqual(data["created"], 30)
+        self.assertEqual(
+            data["chunks"][0]["errors"],
+            ["Row 30: Invalid customer ID", "Row 31: One or more invalid product IDs"],
+        )
+        # savepoint + 2 lookups + stock update + 2 inserts + 3 summary upserts
+        # + release
+        self.assertEqual(len(ctx.captured_queries), 10)
+        self.assertEqual(Order.products.through.objects.count(), 60)
+        self.assertEqual(Order.objects.first().total_amount, Decimal("6.50"))
+        self.assertEqual(
+            list(Product.objects.order_by("pk").values_list("stock", flat=True)),
+            [0, 0],
+        )
+
+    def test_malformed_order_ids_are_row_errors(self):
+        customer = Customer.objects.create(name="A", email="a@x.com")
+        lamp = Product.objects.create(name="Lamp", price=Decimal("5.00"), stock=5)
+        mutation = """
+            mutation ($orders: [OrderInput]!) {
+                bulkCreateOrders(orders: $orders) { created chunks { errors } }
+            }
+        """
+        orders = [
+            {"customerId": "abc", "productIds": [lamp.pk]},
+            {"customerId": customer.pk, "productIds": [lamp.pk, "x"]},
+            {"customerId": customer.pk, "productIds": [lamp.pk]},
+        ]
+
+        result = execute(mutation, {"orders": orders})
+
+        self.assertIsNone(result.errors)
+        data = result.data["bulkCreateOrders"]
+        self.assertEqual(data["created"], 1)
+        self.assertEqual(
+            data["chunks"][0]["errors"],
+            ["Row 0: Invalid customer ID", "Row 1: One or more invalid product IDs"],
+        )
+
+    def test_bulk_orders_cannot_oversell(self):
+        customer = Customer.objects.create(name="A", email="a@x.com")
+        lamp = Product.objects.create(name="Lamp", price=Decimal("5.00"), stock=3)
+        mutation = """
+            mutation ($orders: [OrderInput]!) {
+                bulkCreateOrders(orders: $orders, chunkSize: 2) {
+                    created
+                    chunks { errors }
+                }
+            }
+        """
+        orders = [
+            {"customerId": customer.pk, "productIds": [lamp.pk, lamp.pk]},
+            {"customerId": customer.pk, "productIds": [lamp.pk, lamp.pk]},
+            {"customerId": customer.pk, "productIds": [lamp.pk]},
+            {"customerId": customer.pk, "productIds": [lamp.pk]},
+        ]
+
+        result = execute(mutation, {"orders": orders})
+
+        self.assertIsNone(result.errors)
+        data = result.data["bulkCreateOrders"]
+        self.assertEqual(data["created"], 2)
+        self.assertEqual(
+            [chunk["errors"] for chunk in data["chunks"]],
+            [
+                ["Row 1: Insufficient stock for Lamp"],
+                ["Row 3: Insufficient stock for Lamp"],
+            ],
+        )
+        lamp.refresh_from_db()
+        self.assertEqual(lamp.stock, 0)
+
+
+class UpdateLowStockProductsTests(TestCase):
+    MUTATION = """
+        mutation ($threshold: Int, $increment: Int) {
+            updateLowStockProducts(threshold: $threshold, increment: $increment) {
+                products { name stock price }
+                message
+            }
+        }
+    """
+
+    def setUp(self):
+        for i, stock in enumerate([0, 4, 9, 10, 50]):
+            Product.objects.create(name=f"P{i}", price=Decimal("1.25"), stock=stock)
+
+    def test_restocks_with_a_single_update(self):
+        with CaptureQueriesContext(connection) as ctx:
+            result = execute(self.MUTATION, {"threshold": 10, "increment": 5})
+
+        self.assertIsNone(result.errors)
+        products = result.data["updateLowStockProducts"]["products"]
+        self.assertEqual(
+            [(p["name"], p["stock"]) for p in products],
+            [("P0", 5), ("P1", 9), ("P2", 14)],
+        )
+        self.assertEqual(products[0]["price"], "1.25")
+        updates = [q["sql"] for q in ctx.captured_queries if "UPDATE" in q["sql"]]
+        self.assertEqual(len(updates), 1)
+        self.assertIn("RETURNING", updates[0])
+        self.assertEqual(Product.objects.get(name="P3").stock, 10)
+
+    def test_batched_fallback_matches_returning_path(self):
+        with patch("crm.services.supports_update_returning", return_value=False):
+            updated = services.restock_low_stock(threshold=5, increment=1, batch_size=1)
+
+        self.assertEqual([(p.name, p.stock) for p in updated], [("P0", 1), ("P1", 5)])
+
+    def test_rejects_non_positive_increment(self):
+        result = execute(self.MUTATION, {"increment": 0})
+
+        self.assertEqual(result.errors[0].message, "Increment must be positive")
+
+
+class CreateOrderTests(TestCase):
+    MUTATION = """
+        mutation ($customerId: ID!, $items: [OrderItemInput]) {
+            createOrder(customerId: $customerId, items: $items) {
+                order { totalAmount }
+            }
+        }
+    """
+
+    def setUp(self):
+        self.customer = Customer.objects.create(name="A", email="a@x.com")
+        self.products = [
+            Product.objects.create(name=f"P{i}", price=Decimal("3.50"), stock=10)
+            for i in range(5)
+        ]
+
+    def create(self, items):
+        variables = {"customerId": self.customer.pk, "items": items}
+        with CaptureQueriesContext(connection) as ctx:
+            result = execute(self.MUTATION, variables)
+        return result, len(ctx.captured_queries)
+
+    def test_query_count_is_independent_of_basket_size(self):
+        _, single = self.create([{"productId": self.products[0].pk, "quantity": 2}])
+        result, basket = self.create(
+            [{"productId": p.pk, "quantity": 3} for p in self.products]
+        )
+
+        self.assertIsNone(result.errors)
+        self.assertEqual(single, basket)
+        self.assertEqual(result.data["createOrder"]["order"]["totalAmount"], "52.50")
+        stock = dict(Product.objects.values_list("name", "stock"))
+        self.assertEqual(stock, {"P0": 5, "P1": 7, "P2": 7, "P3": 7, "P4": 7})
+
+    def test_product_ids_count_as_one_unit_each(self):
+        result = execute(
+            """
+            mutation ($customerId: ID!, $productIds: [ID]) {
+                createOrder(customerId: $customerId, productIds: $productIds) {
+                    order { totalAmount products { edges { node { name } } } }
+                }
+            }
+            """,
+            {"customerId": self.customer.pk, "productIds": [self.products[0].pk]},
+        )
+
+        self.assertIsNone(result.errors)
+        order = result.data["createOrder"]["order"]
+        self.assertEqual(order["totalAmount"], "3.50")
+        self.assertEqual(len(order["products"]["edges"]), 1)
+
+    def test_insufficient_stock_leaves_everything_untouched(self):
+        result, _ = self.create(
+            [
+                {"productId": self.products[0].pk, "quantity": 1},
+                {"productId": self.products[1].pk, "quantity": 11},
+            ]
+        )
+
+        self.assertEqual(result.errors[0].message, "Insufficient stock for P1")
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).stock, 10)
+
+
+class IdempotencyTests(TestCase):
+    CREATE_CUSTOMER = """
+        mutation ($key: String) {
+            createCustomer(name: "Ann", email: "ann@example.com", idempotencyKey: $key) {
+                customer { id name email createdAt }
+                message
+            }
+        }
+    """
+    CREATE_ORDER = """
+        mutation ($customerId: ID!, $items: [OrderItemInput], $key: String) {
+            createOrder(customerId: $customerId, items: $items, idempotencyKey: $key) {
+                order {
+                    id totalAmount customer { email }
+                    lines { quantity unitPrice product { name } }
+                }
+            }
+        }
+    """
+
+    def test_retry_returns_stored_result_in_one_query(self):
+        first = execute(self.CREATE_CUSTOMER, {"key": "k1"})
+        with self.assertNumQueries(1):
+            retry = execute(self.CREATE_CUSTOMER, {"key": "k1"})
+
+        self.assertIsNone(first.errors)
+        self.assertIsNone(retry.errors)
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(Customer.objects.count(), 1)
+
+        # Without a key the mutation runs and fails on the duplicate email.
+        result = execute(self.CREATE_CUSTOMER)
+        self.assertEqual(result.errors[0].message, "Email already exists")
+
+    def test_retried_order_is_created_once(self):
+        customer = Customer.objects.create(name="Ann", email="ann@example.com")
+        product = Product.objects.create(name="Lamp", price=Decimal("5.00"), stock=10)
+        variables = {
+            "customerId": customer.pk,
+            "items": [{"productId": product.pk, "quantity": 3}],
+            "key": "order-1",
+        }
+
+        first = execute(self.CREATE_ORDER, variables)
+        retry = execute(self.CREATE_ORDER, variables)
+
+        self.assertIsNone(retry.errors)
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(
+            retry.data["createOrder"]["order"]["lines"],
+            [{"quantity": 3, "unitPrice": "5.00", "product": {"name": "Lamp"}}],
+        )
+        self.assertEqual(Order.objects.count(), 1)
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 7)
+
+    def test_keys_are_scoped_to_their_arguments_and_mutation(self):
+        execute(self.CREATE_CUSTOMER, {"key": "k1"})
+
+        result = execute(
+            'mutation { createCustomer(name: "Bob", email: "bob@example.com", '
+            'idempotencyKey: "k1") { message } }'
+        )
+        self.assertEqual(
+            result.errors[0].message,
+            "idempotencyKey was already used with different arguments",
+        )
+
+        result = execute(
+            'mutation { createProduct(name: "Lamp", price: 5, idempotencyKey: "k1") '
+            "{ product { name } } }"
+        )
+        self.assertIsNone(result.errors)
+
+    def test_chunked_bulk_mutations_take_no_key(self):
+        mutations = schema.graphql_schema.mutation_type.fields
+        self.assertIn("idempotencyKey", mutations["bulkCreateCustomers"].args)
+        for name in ("bulkCreateProducts", "bulkCreateOrders"):
+            self.assertNotIn("idempotencyKey", mutations[name].args)
+
+    def test_failures_are_not_stored(self):
+        Customer.objects.create(name="Ann", email="ann@example.com")
+
+        result = execute(self.CREATE_CUSTOMER, {"key": "k1"})
+
+        self.assertEqual(result.errors[0].message, "Email already exists")
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+        result = execute(self.CREATE_CUSTOMER, {"key": ""})
+        self.assertIn("idempotencyKey must be 1 to 255", result.errors[0].message)
+
+    def test_expired_key_runs_the_mutation_again(self):
+        mutation = (
+            'mutation { createProduct(name: "Lamp", price: 5, idempotencyKey: "k1") '
+            "{ product { id } } }"
+        )
+        execute(mutation)
+        IdempotencyKey.objects.update(expires_at=timezone.now())
+
+        execute(mutation)
+
+        self.assertEqual(Product.objects.count(), 2)
+        self.assertEqual(IdempotencyKey.objects.count(), 1)
+
+    @override_settings(CRM_IDEMPOTENCY={"PURGE_BATCH_SIZE": 2})
+    def test_purge_expired(self):
+        now = timezone.now()
+        IdempotencyKey.objects.bulk_create(
+            IdempotencyKey(
+                mutation="createProduct",
+                key=str(i),
+                request_hash="",
+                response={},
+                expires_at=now + timedelta(hours=1 if i < 2 else -1),
+            )
+            for i in range(7)
+        )
+
+        self.assertEqual(idempotency.purge_expired(), {"deleted": 5})
+        self.assertEqual(
+            sorted(IdempotencyKey.objects.values_list("key", flat=True)), ["0", "1"]
+        )
+
+
+class ExplainFiltersCommandTests(TestCase):
+    def test_indexed_filters_do_not_scan(self):
+        out = StringIO()
+        call_command("explain_filters", stdout=out)
+        output = out.getvalue()
+
+        for label in [
+            "name_icontains",
+            "created_at_gte",
+            "price_gte, price_lte, stock",
+            "total_amount_gte",
+            "customer_name",
+        ]:
+            self.assertIn(f"OK    {label}\n", output)
+
+
+class SearchBackendTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        names = ["Alice Martin", "Malika Stone", "Bob Alison", "Carol King"]
+        for i, name in enumerate(names):
+            customer = Customer.objects.create(name=name, email=f"s{i}@x.com")
+            Order.objects.create(customer=customer, total_amount=10)
+
+    def nodes(self, query):
+        result = execute(query)
+        self.assertIsNone(result.errors)
+        return [e["node"] for e in list(result.data.values())[0]["edges"]]
+
+    def test_sqlite_uses_fts5_backend(self):
+        self.assertIsInstance(
+            search.get_backend(Customer.objects.all()), search.SQLiteFTSBackend
+        )
+
+    def test_substring_matches_like_icontains(self):
+        nodes = self.nodes(
+            '{ allCustomers(nameIcontains: "ALI") { edges { node { name } } } }'
+        )
+
+        self.assertCountEqual(
+            [n["name"] for n in nodes], ["Alice Martin", "Malika Stone", "Bob Alison"]
+        )
+
+    def test_results_are_ranked(self):
+        ranks = [
+            c.search_rank for c in search.search(Customer.objects.all(), "name", "ali")
+        ]
+
+        self.assertEqual(len(ranks), 3)
+        self.assertEqual(ranks, sorted(ranks))
+
+    def test_filtered_pages_keep_the_keyset_order(self):
+        query = """
+            query ($after: String) {
+                allCustomers(nameIcontains: "ali", first: 2, after: $after) {
+                    edges { node { name } }
+                    pageInfo { endCursor }
+                }
+            }
+        """
+        with CaptureQueriesContext(connection) as ctx:
+            first = execute(query).data["allCustomers"]
+            after = first["pageInfo"]["endCursor"]
+            second = execute(query, {"after": after}).data["allCustomers"]
+
+        self.assertEqual(
+            [e["node"]["name"] for e in first["edges"] + second["edges"]],
+            ["Alice Martin", "Malika Stone", "Bob Alison"],
+        )
+        self.assertFalse(any("rank" in q["sql"] for q in ctx.captured_queries))
+
+    def test_short_terms_fall_back_to_icontains(self):
+        nodes = self.nodes(
+            '{ allCustomers(nameIcontains: "ob") { edges { node { name } } } }'
+        )
+
+        self.assertEqual([n["name"] for n in nodes], ["Bob Alison"])
+
+    def test_index_follows_updates_and_deletes(self):
+        Customer.objects.filter(name="Carol King").update(name="Caroline Queen")
+        Customer.objects.filter(name="Bob Alison").delete()
+
+        found = search.search(Customer.objects.all(), "name", "queen", rank=False)
+        self.assertEqual([c.name for c in found], ["Caroline Queen"])
+        found = search.search(Customer.objects.all(), "name", "alison", rank=False)
+        self.assertFalse(found.exists())
+
+    def test_order_customer_name_filter(self):
+        nodes = self.nodes(
+            '{ allOrders(customerName: "king") { edges { node { customer { name } } } } }'
+        )
+
+        self.assertEqual([n["customer"]["name"] for n in nodes], ["Carol King"])
+
+
+class KeysetPaginationTests(TestCase):
+    QUERY = """
+        query ($first: Int, $after: String, $last: Int, $before: String) {
+            allOrders(first: $first, after: $after, last: $last, before: $before) {
+                edges { node { totalAmount } }
+                pageInfo { hasNextPage hasPreviousPage startCursor endCursor }
+            }
+        }
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        customer = Customer.objects.create(name="A", email="a@x.com")
+        for i in range(7):
+            Order.objects.create(customer=customer, total_amount=i)
+        # Ties on the sort key are broken by primary key.
+        Order.objects.update(order_date=timezone.now())
+
+    def page(self, **variables):
+        with CaptureQueriesContext(connection) as ctx:
+            result = execute(self.QUERY, variables)
+        self.assertIsNone(result.errors)
+        data = result.data["allOrders"]
+        amounts = [int(float(e["node"]["totalAmount"])) for e in data["edges"]]
+        return amounts, data["pageInfo"], ctx.captured_queries
+
+    def test_walks_forward_with_cursors(self):
+        seen = []
+        after = None
+        while True:
+            amounts, info, queries = self.page(first=3, after=after)
+            seen.extend(amounts)
+            self.assertEqual(len(queries), 1)
+            self.assertNotIn("COUNT", queries[0]["sql"])
+            self.assertNotIn("OFFSET", queries[0]["sql"])
+            if not info["hasNextPage"]:
+                break
+            after = info["endCursor"]
+
+        self.assertEqual(seen, list(range(7)))
+
+    def test_walks_backward_with_cursors(self):
+        amounts, info, _ = self.page(last=3)
+        self.assertEqual(amounts, [4, 5, 6])
+        self.assertTrue(info["hasPreviousPage"])
+
+        amounts, info, _ = self.page(last=3, before=info["startCursor"])
+        self.assertEqual(amounts, [1, 2, 3])
+
+    def test_total_count_only_runs_when_selected(self):
+        query = "{ allOrders(first: 2) { totalCount edges { node { id } } } }"
+        with CaptureQueriesContext(connection) as ctx:
+            result = execute(query)
+
+        self.assertEqual(result.data["allOrders"]["totalCount"], 7)
+        self.assertEqual(len(ctx.captured_queries), 2)
+
+    def test_invalid_cursor_is_rejected(self):
+        result = execute(self.QUERY, {"first": 1, "after": "not-a-cursor"})
+
+        self.assertEqual(result.errors[0].message, "Invalid cursor: not-a-cursor")
+
+    def test_filters_apply_before_pagination(self):
+        result = execute(
+            "{ allOrders(totalAmountGte: 5, first: 1) { totalCount edges { node { id } } } }"
+        )
+
+        self.assertIsNone(result.errors)
+        self.assertEqual(result.data["allOrders"]["totalCount"], 2)
+        self.assertEqual(len(result.data["allOrders"]["edges"]), 1)
+
+
+class DocumentCacheTests(TestCase):
+    QUERY = "{ allProducts { edges { node { name } } } }"
+
+    def setUp(self):
+        document_cache.clear()
+        response_cache.clear()
+        Product.objects.create(name="Lamp", price=Decimal("5.00"))
+
+    def post(self, payload):
+        response = self.client.post(
+            "/graphql/", json.dumps(payload), content_type="application/json"
+        )
+        return response.json()
+
+    def test_repeated_queries_are_parsed_once(self):
+        with patch("crm.documents.parse", wraps=documents.parse) as parse:
+            first = self.post({"query": self.QUERY})
+            second = self.post({"query": self.QUERY})
+
+        self.assertEqual(first["data"], second["data"])
+        self.assertEqual(parse.call_count, 1)
+        self.assertEqual(document_cache.stats()["hits"], 1)
+
+    def test_validation_errors_are_cached_and_returned(self):
+        for _ in range(2):
+            body = self.post({"query": "{ allProducts { nope } }"})
+            self.assertIn("Cannot query field 'nope'", body["errors"][0]["message"])
+        self.assertEqual(document_cache.stats()["hits"], 1)
+
+    def test_validation_rules_are_part_of_the_key(self):
+        schema_ = schema.graphql_schema
+        query = "{ allProducts { totalCount } }"
+
+        _, errors = document_cache.get_document(schema_, query)
+        _, limited = document_cache.get_document(
+            schema_, query, [depth_limit_validator(max_depth=0)]
+        )
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(limited), 1)
+        self.assertEqual(document_cache.stats()["hits"], 0)
+
+    def test_lru_evicts_least_recently_used(self):
+        cache = documents.DocumentCache(max_size=2)
+        schema_ = schema.graphql_schema
+        for query in [
+            "{ a: allProducts { totalCount } }",
+            "{ b: allProducts { totalCount } }",
+        ]:
+            cache.get_document(schema_, query)
+        cache.get_document(schema_, "{ a: allProducts { totalCount } }")
+        cache.get_document(schema_, "{ c: allProducts { totalCount } }")
+
+        self.assertEqual(cache.stats()["evictions"], 1)
+        cache.get_document(schema_, "{ a: allProducts { totalCount } }")
+        self.assertEqual(cache.stats()["hits"], 2)
+
+
+class PersistedQueryTests(TestCase):
+    QUERY = "{ allProducts { edges { node { name } } } }"
+
+    def setUp(self):
+        persisted_queries.registered.clear()
+        response_cache.clear()
+        self.sha = documents.query_hash(self.QUERY)
+        Product.objects.create(name="Lamp", price=Decimal("5.00"))
+
+    def post(self, payload):
+        response = self.client.post(
+            "/graphql/", json.dumps(payload), content_type="application/json"
+        )
+        return response.json()
+
+    def apq(self, sha):
+        return {"persistedQuery": {"version": 1, "sha256Hash": sha}}
+
+    def test_hash_only_request_after_registration(self):
+        body = self.post({"extensions": self.apq(self.sha)})
+        self.assertEqual(body["errors"][0]["message"], "PersistedQueryNotFound")
+        self.assertEqual(
+            body["errors"][0]["extensions"]["code"], "PERSISTED_QUERY_NOT_FOUND"
+        )
+
+        self.post({"query": self.QUERY, "extensions": self.apq(self.sha)})
+        body = self.post({"extensions": self.apq(self.sha)})
+
+        self.assertEqual(
+            body["data"]["allProducts"]["edges"], [{"node": {"name": "Lamp"}}]
+        )
+
+    def test_get_requests_can_use_hashes(self):
+        self.post({"query": self.QUERY, "extensions": self.apq(self.sha)})
+        response = self.client.get(
+            "/graphql/",
+            {"extensions": json.dumps(self.apq(self.sha))},
+            HTTP_ACCEPT="application/json",
+        )
+
+        self.assertIn("Lamp", response.content.decode())
+
+    def test_mismatched_hash_is_rejected(self):
+        body = self.post({"query": self.QUERY, "extensions": self.apq("0" * 64)})
+
+        self.assertEqual(
+            body["errors"][0]["message"], "provided sha does not match query"
+        )
+
+    def test_manifest_queries_are_available_at_startup(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+            json.dump([self.QUERY], f)
+        self.addCleanup(os.remove, f.name)
+        store = documents.PersistedQueryStore()
+
+        self.assertEqual(store.load_manifest(f.name), 1)
+        self.assertEqual(store.get(self.sha), self.QUERY)
+
+
+class ResponseCacheTests(TestCase):
+    PRODUCTS = "{ allProducts { edges { node { name stock } } } }"
+    CUSTOMERS = "{ allCustomers { edges { node { name } } } }"
+
+    def setUp(self):
+        response_cache.clear()
+        self.product = Product.objects.create(name="Lamp", price=Decimal("5.00"))
+        self.customer = Customer.objects.create(name="Alice", email="a@example.com")
+
+    def post(self, query):
+        response = self.client.post(
+            "/graphql/", json.dumps({"query": query}), content_type="application/json"
+        )
+        return response.json()
+
+    def test_repeated_query_is_served_from_cache(self):
+        first = self.post(self.PRODUCTS)
+        with self.assertNumQueries(0):
+            second = self.post(self.PRODUCTS)
+
+        self.assertEqual(first["extensions"]["responseCache"], "MISS")
+        self.assertEqual(second["extensions"]["responseCache"], "HIT")
+        self.assertEqual(first["data"], second["data"])
+        self.assertEqual(response_cache.stats()["hits"], 1)
+
+    def test_lru_entries_expire_after_timeout(self):
+        cache = ResponseCache(LRUBackend(10), 60)
+        with patch("crm.views.response_cache", cache):
+            self.post(self.PRODUCTS)
+            # update() sends no signals, so nothing bumps the product tag.
+            Product.objects.update(stock=7)
+            self.assertEqual(
+                self.post(self.PRODUCTS)["extensions"]["responseCache"], "HIT"
+            )
+
+            later = time.monotonic() + 61
+            with patch("crm.response_cache.time.monotonic", return_value=later):
+                body = self.post(self.PRODUCTS)
+
+        self.assertEqual(body["extensions"]["responseCache"], "MISS")
+        self.assertEqual(body["data"]["allProducts"]["edges"][0]["node"]["stock"], 7)
+
+    def test_save_invalidates_only_queries_reading_that_model(self):
+        self.post(self.PRODUCTS)
+        self.post(self.CUSTOMERS)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=self.product.pk).update(stock=3)
+            self.product.refresh_from_db()
+            self.product.save()
+
+        body = self.post(self.PRODUCTS)
+        self.assertEqual(body["extensions"]["responseCache"], "MISS")
+        self.assertEqual(body["data"]["allProducts"]["edges"][0]["node"]["stock"], 3)
+        self.assertEqual(
+            self.post(self.CUSTOMERS)["extensions"]["responseCache"], "HIT"
+        )
+
+    def test_nested_types_are_tagged(self):
+        query = (
+            "{ allCustomers { edges { node { orders { edges { node { id } } } } } } }"
+        )
+        self.post(query)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            order = Order.objects.create(customer=self.customer)
+        self.assertEqual(self.post(query)["extensions"]["responseCache"], "MISS")
+
+        self.post(query)
+        with self.captureOnCommitCallbacks(execute=True):
+            order.products.add(self.product, through_defaults={"unit_price": 1})
+        self.assertEqual(self.post(query)["extensions"]["responseCache"], "MISS")
+
+    def test_bulk_writes_invalidate(self):
+        self.post(self.PRODUCTS)
+        with self.captureOnCommitCallbacks(execute=True):
+            services.restock_low_stock(threshold=10, increment=5)
+
+        body = self.post(self.PRODUCTS)
+        self.assertEqual(body["extensions"]["responseCache"], "MISS")
+        self.assertEqual(body["data"]["allProducts"]["edges"][0]["node"]["stock"], 5)
+
+    def test_mutations_and_other_root_fields_are_not_cached(self):
+        parsed = lambda q: document_cache.get_document(schema.graphql_schema, q)[0]
+        graphql_schema = schema.graphql_schema
+
+        self.assertIsNone(
+            operation_tags(
+                graphql_schema,
+                parsed(
+                    'mutation { createProduct(name: "X", price: 1) { product { id } } }'
+                ),
+            )
+        )
+        self.assertIsNone(
+            operation_tags(graphql_schema, parsed("{ cacheStats { name hits } }"))
+        )
+        self.assertEqual(
+            operation_tags(graphql_schema, parsed(self.PRODUCTS)), {"crm.product"}
+        )
+
+        # Root fields inside fragments are checked too.
+        for query in [
+            "{ allProducts { edges { node { name } } } "
+            '... on Query { jobStatus(id: "1") { status } } }',
+            "{ ...allProducts } fragment allProducts on Query { cacheStats { hits } }",
+            "{ ... on Query { ...summary } } "
+            "fragment summary on Query { salesSummary { revenue } }",
+        ]:
+            self.assertIsNone(operation_tags(graphql_schema, parsed(query)), query)
+        self.assertEqual(
+            operation_tags(
+                graphql_schema,
+                parsed(
+                    "{ ... on Query { ...products } } "
+                    "fragment products on Query { allProducts { totalCount } }"
+                ),
+            ),
+            {"crm.product"},
+        )
+
+    @override_settings(CRM_RESPONSE_CACHE={"ENABLED": False})
+    def test_disabled(self):
+        self.post(self.PRODUCTS)
+        self.assertNotIn("responseCache", self.post(self.PRODUCTS)["extensions"])
+
+    def test_stats_are_exposed(self):
+        self.post(self.PRODUCTS)
+        self.post(self.PRODUCTS)
+
+        stats = {
+            s["name"]: s
+            for s in self.post("{ cacheStats { name hits misses } }")["data"][
+                "cacheStats"
+            ]
+        }
+        self.assertEqual(stats["responses"]["hits"], 1)
+        self.assertEqual(stats["responses"]["misses"], 1)
+
+
+@override_settings(CRM_ASYNC_PARALLEL_FIELDS=False)
+class AsyncViewTests(TestCase):
+    QUERY = """
+    {
+        allCustomers(first: 10) { edges { node { name orders(first: 10) {
+            totalCount edges { node {
+                totalAmount customer { name }
+                products(first: 10) { edges { node { name } } }
+            } }
+        } } } }
+        allProducts(first: 2) { totalCount edges { node { name stock } } }
+    }
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = Customer.objects.create(name="Alice", email="a@example.com")
+        cls.products = [
+            Product.objects.create(name=f"P{i}", price=Decimal("2.50"), stock=i)
+            for i in range(3)
+        ]
+        order = Order.objects.create(customer=cls.customer, total_amount=5)
+        order.products.set(cls.products[:2], through_defaults={"unit_price": 2.5})
+
+    def setUp(self):
+        response_cache.clear()
+
+    async def post(self, query, path="/graphql/async/"):
+        response = await self.async_client.post(
+            path, json.dumps({"query": query}), content_type="application/json"
+        )
+        return response.json()
+
+    async def test_matches_sync_view(self):
+        body = await self.post(self.QUERY)
+        response_cache.clear()
+        expected = await self.post(self.QUERY, path="/graphql/")
+
+        self.assertNotIn("errors", body)
+        self.assertEqual(body["data"], expected["data"])
+        self.assertEqual(body["data"]["allProducts"]["totalCount"], 3)
+
+    async def test_node_field(self):
+        global_id = to_global_id("CustomerType", self.customer.pk)
+        body = await self.post(f'{{ customer(id: "{global_id}") {{ email }} }}')
+        self.assertEqual(body["data"]["customer"], {"email": "a@example.com"})
+
+    async def test_mutations(self):
+        body = await self.post(
+            'mutation { createCustomer(name: "Bob", email: "b@example.com") '
+            "{ customer { name } message } }"
+        )
+        self.assertEqual(body["data"]["createCustomer"]["customer"], {"name": "Bob"})
+
+        body = await self.post(
+            'mutation { createCustomer(name: "Bob", email: "b@example.com") '
+            "{ message } }"
+        )
+        self.assertEqual(body["errors"][0]["message"], "Email already exists")
+
+        customer_id = self.customer.pk
+        product_id = self.products[2].pk
+        body = await self.post(
+            f"mutation {{ createOrder(customerId: {customer_id}, "
+            f"items: [{{productId: {product_id}, quantity: 2}}]) "
+            "{ order { totalAmount products { edges { node { name } } } } } }"
+        )
+        self.assertNotIn("errors", body)
+        self.assertEqual(
+            body["data"]["createOrder"]["order"]["products"]["edges"],
+            [{"node": {"name": "P2"}}],
+        )
+
+    async def test_mutation_idempotency_key(self):
+        mutations = [
+            'mutation { createCustomer(name: "Bob", email: "b@example.com", '
+            'idempotencyKey: "k1") { customer { name email } message } }',
+            'mutation { createProduct(name: "Lamp", price: 5, '
+            'idempotencyKey: "k2") { product { name stock } } }',
+        ]
+        for mutation in mutations:
+            first = await self.post(mutation)
+            retry = await self.post(mutation)
+            self.assertNotIn("errors", first)
+            self.assertEqual(retry, first)
+
+        self.assertEqual(await Customer.objects.filter(name="Bob").acount(), 1)
+        self.assertEqual(await Product.objects.filter(name="Lamp").acount(), 1)
+
+
+@override_settings(CRM_RESPONSE_CACHE={"ENABLED": False})
+class GraphQLBatchTests(TestCase):
+    ORDERS = "{ allCustomers { edges { node { name orders { edges { node { totalAmount } } } } } } }"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = Customer.objects.create(name="Alice", email="a@example.com")
+        cls.product = Product.objects.create(
+            name="Lamp", price=Decimal("5.00"), stock=10
+        )
+        order = Order.objects.create(customer=cls.customer, total_amount=5)
+        order.products.set([cls.product], through_defaults={"unit_price": 5})
+
+    def post(self, data, path="/graphql/"):
+        return self.client.post(path, json.dumps(data), content_type="application/json")
+
+    def order_totals(self, result):
+        customer = result["data"]["allCustomers"]["edges"][0]["node"]
+        return [edge["node"]["totalAmount"] for edge in customer["orders"]["edges"]]
+
+    def test_results_in_order(self):
+        response = self.post(
+            [
+                {"id": "a", "query": "{ allProducts { edges { node { name } } } }"},
+                {"id": "b", "query": "{ allCustomers { edges { node { email } } } }"},
+                {"id": "c", "query": "{ nope }"},
+            ]
+        )
+        # The response status is the highest of the operations' statuses.
+        self.assertEqual(response.status_code, 400)
+        body = response.json()
+        self.assertEqual([entry["id"] for entry in body], ["a", "b", "c"])
+        self.assertEqual([entry["status"] for entry in body], [200, 200, 400])
+        self.assertEqual(
+            body[0]["data"]["allProducts"]["edges"], [{"node": {"name": "Lamp"}}]
+        )
+        self.assertEqual(
+            body[1]["data"]["allCustomers"]["edges"],
+            [{"node": {"email": "a@example.com"}}],
+        )
+        self.assertIn("errors", body[2])
+
+    # Without the optimizer's prefetching, relations are read by DataLoaders.
+    @override_settings(CRM_QUERY_OPTIMIZER=False)
+    def test_operations_share_loaders(self):
+        with CaptureQueriesContext(connection) as single:
+            self.post({"query": self.ORDERS})
+        with CaptureQueriesContext(connection) as batch:
+            body = self.post([{"query": self.ORDERS}] * 2).json()
+
+        self.assertEqual(body[0]["data"], body[1]["data"])
+        # The second operation reads the orders the first one loaded.
+        self.assertLess(len(batch), 2 * len(single))
+
+    @override_settings(CRM_QUERY_OPTIMIZER=False)
+    def test_mutation_resets_loaders(self):
+        mutation = (
+            f"mutation {{ createOrder(customerId: {self.customer.pk}, "
+            f"items: [{{productId: {self.product.pk}, quantity: 2}}]) "
+            "{ order { id } } }"
+        )
+        body = self.post(
+            [{"query": self.ORDERS}, {"query": mutation}, {"query": self.ORDERS}]
+        ).json()
+
+        self.assertNotIn("errors", body[1])
+        self.assertEqual(len(self.order_totals(body[0])), 1)
+        self.assertEqual(len(self.order_totals(body[2])), 2)
+
+    def test_rejected_batches(self):
+        response = self.post([])
+        self.assertEqual(response.status_code, 400)
+
+        response = self.post(
+            [
+                {"query": "{ allProducts { totalCount } }"},
+                "{ allProducts { totalCount } }",
+            ]
+        )
+        self.assertEqual(response.status_code, 400)
+
+        with override_settings(CRM_GRAPHQL_BATCH={"MAX_SIZE": 2}):
+            response = self.post([{"query": "{ allProducts { totalCount } }"}] * 3)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(b"exceeds the maximum of 2", response.content)
+
+        with override_settings(CRM_GRAPHQL_BATCH={"ENABLED": False}):
+            response = self.post([{"query": "{ allProducts { totalCount } }"}])
+            self.assertEqual(response.status_code, 400)
+            response = self.post({"query": "{ allProducts { totalCount } }"})
+            self.assertEqual(response.status_code, 200)
+
+    @override_settings(CRM_ASYNC_PARALLEL_FIELDS=False)
+    async def test_async_view(self):
+        response = await self.async_client.post(
+            "/graphql/async/",
+            json.dumps(
+                [
+                    {"query": self.ORDERS},
+                    {"query": "{ allProducts { edges { node { stock } } } }"},
+                ]
+            ),
+            content_type="application/json",
+        )
+        body = response.json()
+        self.assertEqual(self.order_totals(body[0]), ["5.00"])
+        self.assertEqual(
+            body[1]["data"]["allProducts"]["edges"], [{"node": {"stock": 10}}]
+        )
+
+
+class AsyncParallelFieldsTests(TransactionTestCase):
+    def setUp(self):
+        response_cache.clear()
+        Customer.objects.create(name="Alice", email="a@example.com")
+        Product.objects.create(name="Lamp", price=Decimal("5.00"))
+
+    @override_settings(CRM_ASYNC_PARALLEL_FIELDS=True)
+    def test_root_fields_run_concurrently(self):
+        # Both root fields must be fetching at the same time to pass the
+        # barrier; run one after the other, the first would time out.
+        barrier = threading.Barrier(2, timeout=5)
+        fetch_page = AsyncKeysetConnectionField.fetch_page
+
+        def waiting_fetch_page(field, *args):
+            barrier.wait()
+            return fetch_page(field, *args)
+
+        with patch.object(AsyncKeysetConnectionField, "fetch_page", waiting_fetch_page):
+            response = self.client.post(
+                "/graphql/async/",
+                json.dumps(
+                    {
+                        "query": "{ allCustomers { edges { node { name } } } "
+                        "allProducts { edges { node { name } } } }"
+                    }
+                ),
+                content_type="application/json",
+            )
+
+        body = response.json()
+        self.assertNotIn("errors", body)
+        self.assertEqual(
+            body["data"]["allCustomers"]["edges"], [{"node": {"name": "Alice"}}]
+        )
+        self.assertEqual(
+            body["data"]["allProducts"]["edges"], [{"node": {"name": "Lamp"}}]
+        )
+
+
+class QueryCostTests(TestCase):
+    def analyze(self, query, variables=None):
+        document = document_cache.get_document(schema.graphql_schema, query)[0]
+        return cost.analyze(schema.graphql_schema, document, variables=variables)
+
+    def post(self, query, variables=None, **headers):
+        response = self.client.post(
+            "/graphql/",
+            json.dumps({"query": query, "variables": variables}),
+            content_type="application/json",
+            headers=headers,
+        )
+        return response.json()
+
+    def test_cost_multiplies_page_sizes_through_nesting(self):
+        query_cost = self.analyze(
+            """
+            query ($n: Int) {
+                allCustomers(first: 10) { totalCount edges { node {
+                    name
+                    orders(first: $n) { edges { node { customer { name } } } }
+                } } }
+            }
+            """,
+            {"n": 5},
+        )
+        # 10 customers * (1 + 5 orders * (1 + 1 customer))
+        self.assertEqual(query_cost.cost, 10 * (1 + 5 * 2))
+        self.assertEqual(query_cost.depth, 3)
+
+    def test_missing_page_size_uses_the_connection_limit(self):
+        query_cost = self.analyze("{ allProducts { edges { node { name } } } }")
+        self.assertEqual(query_cost.cost, 100)
+
+    def test_fragments_and_introspection(self):
+        query_cost = self.analyze("""
+            { __schema { types { name fields { name type { name } } } }
+              allOrders(first: 2) { ...orders } }
+            fragment orders on OrderTypeConnection {
+                edges { node { products(first: 3) { edges { node { name } } } } }
+            }
+            """)
+        self.assertEqual(query_cost.cost, 2 * (1 + 3))
+        self.assertEqual(query_cost.depth, 2)
+
+    def test_negative_page_sizes_cost_nothing(self):
+        query_cost = self.analyze("""
+            { products: allProducts(first: -100000) { edges { node { name } } }
+              allCustomers(first: 2) { edges { node {
+                  orders(first: -5) { edges { node { id } } }
+              } } } }
+            """)
+        self.assertEqual(query_cost.cost, 2)
+
+    @override_settings(CRM_QUERY_COST={"MAX_COST": 50})
+    def test_negative_page_size_does_not_hide_siblings(self):
+        body = self.post("""
+            { products: allProducts(first: -100000) { edges { node { name } } }
+              allOrders(first: 100) { edges { node { customer { name } } } } }
+            """)
+        self.assertNotIn("data", body)
+        self.assertEqual(body["errors"][0]["extensions"]["code"], "QUERY_TOO_COMPLEX")
+
+    def test_fragment_cycles_are_validation_errors(self):
+        query = """
+            { allProducts(first: 1) { ...a } }
+            fragment a on ProductTypeConnection { ...b }
+            fragment b on ProductTypeConnection { ...a }
+            """
+        document = parse(query)
+        query_cost = cost.CostAnalyzer(schema.graphql_schema, document).analyze(
+            document.definitions[0]
+        )
+        self.assertEqual(query_cost.cost, 1)
+
+        body = self.post(query)
+        self.assertNotIn("data", body)
+        self.assertIn("Cannot spread fragment", body["errors"][0]["message"])
+
+    def test_deep_query_is_rejected_before_execution(self):
+        query = """
+        { allOrders(first: 1) { edges { node { customer { orders(first: 1) {
+            edges { node { products(first: 1) { edges { node {
+                orders(first: 1) { edges { node { customer { orders(first: 1) {
+                    edges { node { id } } } } } } }
+            } } } } } } } } } } }
+        """
+        with self.assertNumQueries(0):
+            body = self.post(query)
+
+        self.assertNotIn("data", body)
+        self.assertEqual(body["errors"][0]["extensions"]["code"], "QUERY_TOO_DEEP")
+        self.assertEqual(body["extensions"]["cost"]["depth"], 7)
+
+    @override_settings(CRM_QUERY_COST={"MAX_COST": 50, "BUDGETS": {"reporting": 1000}})
+    def test_per_client_budgets(self):
+        query = "{ allProducts(first: $n) { edges { node { name } } } }"
+        query = "query ($n: Int) " + query
+
+        body = self.post(query, {"n": 40})
+        self.assertEqual(body["extensions"]["cost"]["requested"], 40)
+        self.assertIn("data", body)
+
+        body = self.post(query, {"n": 100})
+        self.assertEqual(body["errors"][0]["extensions"]["code"], "QUERY_TOO_COMPLEX")
+
+        body = self.post(query, {"n": 100}, x_client_id="reporting")
+        self.assertNotIn("errors", body)
+        self.assertEqual(
+            body["extensions"]["cost"],
+            {
+                "requested": 100,
+                "budget": 1000,
+                "depth": 1,
+                "maxDepth": 6,
+                "client": "reporting",
+            },
+        )
+
+    @override_settings(CRM_QUERY_COST={"MAX_COST": 50})
+    def test_validation_rule(self):
+        document = parse("{ allProducts { edges { node { name } } } }")
+        errors = validate(schema.graphql_schema, document, [cost.QueryCostRule])
+        self.assertEqual(
+            [e.message for e in errors], ["Query cost 100 exceeds the budget of 50."]
+        )
+
+
+class TracingTests(TestCase):
+    QUERY = "{ allOrders { edges { node { totalAmount customer { name } } } } }"
+
+    @classmethod
+    def setUpTestData(cls):
+        customer = Customer.objects.create(name="Alice", email="a@example.com")
+        for _ in range(2):
+            Order.objects.create(customer=customer, total_amount=5)
+
+    def setUp(self):
+        response_cache.clear()
+        staff = get_user_model().objects.create_user("staff", is_staff=True)
+        self.client.force_login(staff)
+
+    def post(self, query, path="/graphql/", **headers):
+        response = self.client.post(
+            path,
+            json.dumps({"query": query}),
+            content_type="application/json",
+            headers=headers,
+        )
+        return response.json()
+
+    def test_untraced_requests_have_no_trace(self):
+        body = self.post(self.QUERY)
+        self.assertNotIn("tracing", body["extensions"])
+        self.assertIsNone(tracing.current_trace.get())
+
+    def test_header_is_ignored_for_anonymous_users(self):
+        self.client.logout()
+        self.assertNotIn(
+            "tracing", self.post(self.QUERY, x_crm_trace="1")["extensions"]
+        )
+        body = self.post(self.QUERY, path="/graphql/async/", x_crm_trace="1")
+        self.assertNotIn("tracing", body["extensions"])
+
+        with override_settings(DEBUG=True):
+            body = self.post(self.QUERY, x_crm_trace="1")
+        self.assertIn("tracing", body["extensions"])
+
+    @override_settings(CRM_DATALOADERS=False, CRM_QUERY_OPTIMIZER=False)
+    def test_header_returns_trace_with_sql_per_field_path(self):
+        body = self.post(self.QUERY, x_crm_trace="1")
+        trace = body["extensions"]["tracing"]
+        sql = body["extensions"]["sql"]
+
+        self.assertEqual(trace["version"], 1)
+        self.assertIsNotNone(trace["parsing"])
+        paths = [r["path"] for r in trace["execution"]["resolvers"]]
+        self.assertIn(["allOrders", "edges", 1, "node", "customer"], paths)
+
+        self.assertEqual(sql["byPath"]["allOrders"]["count"], 1)
+        self.assertEqual(sql["byPath"]["allOrders.edges.node.customer"]["count"], 2)
+        self.assertEqual(sql["count"], 3)
+        # Both orders load the same customer row: an N+1 duplicate.
+        self.assertEqual(len(sql["duplicates"]), 1)
+        self.assertEqual(sql["duplicates"][0]["count"], 2)
+        self.assertEqual(
+            sql["duplicates"][0]["paths"], ["allOrders.edges.node.customer"]
+        )
+
+    def test_batched_query_has_no_duplicates(self):
+        sql = self.post(self.QUERY, x_crm_trace="1")["extensions"]["sql"]
+        self.assertEqual(sql["duplicates"], [])
+
+    @override_settings(CRM_ASYNC_PARALLEL_FIELDS=False)
+    def test_async_view_attributes_queries(self):
+        body = self.post(self.QUERY, path="/graphql/async/", x_crm_trace="1")
+        sql = body["extensions"]["sql"]
+        self.assertIn("allOrders", sql["byPath"])
+        self.assertEqual(sql["count"], sum(e["count"] for e in sql["byPath"].values()))
+
+    def test_document_cache_miss_records_parsing_once(self):
+        phases = []
+        phase = tracing.phase
+
+        def recording_phase(name):
+            phases.append(name)
+            return phase(name)
+
+        with patch("crm.tracing.phase", recording_phase):
+            document_cache.get_document(schema.graphql_schema, "{ hello } # miss")
+            document_cache.get_document(schema.graphql_schema, "{ hello } # miss")
+
+        self.assertEqual(phases, ["parsing", "validation", "parsing", "validation"])
+
+    def test_sampled_traces_are_written_to_sinks(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            jsonl = os.path.join(tmp, "traces.jsonl")
+            prom = os.path.join(tmp, "crm.prom")
+            config = {"SAMPLE_RATE": 1.0, "JSONL_PATH": jsonl, "PROMETHEUS_PATH": prom}
+            with override_settings(CRM_TRACING=config):
+                body = self.post(self.QUERY)
+                self.post("query Named " + self.QUERY)
+
+            self.assertNotIn("tracing", body["extensions"])
+            with open(jsonl) as f:
+                records = [json.loads(line) for line in f]
+            self.assertEqual(
+                [r["operationName"] for r in records], ["allOrders", "Named"]
+            )
+            self.assertIn("serialization", records[0]["phases"])
+            self.assertIn("allOrders.edges.node", records[0]["resolvers"])
+
+            with open(prom) as f:
+                metrics = f.read()
+            self.assertIn(
+                'crm_graphql_traced_operations_total{operation="Named"} 1', metrics
+            )
+            self.assertIn("# TYPE crm_graphql_sql_queries_total counter", metrics)
+            self.assertIn(
+                "# TYPE crm_graphql_operation_duration_seconds_total counter", metrics
+            )
+            self.assertNotIn("gauge", metrics)
+
+
+class GraphQLClientTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        customer = Customer.objects.create(name="Alice", email="a@example.com")
+        cls.recent = Order.objects.create(customer=customer, total_amount=5)
+        cls.old = Order.objects.create(customer=customer, total_amount=5)
+        Order.objects.filter(pk=cls.old.pk).update(
+            order_date=timezone.now() - timezone.timedelta(days=30)
+        )
+
+    def test_in_process_execution(self):
+        client = GraphQLClient(InProcessTransport())
+        with self.assertNumQueries(0):
+            self.assertEqual(client.execute("{ hello }"), {"hello": "Hello, GraphQL!"})
+
+        with self.assertRaisesMessage(GraphQLClientError, "Cannot query field"):
+            client.execute("{ nope }")
+
+    def test_pending_order_reminders_follow_the_date_filter(self):
+        from crm.cron_jobs.send_order_reminders import get_pending_orders
+
+        orders = get_pending_orders()
+        self.assertEqual(
+            [o["id"] for o in orders], [to_global_id("OrderType", self.recent.pk)]
+        )
+        self.assertEqual(orders[0]["customer_email"], "a@example.com")
+
+    def test_update_low_stock_cron_logs_restocked_products(self):
+        from crm import cron
+
+        Product.objects.create(name="Lamp", price=Decimal("5.00"), stock=2)
+        log = mock_open()
+        with patch("crm.cron.open", log, create=True):
+            cron.update_low_stock()
+
+        written = "".join(c.args[0] for c in log().write.call_args_list)
+        self.assertIn("Updated Lamp: 12", written)
+
+    def test_update_low_stock_cron_logs_graphql_errors(self):
+        from crm import cron
+
+        client = GraphQLClient(InProcessTransport())
+        log = mock_open()
+        with patch("crm.cron.get_client", return_value=client):
+            with patch("crm.services.restock_low_stock", side_effect=Exception("boom")):
+                with patch("crm.cron.open", log, create=True):
+                    cron.update_low_stock()
+
+        written = "".join(c.args[0] for c in log().write.call_args_list)
+        self.assertIn("GraphQL Error: boom", written)
+
+    def test_http_transport_keeps_the_connection_alive(self):
+        ports = set()
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                ports.add(self.client_address[1])
+                self.rfile.read(int(self.headers["Content-Length"]))
+                body = json.dumps({"data": {"hello": "hi"}}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            transport = HTTPTransport(f"http://127.0.0.1:{server.server_port}/graphql/")
+            client = GraphQLClient(transport)
+            for _ in range(3):
+                self.assertEqual(client.execute("{ hello }"), {"hello": "hi"})
+            transport.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(len(ports), 1)
+
+
+class OrderReminderPipelineTests(TestCase):
+    def setUp(self):
+        self.customer = Customer.objects.create(name="Alice", email="a@example.com")
+        self.orders = [
+            Order.objects.create(customer=self.customer, total_amount=i)
+            for i in range(5)
+        ]
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.log = os.path.join(tmp.name, "reminders.log")
+        self.checkpoint = os.path.join(tmp.name, "checkpoint.json")
+
+    def run_reminders(self, **kwargs):
+        with patch("builtins.print"):
+            return reminders.send_order_reminders(
+                self.log, self.checkpoint, page_size=2, **kwargs
+            )
+
+    def logged_ids(self):
+        with open(self.log) as f:
+            return [line.split("Order ID: ")[1].split(",")[0] for line in f]
+
+    def test_pages_are_streamed(self):
+        pages = []
+        execute = GraphQLClient.execute
+
+        def counting_execute(client, query, variables=None, operation_name=None):
+            pages.append(variables["after"])
+            return execute(client, query, variables, operation_name)
+
+        with patch.object(GraphQLClient, "execute", counting_execute):
+            orders = reminders.iter_pending_orders(page_size=2)
+            next(orders)
+            self.assertEqual(len(pages), 1)
+            self.assertEqual(len(list(orders)), 4)
+        self.assertEqual(len(pages), 3)
+
+    def test_each_order_is_logged_once_across_runs(self):
+        self.assertEqual(self.run_reminders(batch_size=2), 5)
+        self.assertEqual(self.run_reminders(batch_size=2), 0)
+
+        new = Order.objects.create(customer=self.customer, total_amount=9)
+        self.assertEqual(self.run_reminders(batch_size=2), 1)
+
+        expected = [to_global_id("OrderType", o.pk) for o in [*self.orders, new]]
+        self.assertEqual(self.logged_ids(), expected)
+        self.assertEqual(
+            reminders.load_checkpoint(self.checkpoint)["order_id"], expected[-1]
+        )
+
+    def test_interrupted_run_resumes_after_last_batch(self):
+        orders = reminders.iter_pending_orders(page_size=2)
+        failing = (o if i < 3 else 1 / 0 for i, o in enumerate(orders))
+        with self.assertRaises(ZeroDivisionError):
+            reminders.write_reminders(failing, self.log, self.checkpoint, batch_size=2)
+
+        # The first batch of two was written and checkpointed; the third
+        # order was still buffered and is picked up by the next run.
+        self.assertEqual(len(self.logged_ids()), 2)
+        self.assertEqual(self.run_reminders(batch_size=2), 3)
+        self.assertEqual(len(self.logged_ids()), 5)
+
+
+flaky_calls = []
+
+
+@jobs.task(max_attempts=2, retry_delay=0)
+def flaky_task(fail_times):
+    flaky_calls.append(fail_times)
+    if len(flaky_calls) <= fail_times:
+        raise RuntimeError("try again")
+    return {"calls": len(flaky_calls)}
+
+
+@jobs.task(max_attempts=1)
+def slow_task(seconds):
+    time.sleep(seconds)
+    return {"slept": seconds}
+
+
+class JobQueueTests(TestCase):
+    JOB_QUERY = """
+        query ($id: ID!) { jobStatus(id: $id) { status attempts result error } }
+    """
+
+    def setUp(self):
+        flaky_calls.clear()
+        self.worker = jobs.Worker(queues={"default": 1, "heavy": 1}, schedule=[])
+
+    def test_retries_until_success(self):
+        job = jobs.enqueue(flaky_task, {"fail_times": 1})
+
+        self.assertEqual(self.worker.run_pending(), 2)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual(job.attempts, 2)
+        self.assertEqual(job.result, {"calls": 2})
+
+    def test_fails_after_max_attempts(self):
+        job = jobs.enqueue(flaky_task, {"fail_times": 5})
+
+        self.worker.run_pending()
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.attempts, 2)
+        self.assertIn("RuntimeError: try again", job.error)
+
+    def test_claim_is_exclusive_until_the_lease_expires(self):
+        job = jobs.enqueue(flaky_task, {"fail_times": 0})
+
+        self.assertEqual(jobs.claim("default", "a").pk, job.pk)
+        self.assertIsNone(jobs.claim("default", "b"))
+
+        Job.objects.filter(pk=job.pk).update(
+            lease_expires_at=timezone.now() - timedelta(seconds=1)
+        )
+        reclaimed = jobs.claim("default", "b")
+        self.assertEqual((reclaimed.worker, reclaimed.attempts), ("b", 2))
+
+    def test_claims_record_the_thread(self):
+        jobs.enqueue(flaky_task, {"fail_times": 0})
+
+        self.worker.run_pending()
+
+        self.assertEqual(
+            Job.objects.get().worker,
+            f"{self.worker.worker_id}:{threading.get_ident()}",
+        )
+
+    def test_lease_renewal_stops_once_the_job_is_reclaimed(self):
+        job = jobs.enqueue(flaky_task, {"fail_times": 0})
+        claimed = jobs.claim("default", "a")
+        self.assertEqual(jobs.renew_lease(claimed, 3600), 1)
+        claimed.refresh_from_db()
+        self.assertGreater(
+            claimed.lease_expires_at, timezone.now() + timedelta(minutes=59)
+        )
+
+        Job.objects.filter(pk=job.pk).update(
+            lease_expires_at=timezone.now() - timedelta(seconds=1)
+        )
+        jobs.claim("default", "a")
+        # Same worker id, but a later attempt: the old claim is lost.
+        self.assertEqual(jobs.renew_lease(claimed, 3600), 0)
+
+    @override_settings(CRM_JOBS={"LEASE_SECONDS": 0.03})
+    def test_lease_is_renewed_while_the_job_runs(self):
+        jobs.enqueue(slow_task, {"seconds": 0.2})
+
+        # Patched so the heartbeat thread stays off the test database.
+        with patch("crm.jobs.renew_lease", return_value=1) as renew_lease:
+            self.worker.run_pending()
+
+        self.assertGreaterEqual(renew_lease.call_count, 2)
+        self.assertEqual(Job.objects.get().status, Job.SUCCEEDED)
+
+    def test_schedule_enqueues_each_run_once(self):
+        schedule = [(300, "crm.jobs.prune_jobs")]
+        now = timezone.now()
+
+        first = jobs.enqueue_due(schedule, now)
+        again = jobs.enqueue_due(schedule, now)
+
+        self.assertEqual(first, again)
+        self.assertEqual(Job.objects.count(), 1)
+
+    def test_worker_enqueues_only_when_a_new_slot_is_due(self):
+        worker = jobs.Worker(schedule=[(300, "crm.jobs.prune_jobs")])
+        now = timezone.now()
+
+        self.assertEqual(len(worker.enqueue_scheduled(now)), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(worker.enqueue_scheduled(now), [])
+        self.assertEqual(len(worker.enqueue_scheduled(now + timedelta(seconds=300))), 1)
+        self.assertEqual(Job.objects.count(), 2)
+
+    def test_restock_in_background_returns_a_job(self):
+        Product.objects.create(name="Low", price=Decimal("1.00"), stock=1)
+
+        result = execute("""
+            mutation {
+                updateLowStockProducts(background: true) {
+                    products { name }
+                    job { id status }
+                }
+            }
+            """)
+        self.assertIsNone(result.errors)
+        payload = result.data["updateLowStockProducts"]
+        self.assertIsNone(payload["products"])
+        self.assertEqual(payload["job"]["status"], "QUEUED")
+        self.assertEqual(Product.objects.get().stock, 1)
+
+        self.worker.run_pending()
+
+        self.assertEqual(Product.objects.get().stock, 11)
+        status = execute(self.JOB_QUERY, {"id": payload["job"]["id"]})
+        self.assertIsNone(status.errors)
+        job = status.data["jobStatus"]
+        self.assertEqual((job["status"], job["attempts"]), ("SUCCEEDED", 1))
+        self.assertEqual(json.loads(job["result"])["products"][0]["stock"], 11)
+
+    def test_bulk_create_customers_in_background(self):
+        Customer.objects.create(name="Taken", email="taken@x.com")
+        result = execute(
+            """
+            mutation ($customers: [CustomerInput]!) {
+                bulkCreateCustomers(customers: $customers, background: true) {
+                    job { id }
+                }
+            }
+            """,
+            {
+                "customers": [
+                    {"name": "New", "email": "new@x.com"},
+                    {"name": "Dup", "email": "taken@x.com"},
+                ]
+            },
+        )
+        self.assertIsNone(result.errors)
+
+        self.worker.run_pending()
+
+        job = Job.objects.get()
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual(job.queue, "heavy")
+        new = Customer.objects.get(email="new@x.com")
+        self.assertEqual(
+            job.result,
+            {
+                "customers": [to_global_id("CustomerType", new.pk)],
+                "errors": ["Email already exists: taken@x.com"],
+            },
+        )
+
+
+class JobWorkerPoolTests(TransactionTestCase):
+    def test_queue_concurrency_is_limited(self):
+        running = []
+        peak = []
+        done = []
+        lock = threading.Lock()
+        worker = jobs.Worker(queues={"default": 2}, poll_interval=0.01, schedule=[])
+
+        # Stays off the database: pool threads writing to the shared
+        # in-memory test database can fail with "table is locked".
+        def fake_run_job(job):
+            with lock:
+                running.append(job.pk)
+                peak.append(len(running))
+            threading.Event().wait(0.05)
+            with lock:
+                running.remove(job.pk)
+                done.append(job.pk)
+                if len(done) == 6:
+                    worker.stop()
+
+        for _ in range(6):
+            jobs.enqueue(flaky_task, {"fail_times": 0})
+        # Never hang the suite if a job goes missing.
+        watchdog = threading.Timer(10, worker.stop)
+        watchdog.start()
+        try:
+            with patch("crm.jobs.run_job", fake_run_job):
+                worker.run()
+        finally:
+            watchdog.cancel()
+
+        self.assertEqual(sorted(done), sorted(Job.objects.values_list("pk", flat=True)))
+        self.assertEqual(max(peak), 2)
+
+
+class SalesAnalyticsTests(TestCase):
+    QUERY = """
+        query ($customerId: ID!) {
+            salesSummary { orderCount revenue averageOrderValue days { orderCount } }
+            topProducts(first: 2) { product { name } unitsSold orderCount revenue }
+            customerLifetimeValue(customerId: $customerId) {
+                orderCount totalSpent averageOrderValue
+            }
+        }
+    """
+
+    def setUp(self):
+        self.alice = Customer.objects.create(name="Alice", email="a@x.com")
+        self.bob = Customer.objects.create(name="Bob", email="b@x.com")
+        self.pen = Product.objects.create(name="Pen", price=Decimal("2.00"), stock=50)
+        self.ink = Product.objects.create(name="Ink", price=Decimal("5.00"), stock=50)
+
+    def summary(self):
+        return {
+            "days": list(DailySales.objects.values_list("order_count", "revenue")),
+            "customers": sorted(
+                CustomerSales.objects.values_list(
+                    "customer_id", "order_count", "total_spent"
+                )
+            ),
+            "products": sorted(
+                ProductSales.objects.values_list(
+                    "product_id", "order_count", "units_sold", "revenue"
+                )
+            ),
+        }
+
+    def test_create_order_updates_summaries(self):
+        services.create_order(self.alice.pk, {self.pen.pk: 3, self.ink.pk: 1})
+        services.create_order(self.alice.pk, {self.pen.pk: 1})
+
+        self.assertEqual(
+            self.summary(),
+            {
+                "days": [(2, Decimal("13.00"))],
+                "customers": [(self.alice.pk, 2, Decimal("13.00"))],
+                "products": [
+                    (self.pen.pk, 2, 4, Decimal("8.00")),
+                    (self.ink.pk, 1, 1, Decimal("5.00")),
+                ],
+            },
+        )
+
+    def test_bulk_orders_update_summaries_in_a_few_statements(self):
+        rows = [
+            type("Row", (), {"customer_id": c.pk, "product_ids": [self.pen.pk]})
+            for c in [self.alice, self.bob] * 10
+        ]
+        with CaptureQueriesContext(connection) as ctx:
+            services.bulk_create_orders(rows)
+
+        upserts = [q for q in ctx.captured_queries if "ON CONFLICT" in q["sql"]]
+        self.assertEqual(len(upserts), 3)
+        self.assertEqual(
+            self.summary()["customers"],
+            [
+                (self.alice.pk, 10, Decimal("20.00")),
+                (self.bob.pk, 10, Decimal("20.00")),
+            ],
+        )
+        self.assertEqual(
+            self.summary()["products"], [(self.pen.pk, 20, 20, Decimal("40.00"))]
+        )
+
+    def test_rebuild_matches_incremental_summaries(self):
+        services.create_order(self.alice.pk, {self.pen.pk: 3})
+        order = Order.objects.create(customer=self.bob, total_amount=Decimal("9.00"))
+        order.products.set(
+            [self.pen], through_defaults={"unit_price": 2, "quantity": 2}
+        )
+        OrderLine.objects.create(order=order, product=self.ink, unit_price=5)
+        self.ink.orders.add(
+            Order.objects.create(customer=self.alice, total_amount=Decimal("5.00")),
+            through_defaults={"unit_price": 5},
+        )
+        incremental = self.summary()
+        self.assertEqual(
+            incremental["products"],
+            [
+                (self.pen.pk, 2, 5, Decimal("10.00")),
+                (self.ink.pk, 2, 2, Decimal("10.00")),
+            ],
+        )
+
+        out = StringIO()
+        call_command("rebuild_sales_summaries", stdout=out)
+
+        self.assertIn(
+            "Rebuilt 1 day(s), 2 customer(s) and 2 product(s)", out.getvalue()
+        )
+        self.assertEqual(self.summary(), incremental)
+
+    def test_queries_read_summary_rows(self):
+        for _ in range(5):
+            services.create_order(self.alice.pk, {self.ink.pk: 2})
+        services.create_order(self.bob.pk, {self.pen.pk: 1})
+
+        with CaptureQueriesContext(connection) as ctx:
+            result = execute(
+                self.QUERY, {"customerId": to_global_id("CustomerType", self.alice.pk)}
+            )
+
+        self.assertIsNone(result.errors)
+        self.assertFalse(
+            any("crm_order" in q["sql"] for q in ctx.captured_queries),
+            "analytics must not scan orders",
+        )
+        self.assertEqual(
+            result.data["salesSummary"],
+            {
+                "orderCount": 6,
+                "revenue": "52.00",
+                "averageOrderValue": "8.67",
+                "days": [{"orderCount": 6}],
+            },
+        )
+        self.assertEqual(
+            result.data["topProducts"][0],
+            {
+                "product": {"name": "Ink"},
+                "unitsSold": 10,
+                "orderCount": 5,
+                "revenue": "50.00",
+            },
+        )
+        self.assertEqual(
+            result.data["customerLifetimeValue"],
+            {"orderCount": 5, "totalSpent": "50.00", "averageOrderValue": "10.00"},
+        )
+
+    def test_customer_without_orders_has_zero_lifetime_value(self):
+        result = execute(
+            self.QUERY, {"customerId": to_global_id("CustomerType", self.bob.pk)}
+        )
+
+        self.assertEqual(
+            result.data["customerLifetimeValue"],
+            {"orderCount": 0, "totalSpent": "0.00", "averageOrderValue": None},
+        )
+
+    def test_lifetime_value_of_an_invalid_id_is_null(self):
+        for customer_id in [
+            str(self.bob.pk),
+            "not-an-id",
+            to_global_id("ProductType", self.bob.pk),
+            to_global_id("CustomerType", "abc"),
+        ]:
+            result = execute(self.QUERY, {"customerId": customer_id})
+            self.assertIsNone(result.errors)
+            self.assertIsNone(result.data["customerLifetimeValue"])
+
+
+class OrderLineTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = Customer.objects.create(name="Alice", email="a@x.com")
+        cls.pen = Product.objects.create(
+            name="Blue pen", price=Decimal("2.00"), stock=50
+        )
+        cls.pencil = Product.objects.create(
+            name="Red pencil", price=Decimal("1.00"), stock=50
+        )
+        cls.ink = Product.objects.create(name="Ink", price=Decimal("5.00"), stock=50)
+        cls.order = services.create_order(
+            cls.customer.pk, {cls.pen.pk: 2, cls.pencil.pk: 1}
+        )
+        services.create_order(cls.customer.pk, {cls.ink.pk: 1})
+
+    def test_lines_snapshot_quantity_and_price(self):
+        Product.objects.filter(pk=self.pen.pk).update(price=Decimal("3.00"))
+
+        lines = self.order.lines.order_by("product_id")
+        self.assertEqual(
+            [(line.product_id, line.quantity, line.unit_price) for line in lines],
+            [(self.pen.pk, 2, Decimal("2.00")), (self.pencil.pk, 1, Decimal("1.00"))],
+        )
+        self.assertEqual(self.order.total_amount, Decimal("5.00"))
+
+    def test_bulk_orders_count_repeated_products_as_quantity(self):
+        row = type(
+            "Row",
+            (),
+            {
+                "customer_id": self.customer.pk,
+                "product_ids": [self.ink.pk, self.pen.pk, self.ink.pk],
+            },
+        )
+        [chunk] = services.bulk_create_orders([row])
+
+        order = Order.objects.get(pk=chunk["ids"][0])
+        self.assertEqual(order.total_amount, Decimal("12.00"))
+        self.assertEqual(order.lines.get(product=self.ink).quantity, 2)
+
+    def test_product_name_filter_uses_exists(self):
+        query = """
+            query ($name: String) {
+                allOrders(productName: $name) { edges { node { id } } }
+            }
+        """
+        with CaptureQueriesContext(connection) as ctx:
+            result = execute(query, {"name": "pen"})
+
+        self.assertIsNone(result.errors)
+        # Both "Blue pen" and "Red pencil" match, yet the order appears once.
+        self.assertEqual(
+            [e["node"]["id"] for e in result.data["allOrders"]["edges"]],
+            [to_global_id("OrderType", self.order.pk)],
+        )
+        self.assertIn("EXISTS", ctx.captured_queries[-1]["sql"])
+
+    def test_lines_are_batched(self):
+        query = """
+            {
+                allOrders(first: 10) {
+                    edges { node { lines { quantity unitPrice product { name } } } }
+                }
+            }
+        """
+        queries, result = count_queries(query)
+
+        # orders + their lines with products (prefetched)
+        self.assertEqual(queries, 2)
+        lines = result.data["allOrders"]["edges"][0]["node"]["lines"]
+        self.assertEqual(
+            lines,
+            [
+                {"quantity": 2, "unitPrice": "2.00", "product": {"name": "Blue pen"}},
+                {"quantity": 1, "unitPrice": "1.00", "product": {"name": "Red pencil"}},
+            ],
+        )
+
+
+@override_settings(CRM_DATABASE_ROUTING={"REPLICAS": ["replica"]})
+class DatabaseRoutingTests(TestCase):
+    # "replica" mirrors the test database; it sees committed rows only, so
+    # these tests check where queries go rather than what they return.
+    databases = {"default", "replica"}
+
+    QUERY = "{ allProducts(first: 5) { edges { node { name } } } }"
+    MUTATION = """
+        mutation { createCustomer(name: "Zoe", email: "zoe@x.com") { message } }
+    """
+
+    def setUp(self):
+        response_cache.clear()
+        routing.replica_health.checked.clear()
+        self.router = routing.ReplicaRouter()
+
+    def post(self, query):
+        with CaptureQueriesContext(
+            connections["default"]
+        ) as primary, CaptureQueriesContext(connections["replica"]) as replica:
+            response = self.client.post(
+                "/graphql/",
+                json.dumps({"query": query}),
+                content_type="application/json",
+            )
+        self.assertEqual(response.status_code, 200)
+        return response, len(primary.captured_queries), len(replica.captured_queries)
+
+    def operation(self, source):
+        return parse(source).definitions[0]
+
+    def test_only_query_operations_read_from_replicas(self):
+        self.assertEqual(self.router.db_for_read(Product), "default")
+        with routing.route_operation(self.operation("{ hello }")):
+            self.assertEqual(self.router.db_for_read(Product), "replica")
+            with routing.use_primary():
+                self.assertEqual(self.router.db_for_read(Product), "default")
+        with routing.route_operation(self.operation("mutation { x }")):
+            self.assertEqual(self.router.db_for_read(Product), "default")
+        self.assertEqual(self.router.db_for_write(Product), "default")
+
+    def test_query_reads_from_replica(self):
+        response, primary, replica = self.post(self.QUERY)
+
+        self.assertEqual((primary, replica), (0, 1))
+        self.assertNotIn("crm_read_primary", response.cookies)
+
+    def test_reads_stick_to_primary_after_a_write(self):
+        response, primary, _ = self.post(self.MUTATION)
+        self.assertGreater(primary, 0)
+        cookie = response.cookies["crm_read_primary"]
+        self.assertEqual(cookie["max-age"], 10)
+
+        # The test client sends the cookie back.
+        _, primary, replica = self.post(self.QUERY)
+        self.assertEqual((primary, replica), (1, 0))
+
+    def test_unavailable_replica_falls_back_to_primary(self):
+        with override_settings(CRM_DATABASE_ROUTING={"REPLICAS": ["missing"]}):
+            with routing.route_operation(self.operation("{ hello }")):
+                self.assertEqual(self.router.db_for_read(Product), "default")
+        self.assertFalse(routing.replica_health.checked["missing"][0])
+
+    def test_replica_error_marks_it_unhealthy_and_retries_on_primary(self):
+        def fail(execute, sql, params, many, context):
+            raise OperationalError("replica went away")
+
+        replica = connections["replica"]
+        routing.install_replica_wrapper(replica)
+        with replica.execute_wrapper(fail):
+            response, primary, _ = self.post(self.QUERY)
+
+        self.assertNotIn("errors", response.json())
+        self.assertEqual(primary, 1)
+        self.assertFalse(routing.replica_health.checked["replica"][0])
+        with routing.route_operation(self.operation("{ hello }")):
+            self.assertEqual(self.router.db_for_read(Product), "default")
+
+    def test_health_check_runs_once_per_interval(self):
+        replica = connections["replica"]
+        with patch.object(
+            replica, "is_usable", wraps=replica.is_usable
+        ) as is_usable, routing.route_operation(self.operation("{ hello }")):
+            for _ in range(3):
+                self.assertEqual(self.router.db_for_read(Product), "replica")
+        self.assertEqual(is_usable.call_count, 1)
+
+
+class SeedingTests(TestCase):
+    END = timezone.make_aware(timezone.datetime(2026, 1, 31))
+
+    def seed(self, seed=7):
+        seeding.flush()
+        seeder = seeding.Seeder(
+            40, 10, 120, seed=seed, batch_size=25, end=self.END, days=30
+        )
+        progress = list(seeder.run())
+        return progress, self.snapshot()
+
+    def snapshot(self):
+        return (
+            list(Customer.objects.order_by("email").values_list("name", "email")),
+            list(Product.objects.order_by("name").values_list("name", "price")),
+            sorted(
+                Order.objects.values_list(
+                    "customer__email", "order_date", "total_amount"
+                )
+            ),
+            sorted(
+                OrderLine.objects.values_list("product__name", "quantity", "unit_price")
+            ),
+        )
+
+    def test_generates_deterministic_dataset_in_batches(self):
+        progress, first = self.seed()
+        self.assertEqual(progress[-1], ("orders", 120, 120))
+        self.assertEqual(
+            [p for p in progress if p[0] == "customers"],
+            [("customers", 25, 40), ("customers", 40, 40)],
+        )
+        self.assertEqual(Customer.objects.count(), 40)
+        self.assertEqual(Product.objects.count(), 10)
+        self.assertEqual(Order.objects.count(), 120)
+
+        _, second = self.seed()
+        self.assertEqual(first, second)
+        _, other = self.seed(seed=8)
+        self.assertNotEqual(first, other)
+
+    def test_orders_are_consistent_and_summarized(self):
+        self.seed()
+        for order in Order.objects.prefetch_related("lines"):
+            self.assertTrue(order.lines.all())
+            self.assertEqual(
+                order.total_amount, sum(line.amount for line in order.lines.all())
+            )
+            self.assertLessEqual(order.order_date, self.END)
+            self.assertGreaterEqual(order.order_date, self.END - timedelta(days=30))
+        self.assertEqual(
+            sum(s.order_count for s in DailySales.objects.all()), Order.objects.count()
+        )
+        # Popularity is skewed: the best seller is in far more orders than average.
+        best = ProductSales.objects.order_by("-order_count").first()
+        self.assertGreater(
+            best.order_count, 2 * OrderLine.objects.count() / Product.objects.count()
+        )
+
+    def test_benchmark_reports_every_operation(self):
+        self.seed()
+        out = StringIO()
+        with tempfile.NamedTemporaryFile(suffix=".json") as f:
+            call_command(
+                "benchmark_graphql", repeat=1, warmup=0, json_path=f.name, stdout=out
+            )
+            results = json.load(open(f.name))
+        self.assertEqual(
+            [r["operation"] for r in results], list(benchmark_graphql.OPERATIONS)
+        )
+        for result in results:
+            self.assertGreaterEqual(result["queries"], 1)
+            self.assertGreater(result["peak_kib"], 0)
+        self.assertIn("orders_with_lines", out.getvalue())
+
+
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = Customer.objects.create(name="Alice", email="alice@example.com")
+        cls.bob = Customer.objects.create(
+            name="Bob", email="bob@example.com", phone="+1234567890"
+        )
+        cls.laptop = Product.objects.create(name="Laptop", price="999.99", stock=5)
+        cls.mouse = Product.objects.create(name="Mouse", price="19.50", stock=50)
+        cls.big = Order.objects.create(customer=cls.alice, total_amount="1038.99")
+        cls.big.products.set(
+            [cls.laptop, cls.mouse], through_defaults={"unit_price": "19.50"}
+        )
+        OrderLine.objects.filter(order=cls.big, product=cls.laptop).update(
+            unit_price="999.99"
+        )
+        OrderLine.objects.filter(order=cls.big, product=cls.mouse).update(quantity=2)
+        cls.small = Order.objects.create(customer=cls.bob, total_amount="19.50")
+        cls.small.products.set([cls.mouse], through_defaults={"unit_price": "19.50"})
+
+    def get(self, path, **params):
+        response = self.client.get(path, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b"".join(response.streaming_content).decode()
+
+    def test_customers_csv_uses_the_filterset(self):
+        body = self.get("/export/customers.csv", name_icontains="bob")
+        rows = body.splitlines()
+        self.assertEqual(rows[0], "id,name,email,phone,created_at")
+        self.assertEqual(len(rows), 2)
+        self.assertTrue(rows[1].startswith(f"{self.bob.pk},Bob,bob@example.com,"))
+
+    def test_orders_csv_has_a_row_per_line(self):
+        body = self.get("/export/orders.csv", total_amount_gte="100")
+        rows = body.splitlines()
+        self.assertEqual(
+            rows[0],
+            "id,order_date,customer_id,customer_email,total_amount,"
+            "product_id,product_name,quantity,unit_price",
+        )
+        self.assertEqual(len(rows), 3)
+        self.assertTrue(all(r.startswith(f"{self.big.pk},") for r in rows[1:]))
+        self.assertTrue(rows[1].endswith(f"{self.laptop.pk},Laptop,1,999.99"))
+        self.assertTrue(rows[2].endswith(f"{self.mouse.pk},Mouse,2,19.50"))
+
+    def test_orders_ndjson_nests_lines(self):
+        body = self.get("/export/orders.ndjson", product_name="mouse")
+        records = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual([r["id"] for r in records], [self.big.pk, self.small.pk])
+        self.assertEqual(records[0]["customer_email"], "alice@example.com")
+        self.assertEqual(records[0]["total_amount"], "1038.99")
+        self.assertEqual(
+            records[0]["lines"],
+            [
+                {
+                    "product_id": self.laptop.pk,
+                    "product_name": "Laptop",
+                    "quantity": 1,
+                    "unit_price": "999.99",
+                },
+                {
+                    "product_id": self.mouse.pk,
+                    "product_name": "Mouse",
+                    "quantity": 2,
+                    "unit_price": "19.50",
+                },
+            ],
+        )
+        self.assertEqual(len(records[1]["lines"]), 1)
+
+    @override_settings(CRM_EXPORT={"CHUNK_SIZE": 1, "BUFFER_SIZE": 1})
+    def test_streams_in_chunks(self):
+        response = self.client.get("/export/products.ndjson")
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertIn('filename="products.ndjson"', response["Content-Disposition"])
+        chunks = list(response.streaming_content)
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual(json.loads(chunks[0])["name"], "Laptop")
+
+    @override_settings(CRM_EXPORT={"CHUNK_SIZE": 1, "BUFFER_SIZE": 1})
+    async def test_asgi_streams_without_buffering(self):
+        response = await self.async_client.get("/export/customers.csv")
+        self.assertEqual(response.status_code, 200)
+        chunks = [chunk async for chunk in response.streaming_content]
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(chunks[0], b"id,name,email,phone,created_at\r\n")
+
+    def test_rejects_bad_requests(self):
+        response = self.client.get("/export/orders.csv", {"total_amount_gte": "x"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("total_amount_gte", response.json()["errors"])
+        self.assertEqual(self.client.get("/export/jobs.csv").status_code, 404)
+        self.assertEqual(self.client.get("/export/orders.xml").status_code, 404)
+        self.assertEqual(self.client.post("/export/orders.csv").status_code, 405)
+
+
+class WebSocketClient:
+    """Drives an ASGI WebSocket application from a test."""
+
+    def __init__(self, app, path="/graphql/", subprotocols=("graphql-transport-ws",)):
+        self.inbox = asyncio.Queue()
+        self.outbox = asyncio.Queue()
+        scope = {"type": "websocket", "path": path, "subprotocols": subprotocols}
+        self.task = asyncio.ensure_future(app(scope, self.inbox.get, self.outbox.put))
+
+    async def connect(self):
+        await self.inbox.put({"type": "websocket.connect"})
+        return await self.receive_raw()
+
+    async def receive_raw(self):
+        return await asyncio.wait_for(self.outbox.get(), 5)
+
+    async def send(self, message):
+        await self.inbox.put({"type": "websocket.receive", "text": json.dumps(message)})
+
+    async def receive(self):
+        return json.loads((await self.receive_raw())["text"])
+
+    async def init(self):
+        await self.connect()
+        await self.send({"type": "connection_init"})
+        return await self.receive()
+
+    async def disconnect(self):
+        await self.inbox.put({"type": "websocket.disconnect", "code": 1000})
+        await asyncio.wait_for(self.task, 5)
+
+
+async def wait_for_listeners(topic, count=1):
+    layer = pubsub.get_channel_layer()
+    for _ in range(500):
+        if len(layer.subscribers[topic]) >= count:
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"No subscriber for {topic}")
+
+
+class SubscriptionTests(TransactionTestCase):
+    ORDER_SUBSCRIPTION = """
+        subscription ($customerId: ID) {
+            orderCreated(customerId: $customerId) {
+                totalAmount
+                customer { name }
+                lines { quantity product { name } }
+            }
+        }
+    """
+
+    def setUp(self):
+        self.alice = Customer.objects.create(name="Alice", email="a@example.com")
+        self.bob = Customer.objects.create(name="Bob", email="b@example.com")
+        self.laptop = Product.objects.create(name="Laptop", price="1000", stock=10)
+        self.mouse = Product.objects.create(name="Mouse", price="20", stock=3)
+        self.app = GraphQLWebSocketApp()
+
+    async def test_order_created_fans_out_one_load_per_event(self):
+        loads = []
+        original = subscriptions.load_orders
+
+        async def counting_load(pks):
+            loads.append(pks)
+            return await original(pks)
+
+        with patch("crm.subscriptions.load_orders", counting_load):
+            everyone = WebSocketClient(self.app)
+            only_bob = WebSocketClient(self.app)
+            for client, customer in ((everyone, None), (only_bob, self.bob)):
+                self.assertEqual(await client.init(), {"type": "connection_ack"})
+                await client.send(
+                    {
+                        "id": "1",
+                        "type": "subscribe",
+                        "payload": {
+                            "query": self.ORDER_SUBSCRIPTION,
+                            "variables": {"customerId": customer and customer.pk},
+                        },
+                    }
+                )
+            # Two subscribers, one channel layer subscription for the topic.
+            await wait_for_listeners(pubsub.ORDER_CREATED)
+            await asyncio.sleep(0.05)
+            self.assertEqual(
+                len(pubsub.get_channel_layer().subscribers[pubsub.ORDER_CREATED]), 1
+            )
+
+            await sync_to_async(services.create_order)(
+                self.alice.pk, {self.laptop.pk: 2, self.mouse.pk: 1}
+            )
+            message = await everyone.receive()
+            self.assertEqual(message["type"], "next")
+            self.assertEqual(
+                message["payload"]["data"]["orderCreated"],
+                {
+                    "totalAmount": "2020.00",
+                    "customer": {"name": "Alice"},
+                    "lines": [
+                        {"quantity": 2, "product": {"name": "Laptop"}},
+                        {"quantity": 1, "product": {"name": "Mouse"}},
+                    ],
+                },
+            )
+            await sync_to_async(services.create_order)(self.bob.pk, {self.mouse.pk: 1})
+            for client in (everyone, only_bob):
+                message = await client.receive()
+                self.assertEqual(
+                    message["payload"]["data"]["orderCreated"]["customer"],
+                    {"name": "Bob"},
+                )
+            self.assertEqual(len(loads), 2)
+
+            await everyone.send({"id": "1", "type": "complete"})
+            await only_bob.disconnect()
+            await everyone.disconnect()
+        self.assertFalse(pubsub.get_channel_layer().subscribers[pubsub.ORDER_CREATED])
+
+    async def test_product_stock_changed_from_mutations(self):
+        client = WebSocketClient(self.app)
+        await client.init()
+        await client.send(
+            {
+                "id": "low",
+                "type": "subscribe",
+                "payload": {
+                    "query": "subscription { productStockChanged(stockLt: 5) "
+                    "{ name stock } }"
+                },
+            }
+        )
+        await wait_for_listeners(pubsub.PRODUCT_STOCK_CHANGED)
+
+        await sync_to_async(services.create_order)(self.alice.pk, {self.mouse.pk: 2})
+        message = await client.receive()
+        self.assertEqual(
+            message["payload"]["data"]["productStockChanged"],
+            {"name": "Mouse", "stock": 1},
+        )
+        await sync_to_async(services.restock_low_stock)(threshold=5, increment=2)
+        message = await client.receive()
+        self.assertEqual(
+            message["payload"]["data"]["productStockChanged"],
+            {"name": "Mouse", "stock": 3},
+        )
+        await client.disconnect()
+
+    async def test_queries_and_errors(self):
+        client = WebSocketClient(self.app)
+        await client.init()
+        await client.send(
+            {"id": "q", "type": "subscribe", "payload": {"query": "{ hello }"}}
+        )
+        self.assertEqual(
+            await client.receive(),
+            {
+                "id": "q",
+                "type": "next",
+                "payload": {"data": {"hello": "Hello, GraphQL!"}},
+            },
+        )
+        self.assertEqual(await client.receive(), {"id": "q", "type": "complete"})
+
+        await client.send(
+            {"id": "bad", "type": "subscribe", "payload": {"query": "{ nope }"}}
+        )
+        message = await client.receive()
+        self.assertEqual(message["type"], "error")
+        self.assertIn("Cannot query field", message["payload"][0]["message"])
+
+        await client.send({"id": "q2", "type": "subscribe", "payload": {}})
+        self.assertEqual((await client.receive())["type"], "error")
+        await client.disconnect()
+
+    async def test_protocol_violations_close_the_socket(self):
+        client = WebSocketClient(self.app, subprotocols=())
+        self.assertEqual(
+            await client.connect(), {"type": "websocket.close", "code": 4406}
+        )
+
+        client = WebSocketClient(self.app)
+        await client.connect()
+        await client.send({"id": "1", "type": "subscribe", "payload": {}})
+        closed = await client.receive_raw()
+        self.assertEqual((closed["type"], closed["code"]), ("websocket.close", 4401))
+        await client.disconnect()
+
+    def test_http_rejects_subscriptions(self):
+        response = self.client.post(
+            "/graphql/async/",
+            {"query": "subscription { orderCreated { id } }"},
+            content_type="application/json",
+        )
+        self.assertEqual(
+            response.json()["errors"][0]["message"],
+            "Subscriptions are served over WebSocket.",
+        )
@@ -0,0 +1,366 @@
+"""
+CRM Tracing
+Per-operation traces of GraphQL requests: parse/validate/execute phases,
+resolver timings, and the SQL each field path ran, with duplicate query
+detection.
+
+A request is traced when it sends the ``HEADER`` header or is picked by
+``SAMPLE_RATE``. Requests that asked through the header get the trace back
+as Apollo-tracing-style ``extensions.tracing`` plus ``extensions.sql``;
+as these carry raw SQL and parameters, the header is only honored under
+``DEBUG`` or for staff users. Every trace is also written to the
+configured sinks. Untraced requests only
+pay one context variable lookup per SQL query.
+
+Configured by ``CRM_TRACING``:
+
+- ``ENABLED``: allow tracing at all
+- ``HEADER``: request header opting a request in (``1``/``true``)
+- ``SAMPLE_RATE``: fraction of other requests traced for the sinks only
+- ``JSONL_PATH``: append one JSON record per trace
+- ``PROMETHEUS_PATH``: rewrite aggregated metrics in Prometheus text format
+"""
+
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import timedelta
+from inspect import isawaitable
+
+from django.conf import settings
+from django.utils import timezone
+
+DEFAULTS = {
+    "ENABLED": True,
+    "HEADER": "X-CRM-Trace",
+    "SAMPLE_RATE": 0.0,
+    "JSONL_PATH": None,
+    "PROMETHEUS_PATH": None,
+}
+
+current_trace = ContextVar("crm_trace", default=None)
+current_path = ContextVar("crm_trace_path", default=None)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, "CRM_TRACING", {})}
+
+
+def field_path(path):
+    """``["allOrders", "edges", 3, "node"]`` -> ``"allOrders.edges.node"``."""
+    return ".".join(str(key) for key in path if not isinstance(key, int))
+
+
+class Trace:
+    def __init__(self, expose=False):
+        self.expose = expose
+        self.operation_name = None
+        self.start_time = timezone.now()
+        self.start = time.perf_counter_ns()
+        self.end = None
+        self.phases = {}
+        self.resolvers = []
+        self.queries = []
+
+    def offset(self):
+        return time.perf_counter_ns() - self.start
+
+    def add_resolver(self, info, path, start):
+        self.resolvers.append(
+            {
+                "path": path,
+                "parentType": info.parent_type.name,
+                "fieldName": info.field_name,
+                "returnType": str(info.return_type),
+                "startOffset": start,
+                "duration": self.offset() - start,
+            }
+        )
+
+    def add_query(self, path, sql, params, duration):
+        self.queries.append((path, sql, params, duration))
+
+    def finish(self):
+        self.end = self.offset()
+
+    def duration(self):
+        return self.end if self.end is not None else self.offset()
+
+    def sql_summary(self):
+        by_path = defaultdict(lambda: {"count": 0, "duration": 0})
+        executions = defaultdict(list)
+        for path, sql, params, duration in self.queries:
+            entry = by_path[path or ""]
+            entry["count"] += 1
+            entry["duration"] += duration
+            executions[(sql, repr(params))].append(path or "")
+        duplicates = [
+            {"sql": sql, "count": len(paths), "paths": sorted(set(paths))}
+            for (sql, _), paths in executions.items()
+            if len(paths) > 1
+        ]
+        return {
+            "count": len(self.queries),
+            "duration": sum(q[3] for q in self.queries),
+            "byPath": dict(by_path),
+            "duplicates": duplicates,
+        }
+
+    def resolver_summary(self):
+        by_path = defaultdict(lambda: {"count": 0, "duration": 0})
+        for resolver in self.resolvers:
+            entry = by_path[field_path(resolver["path"])]
+            entry["count"] += 1
+            entry["duration"] += resolver["duration"]
+        return dict(by_path)
+
+    def extensions(self):
+        """Apollo tracing (https://github.com/apollographql/apollo-tracing) + SQL."""
+        duration = self.duration()
+        return {
+            "tracing": {
+                "version": 1,
+                "startTime": self.start_time.isoformat(),
+                "endTime": (
+                    self.start_time + timedelta(microseconds=duration / 1000)
+                ).isoformat(),
+                "duration": duration,
+                "parsing": self.phases.get("parsing"),
+                "validation": self.phases.get("validation"),
+                "execution": {"resolvers": self.resolvers},
+            },
+            "sql": self.sql_summary(),
+        }
+
+    def name(self):
+        if self.operation_name:
+            return self.operation_name
+        root_fields = sorted(
+            {r["fieldName"] for r in self.resolvers if len(r["path"]) == 1}
+        )
+        return "+".join(root_fields) or "anonymous"
+
+    def record(self):
+        """The flat record written to the sinks."""
+        return {
+            "timestamp": self.start_time.isoformat(),
+            "operationName": self.name(),
+            "duration": self.duration(),
+            "phases": self.phases,
+            "resolvers": self.resolver_summary(),
+            "sql": self.sql_summary(),
+        }
+
+
+# ==========================
+# Lifecycle
+# ==========================
+def requested(request):
+    """Whether ``request`` asks for its trace through the header."""
+    header = request.headers.get(get_config()["HEADER"], "")
+    return header.lower() in ("1", "true")
+
+
+def start_trace(request, user=None):
+    """
+    Start and activate a trace if ``request`` opted in or was sampled.
+
+    ``user`` defaults to ``request.user``; async views pass the user they
+    awaited, as the lazy ``request.user`` cannot be loaded on the event loop.
+    """
+    config = get_config()
+    if not config["ENABLED"]:
+        return None
+    expose = requested(request) and (settings.DEBUG or (user or request.user).is_staff)
+    if not expose and not (
+        config["SAMPLE_RATE"] and random.random() < config["SAMPLE_RATE"]
+    ):
+        return None
+    trace = Trace(expose=expose)
+    trace.token = current_trace.set(trace)
+    return trace
+
+
+def finish_trace(trace):
+    if trace is None:
+        return
+    trace.finish()
+    current_trace.reset(trace.token)
+    for sink in get_sinks():
+        sink.write(trace)
+
+
+@contextmanager
+def phase(name):
+    """Time a phase (``parsing``, ``validation``, ...) of the active trace."""
+    trace = current_trace.get()
+    if trace is None:
+        yield
+        return
+    start = trace.offset()
+    try:
+        yield
+    finally:
+        trace.phases[name] = {"startOffset": start, "duration": trace.offset() - start}
+
+
+# ==========================
+# Instrumentation
+# ==========================
+class TracingMiddleware:
+    """Graphene middleware timing every resolver of the active trace."""
+
+    def resolve(self, next, root, info, **args):
+        trace = current_trace.get()
+        if trace is None:
+            return next(root, info, **args)
+
+        path = info.path.as_list()
+        token = current_path.set(field_path(path))
+        start = trace.offset()
+        try:
+            result = next(root, info, **args)
+        finally:
+            current_path.reset(token)
+        if isawaitable(result):
+            return self.await_result(trace, info, path, start, result)
+        trace.add_resolver(info, path, start)
+        return result
+
+    async def await_result(self, trace, info, path, start, result):
+        # The awaitable runs here, so set the path again for the queries
+        # it makes (sync_to_async copies the context into its thread).
+        token = current_path.set(field_path(path))
+        try:
+            return await result
+        finally:
+            current_path.reset(token)
+            trace.add_resolver(info, path, start)
+
+
+def sql_wrapper(execute, sql, params, many, context):
+    trace = current_trace.get()
+    if trace is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter_ns()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        trace.add_query(current_path.get(), sql, params, time.perf_counter_ns() - start)
+
+
+def install_sql_wrapper(connection, **kwargs):
+    """``connection_created`` receiver adding ``sql_wrapper`` once per connection."""
+    if sql_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(sql_wrapper)
+
+
+# ==========================
+# Sinks
+# ==========================
+class JSONLSink:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def write(self, trace):
+        line = json.dumps(trace.record(), default=str)
+        with self._lock, open(self.path, "a") as jsonl:
+            jsonl.write(line + "\n")
+
+
+def _label(value):
+    return re.sub(r'(["\\])', r"\\\1", str(value)).replace("\n", "\\n")
+
+
+class PrometheusTextSink:
+    """
+    Aggregates traces into counters and rewrites ``path`` in the Prometheus
+    text format after each one, e.g. for node_exporter's textfile collector.
+    """
+
+    METRICS = {
+        "crm_graphql_traced_operations_total": "Traced GraphQL operations.",
+        "crm_graphql_operation_duration_seconds_total": "Total traced operation time.",
+        "crm_graphql_sql_queries_total": "SQL queries run by traced operations.",
+        "crm_graphql_sql_duration_seconds_total": "SQL time of traced operations.",
+        "crm_graphql_duplicate_queries_total": "Identical SQL queries run again.",
+        "crm_graphql_field_sql_queries_total": "SQL queries per field path.",
+        "crm_graphql_field_duration_seconds_total": "Resolver time per field path.",
+    }
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.values = defaultdict(float)
+
+    def write(self, trace):
+        operation = trace.name()
+        sql = trace.sql_summary()
+        with self._lock:
+            op = (("operation", operation),)
+            self.values[("crm_graphql_traced_operations_total", op)] += 1
+            self.values[("crm_graphql_operation_duration_seconds_total", op)] += (
+                trace.duration() / 1e9
+            )
+            self.values[("crm_graphql_sql_queries_total", op)] += sql["count"]
+            self.values[("crm_graphql_sql_duration_seconds_total", op)] += (
+                sql["duration"] / 1e9
+            )
+            self.values[("crm_graphql_duplicate_queries_total", op)] += sum(
+                d["count"] - 1 for d in sql["duplicates"]
+            )
+            for path, entry in sql["byPath"].items():
+                key = ("crm_graphql_field_sql_queries_total", (("path", path),))
+                self.values[key] += entry["count"]
+            for path, entry in trace.resolver_summary().items():
+                key = ("crm_graphql_field_duration_seconds_total", (("path", path),))
+                self.values[key] += entry["duration"] / 1e9
+            text = self.render()
+        self.replace_file(text)
+
+    def render(self):
+        lines = []
+        for name, help_text in self.METRICS.items():
+            samples = [(k, v) for k, v in self.values.items() if k[0] == name]
+            if not samples:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for (_, labels), value in sorted(samples):
+                rendered = ",".join(f'{k}="{_label(v)}"' for k, v in labels)
+                lines.append(f"{name}{{{rendered}}} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def replace_file(self, text):
+        # Write then rename so scrapers never read a half-written file.
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".prom.tmp")
+        with os.fdopen(fd, "w") as prom:
+            prom.write(text)
+        os.replace(tmp, self.path)
+
+
+_sinks = {}
+
+
+def get_sinks():
+    config = get_config()
+    sinks = []
+    for key, sink_class in (
+        ("JSONL_PATH", JSONLSink),
+        ("PROMETHEUS_PATH", PrometheusTextSink),
+    ):
+        path = config[key]
+        if path:
+            if (sink_class, path) not in _sinks:
+                _sinks[(sink_class, path)] = sink_class(path)
+            sinks.append(_sinks[(sink_class, path)])
+    return sinks
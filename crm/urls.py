@@ -15,12 +15,18 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path
-from graphene_django.views import GraphQLView
 from django.views.decorators.csrf import csrf_exempt
 
+from crm.views import AsyncCRMGraphQLView, CRMGraphQLView, ExportView
+
+GraphQLView = AsyncCRMGraphQLView if settings.CRM_ASYNC_GRAPHQL else CRMGraphQLView
+
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("graphql/", csrf_exempt(GraphQLView.as_view(graphiql=True))),
+    path("graphql/async/", csrf_exempt(AsyncCRMGraphQLView.as_view(graphiql=True))),
+    path("export/<slug:resource>.<slug:fmt>", ExportView.as_view()),
 ]
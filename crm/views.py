@@ -1,3 +1,532 @@
-from django.shortcuts import render
+import json
+from inspect import isawaitable
 
-# Create your views here.
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import connection, router, transaction
+from django.http import (
+    Http404,
+    HttpResponse,
+    HttpResponseBadRequest,
+    HttpResponseNotAllowed,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from django.views import View
+from graphene_django.constants import MUTATION_ERRORS_FLAG
+from graphene_django.settings import graphene_settings
+from graphene_django.utils.utils import set_rollback
+from graphene_django.views import GraphQLView, HttpError
+from graphql import ExecutionResult, OperationType, execute, get_operation_ast
+from graphql.error import GraphQLError
+
+from crm.async_schema import ORMThreadMiddleware
+from crm.async_schema import schema as async_schema
+from crm import cost, export, routing, tracing
+from crm.documents import document_cache, persisted_queries, query_hash
+from crm.loaders import reset_loaders
+from crm.response_cache import get_config, operation_tags, response_cache
+
+BATCH_DEFAULTS = {
+    "ENABLED": True,
+    "MAX_SIZE": 20,
+}
+
+
+def batch_config():
+    return {**BATCH_DEFAULTS, **getattr(settings, "CRM_GRAPHQL_BATCH", {})}
+
+
+def is_mutation(operation_ast):
+    return (
+        operation_ast is not None and operation_ast.operation == OperationType.MUTATION
+    )
+
+
+def persisted_query_error(message, code):
+    return ExecutionResult(errors=[GraphQLError(message, extensions={"code": code})])
+
+
+def add_extensions(result, extensions):
+    """Merge ``extensions`` into a result, or into an awaitable's result."""
+    if not extensions:
+        return result
+    if isawaitable(result):
+
+        async def merged():
+            return add_extensions(await result, extensions)
+
+        return merged()
+    result.extensions = {**extensions, **(result.extensions or {})}
+    return result
+
+
+class CRMGraphQLView(GraphQLView):
+    """
+    GraphQLView that reuses parsed and validated documents across requests
+    and supports Automatic Persisted Queries.
+
+    APQ clients send ``extensions.persistedQuery.sha256Hash``; the query text
+    may be omitted once the hash has been registered or loaded from the
+    ``CRM_PERSISTED_QUERIES_MANIFEST`` file.
+
+    Read-only operations over cacheable root fields are answered from
+    ``crm.response_cache`` when possible.
+
+    A JSON array of operations is run as a batch, in order, within one
+    request: the operations share the request's DataLoaders (reset after
+    each mutation) and database connection, and the response is the array
+    of their results. ``CRM_GRAPHQL_BATCH`` turns batching off or caps the
+    number of operations.
+    """
+
+    def parse_body(self, request):
+        if self.get_content_type(request) != "application/json":
+            return super().parse_body(request)
+        try:
+            data = json.loads(request.body.decode("utf-8"))
+        except (UnicodeDecodeError, ValueError):
+            raise HttpError(HttpResponseBadRequest("POST body sent invalid JSON."))
+
+        if isinstance(data, list):
+            config = batch_config()
+            if not config["ENABLED"]:
+                raise HttpError(HttpResponseBadRequest("Batching is not enabled."))
+            if not data:
+                raise HttpError(
+                    HttpResponseBadRequest(
+                        "Received an empty list in the batch request."
+                    )
+                )
+            if len(data) > config["MAX_SIZE"]:
+                raise HttpError(
+                    HttpResponseBadRequest(
+                        f"Batch of {len(data)} operations exceeds the maximum "
+                        f"of {config['MAX_SIZE']}."
+                    )
+                )
+            if not all(isinstance(entry, dict) for entry in data):
+                raise HttpError(
+                    HttpResponseBadRequest("Each batch entry must be a JSON query.")
+                )
+            # Views are instantiated per request, so this is per request.
+            self.batch = True
+        elif not isinstance(data, dict):
+            raise HttpError(
+                HttpResponseBadRequest("The received data is not a valid JSON query.")
+            )
+        return data
+
+    def get_response(self, request, data, show_graphiql=False):
+        query, variables, operation_name, id = self.get_graphql_params(request, data)
+
+        trace = tracing.start_trace(request)
+        try:
+            execution_result = self.execute_graphql_request(
+                request, data, query, variables, operation_name, show_graphiql
+            )
+            return self.encode_response(request, execution_result, id, show_graphiql)
+        finally:
+            tracing.finish_trace(trace)
+
+    def get_middleware(self, request):
+        middleware = list(super().get_middleware(request) or [])
+        if tracing.current_trace.get() is not None:
+            middleware.insert(0, tracing.TracingMiddleware())
+        return middleware
+
+    def encode_response(self, request, execution_result, id, show_graphiql=False):
+        """Serialize an execution result, including its ``extensions``."""
+        trace = tracing.current_trace.get()
+        if trace is not None and trace.expose and execution_result is not None:
+            add_extensions(execution_result, trace.extensions())
+        with tracing.phase("serialization"):
+            return self.serialize_response(request, execution_result, id, show_graphiql)
+
+    def serialize_response(self, request, execution_result, id, show_graphiql):
+        if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+            set_rollback()
+
+        status_code = 200
+        if execution_result:
+            response = {}
+
+            if execution_result.errors:
+                set_rollback()
+                response["errors"] = [
+                    self.format_error(e) for e in execution_result.errors
+                ]
+
+            if execution_result.errors and any(
+                not getattr(e, "path", None) for e in execution_result.errors
+            ):
+                status_code = 400
+            else:
+                response["data"] = execution_result.data
+
+            if execution_result.extensions:
+                response["extensions"] = execution_result.extensions
+
+            if self.batch:
+                response["id"] = id
+                response["status"] = status_code
+
+            result = self.json_encode(request, response, pretty=show_graphiql)
+        else:
+            result = None
+
+        return result, status_code
+
+    def get_persisted_query_hash(self, request, data):
+        extensions = request.GET.get("extensions") or data.get("extensions")
+        if isinstance(extensions, str):
+            try:
+                extensions = json.loads(extensions)
+            except ValueError:
+                raise HttpError(HttpResponseBadRequest("Extensions are invalid JSON."))
+        persisted = (extensions or {}).get("persistedQuery") or {}
+        return persisted.get("sha256Hash")
+
+    def resolve_query(self, request, data, query):
+        """Return ``(query, error_result)`` after applying APQ lookups."""
+        sha256 = self.get_persisted_query_hash(request, data)
+        if not sha256:
+            return query, None
+        if query:
+            try:
+                persisted_queries.register(sha256, query)
+            except ValueError as e:
+                return None, persisted_query_error(str(e), "BAD_REQUEST")
+            return query, None
+        query = persisted_queries.get(sha256)
+        if query is None:
+            return None, persisted_query_error(
+                "PersistedQueryNotFound", "PERSISTED_QUERY_NOT_FOUND"
+            )
+        return query, None
+
+    def get_document(self, query):
+        return document_cache.get_document(
+            self.schema.graphql_schema,
+            query,
+            self.validation_rules,
+            graphene_settings.MAX_VALIDATION_ERRORS,
+        )
+
+    def execute_graphql_request(
+        self, request, data, query, variables, operation_name, show_graphiql=False
+    ):
+        query, error_result = self.resolve_query(request, data, query)
+        if error_result is not None:
+            return error_result
+
+        if not query:
+            if show_graphiql:
+                return None
+            raise HttpError(HttpResponseBadRequest("Must provide query string."))
+
+        document, validation_errors = self.get_document(query)
+        if document is None:
+            return ExecutionResult(errors=validation_errors)
+
+        operation_ast = get_operation_ast(document, operation_name)
+        trace = tracing.current_trace.get()
+        if trace is not None and operation_ast is not None and operation_ast.name:
+            trace.operation_name = operation_ast.name.value
+
+        if (
+            request.method.lower() == "get"
+            and operation_ast is not None
+            and operation_ast.operation != OperationType.QUERY
+        ):
+            if show_graphiql:
+                return None
+
+            raise HttpError(
+                HttpResponseNotAllowed(
+                    ["POST"],
+                    "Can only perform a {} operation from a POST request.".format(
+                        operation_ast.operation.value
+                    ),
+                )
+            )
+
+        if validation_errors:
+            return ExecutionResult(data=None, errors=validation_errors)
+
+        if (
+            operation_ast is not None
+            and operation_ast.operation == OperationType.SUBSCRIPTION
+        ):
+            return ExecutionResult(
+                errors=[GraphQLError("Subscriptions are served over WebSocket.")]
+            )
+
+        extensions, cost_errors = self.check_cost(
+            request, document, operation_name, variables
+        )
+        if cost_errors:
+            return ExecutionResult(errors=cost_errors, extensions=extensions)
+
+        if get_config()["ENABLED"]:
+            tags = operation_tags(self.schema.graphql_schema, document, operation_name)
+            if tags is not None:
+                return add_extensions(
+                    self.execute_cached(
+                        request,
+                        query,
+                        document,
+                        operation_ast,
+                        variables,
+                        operation_name,
+                        tags,
+                    ),
+                    extensions,
+                )
+
+        return add_extensions(
+            self.execute_operation(
+                request, document, operation_ast, variables, operation_name
+            ),
+            extensions,
+        )
+
+    def check_cost(self, request, document, operation_name, variables):
+        """
+        Return ``(extensions, errors)`` for the operation's static cost
+        against the requesting client's budget.
+        """
+        if not cost.get_config()["ENABLED"]:
+            return None, []
+        client, max_cost, max_depth = cost.client_budget(request)
+        query_cost = cost.analyze(
+            self.schema.graphql_schema, document, operation_name, variables
+        )
+        extensions = {
+            "cost": {
+                "requested": query_cost.cost,
+                "budget": max_cost,
+                "depth": query_cost.depth,
+                "maxDepth": max_depth,
+                "client": client,
+            }
+        }
+        return extensions, query_cost.errors(max_cost, max_depth)
+
+    def execute_cached(
+        self, request, query, document, operation_ast, variables, operation_name, tags
+    ):
+        # The key embeds the tag versions read before executing, so a write
+        # that lands during execution can never be cached as current.
+        key = response_cache.make_key(
+            query_hash(query), operation_name, variables, tags
+        )
+        data = response_cache.get(key)
+        if data is not None:
+            return ExecutionResult(data=data, extensions={"responseCache": "HIT"})
+
+        result = self.execute_operation(
+            request, document, operation_ast, variables, operation_name
+        )
+        if not result.errors:
+            response_cache.set(key, result.data)
+            result.extensions = {**(result.extensions or {}), "responseCache": "MISS"}
+        return result
+
+    def get_execute_options(self, request, variables, operation_name):
+        execute_options = {
+            "root_value": self.get_root_value(request),
+            "context_value": self.get_context(request),
+            "variable_values": variables,
+            "operation_name": operation_name,
+            "middleware": self.get_middleware(request),
+        }
+        if self.execution_context_class:
+            execute_options["execution_context_class"] = self.execution_context_class
+        return execute_options
+
+    def execute_operation(
+        self, request, document, operation_ast, variables, operation_name
+    ):
+        try:
+            execute_options = self.get_execute_options(
+                request, variables, operation_name
+            )
+            schema = self.schema.graphql_schema
+            if is_mutation(operation_ast) and (
+                graphene_settings.ATOMIC_MUTATIONS is True
+                or connection.settings_dict.get("ATOMIC_MUTATIONS", False) is True
+            ):
+                with routing.use_primary(), transaction.atomic(), tracing.phase(
+                    "execution"
+                ):
+                    result = execute(schema, document, **execute_options)
+                    if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+                        transaction.set_rollback(True)
+                return result
+
+            with routing.route_operation(operation_ast) as route, tracing.phase(
+                "execution"
+            ):
+                result = execute(schema, document, **execute_options)
+            if not route.replica_failed:
+                return result
+            # The replica is marked unhealthy; read everything again from the
+            # primary, without what the loaders cached from the failed run.
+            reset_loaders(self.get_context(request))
+            with routing.use_primary(), tracing.phase("execution"):
+                return execute(schema, document, **execute_options)
+        except Exception as e:
+            return ExecutionResult(errors=[e])
+        finally:
+            if is_mutation(operation_ast):
+                # Later operations of a batch must not read cached old rows.
+                reset_loaders(self.get_context(request))
+
+
+class AsyncCRMGraphQLView(CRMGraphQLView):
+    """
+    CRMGraphQLView for the ASGI stack.
+
+    Executes ``crm.async_schema.schema`` on the event loop, so a request no
+    longer holds a thread while it waits on the database. Mutations are
+    still executed one after another, each managing its own transaction;
+    ``ATOMIC_MUTATIONS`` is not supported here.
+    """
+
+    # GraphQLView.dispatch is synchronous; View.dispatch calls the async
+    # handlers below, which makes Django treat the view as async.
+    dispatch = View.dispatch
+
+    def __init__(self, schema=None, **kwargs):
+        super().__init__(schema=schema or async_schema, **kwargs)
+
+    def get_middleware(self, request):
+        return [*super().get_middleware(request), ORMThreadMiddleware()]
+
+    async def get(self, request, *args, **kwargs):
+        return await self.handle(request)
+
+    async def post(self, request, *args, **kwargs):
+        return await self.handle(request)
+
+    async def handle(self, request):
+        try:
+            data = self.parse_body(request)
+            if self.graphiql and self.can_display_graphiql(request, data):
+                return CRMGraphQLView.dispatch(self, request)
+
+            if self.batch:
+                responses = [await self.get_response(request, entry) for entry in data]
+                result = "[{}]".format(",".join(response[0] for response in responses))
+                status_code = max((r[1] for r in responses), default=200)
+            else:
+                result, status_code = await self.get_response(request, data)
+
+            return HttpResponse(
+                status=status_code, content=result, content_type="application/json"
+            )
+
+        except HttpError as e:
+            response = e.response
+            response["Content-Type"] = "application/json"
+            response.content = self.json_encode(
+                request, {"errors": [self.format_error(e)]}
+            )
+            return response
+
+    async def get_response(self, request, data, show_graphiql=False):
+        query, variables, operation_name, id = self.get_graphql_params(request, data)
+
+        user = await request.auser() if tracing.requested(request) else None
+        trace = tracing.start_trace(request, user)
+        try:
+            execution_result = self.execute_graphql_request(
+                request, data, query, variables, operation_name, show_graphiql
+            )
+            if isawaitable(execution_result):
+                execution_result = await execution_result
+            return self.encode_response(request, execution_result, id, show_graphiql)
+        finally:
+            tracing.finish_trace(trace)
+
+    async def execute_cached(
+        self, request, query, document, operation_ast, variables, operation_name, tags
+    ):
+        key = response_cache.make_key(
+            query_hash(query), operation_name, variables, tags
+        )
+        data = response_cache.get(key)
+        if data is not None:
+            return ExecutionResult(data=data, extensions={"responseCache": "HIT"})
+
+        result = await self.execute_operation(
+            request, document, operation_ast, variables, operation_name
+        )
+        if not result.errors:
+            response_cache.set(key, result.data)
+            result.extensions = {**(result.extensions or {}), "responseCache": "MISS"}
+        return result
+
+    async def execute_operation(
+        self, request, document, operation_ast, variables, operation_name
+    ):
+        try:
+            execute_options = self.get_execute_options(
+                request, variables, operation_name
+            )
+            schema = self.schema.graphql_schema
+            with routing.route_operation(operation_ast) as route, tracing.phase(
+                "execution"
+            ):
+                result = execute(schema, document, **execute_options)
+                if isawaitable(result):
+                    result = await result
+            if not route.replica_failed:
+                return result
+            # As in CRMGraphQLView.execute_operation.
+            reset_loaders(self.get_context(request))
+            with routing.use_primary(), tracing.phase("execution"):
+                result = execute(schema, document, **execute_options)
+                if isawaitable(result):
+                    result = await result
+            return result
+        except Exception as e:
+            return ExecutionResult(errors=[e])
+        finally:
+            if is_mutation(operation_ast):
+                reset_loaders(self.get_context(request))
+
+
+class ExportView(View):
+    """
+    Streams ``/export/<resource>.<format>`` (``customers``, ``products`` or
+    ``orders`` as ``csv`` or ``ndjson``), filtered by the resource's
+    filterset from the query string, e.g.
+    ``/export/orders.csv?order_date_gte=2025-01-01``.
+
+    Exports read from a replica unless the client was pinned to the
+    primary by a recent write.
+    """
+
+    http_method_names = ["get", "head"]
+
+    def get(self, request, resource, fmt):
+        spec = export.EXPORTS.get(resource)
+        if spec is None or fmt not in export.FORMATS:
+            raise Http404(f"No export for {resource}.{fmt}")
+        # Chosen now: the request's routing state is gone while streaming.
+        with routing.use_replica():
+            using = router.db_for_read(spec.model)
+        filterset = spec.filter(request.GET, using)
+        if not filterset.is_valid():
+            return JsonResponse({"errors": filterset.errors}, status=400)
+
+        chunks = export.stream(spec, filterset.qs, fmt)
+        if isinstance(request, ASGIRequest):
+            chunks = export.astream(chunks)
+        response = StreamingHttpResponse(chunks, content_type=export.FORMATS[fmt])
+        response["Content-Disposition"] = f'attachment; filename="{resource}.{fmt}"'
+        # Ask nginx-style proxies to pass chunks on instead of buffering them.
+        response["X-Accel-Buffering"] = "no"
+        return response
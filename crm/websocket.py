@@ -0,0 +1,244 @@
+"""
+CRM WebSocket
+Serves GraphQL over WebSocket with the ``graphql-transport-ws`` protocol,
+for the subscriptions of ``crm.subscriptions``; ``crm.asgi`` routes
+WebSocket connections to ``/graphql/`` here.
+
+Operations run on ``crm.async_schema`` with the document cache and the
+query cost limits of the HTTP views. Queries and mutations get a single
+``next`` message; subscriptions get one per event until either side sends
+``complete``. Every event is executed as a fresh request, so DataLoaders
+never serve rows cached by an earlier event. Each connection runs its ORM
+work on a thread of its own.
+"""
+
+import asyncio
+import json
+
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from django.db import connections
+from django.http import HttpRequest
+from graphene_django.settings import graphene_settings
+from graphql import (
+    ExecutionResult,
+    GraphQLError,
+    OperationType,
+    create_source_event_stream,
+    execute,
+    get_operation_ast,
+)
+
+from crm import cost, pubsub
+from crm.async_schema import ORMThreadMiddleware
+from crm.async_schema import schema as async_schema
+from crm.documents import document_cache
+
+PROTOCOL = "graphql-transport-ws"
+
+
+class ProtocolError(Exception):
+    def __init__(self, code, reason):
+        self.code = code
+        self.reason = reason
+        super().__init__(reason)
+
+
+class GraphQLWebSocketConnection:
+    def __init__(self, scope, receive, send, schema):
+        self.scope = scope
+        self.receive = receive
+        self.send = send
+        self.schema = schema
+        self.acknowledged = False
+        self.operations = {}
+        self.closed = asyncio.Event()
+
+    async def send_json(self, message):
+        await self.send({"type": "websocket.send", "text": json.dumps(message)})
+
+    async def run(self):
+        message = await self.receive()
+        if message["type"] != "websocket.connect":
+            return
+        if PROTOCOL not in self.scope.get("subprotocols", []):
+            # Closing before accepting rejects the handshake.
+            await self.send({"type": "websocket.close", "code": 4406})
+            return
+        await self.send({"type": "websocket.accept", "subprotocol": PROTOCOL})
+
+        timeout = pubsub.get_config()["CONNECTION_INIT_TIMEOUT"]
+        init_timer = asyncio.get_running_loop().call_later(timeout, self.init_timed_out)
+        receiver = asyncio.ensure_future(self.receive_messages())
+        try:
+            await self.closed.wait()
+        finally:
+            init_timer.cancel()
+            receiver.cancel()
+            for task in self.operations.values():
+                task.cancel()
+            await asyncio.gather(
+                receiver, *self.operations.values(), return_exceptions=True
+            )
+
+    def init_timed_out(self):
+        if not self.acknowledged:
+            asyncio.ensure_future(self.close(4408, "Connection initialisation timeout"))
+
+    async def close(self, code, reason):
+        if not self.closed.is_set():
+            self.closed.set()
+            await self.send({"type": "websocket.close", "code": code, "reason": reason})
+
+    async def receive_messages(self):
+        while True:
+            message = await self.receive()
+            if message["type"] == "websocket.disconnect":
+                self.closed.set()
+                return
+            try:
+                await self.handle(message.get("text") or message.get("bytes"))
+            except ProtocolError as e:
+                await self.close(e.code, e.reason)
+                return
+
+    async def handle(self, text):
+        try:
+            message = json.loads(text)
+            kind = message["type"]
+        except (TypeError, ValueError, KeyError):
+            raise ProtocolError(4400, "Invalid message")
+
+        if kind == "connection_init":
+            if self.acknowledged:
+                raise ProtocolError(4429, "Too many initialisation requests")
+            self.acknowledged = True
+            await self.send_json({"type": "connection_ack"})
+        elif kind == "ping":
+            await self.send_json({"type": "pong"})
+        elif kind == "pong":
+            pass
+        elif kind == "subscribe":
+            if not self.acknowledged:
+                raise ProtocolError(4401, "Unauthorized")
+            id = message.get("id")
+            payload = message.get("payload")
+            if not isinstance(id, str) or not isinstance(payload, dict):
+                raise ProtocolError(4400, "Invalid message")
+            if id in self.operations:
+                raise ProtocolError(4409, f"Subscriber for {id} already exists")
+            self.operations[id] = asyncio.ensure_future(self.run_operation(id, payload))
+        elif kind == "complete":
+            task = self.operations.pop(message.get("id"), None)
+            if task is not None:
+                task.cancel()
+        else:
+            raise ProtocolError(4400, f"Unexpected message type {kind}")
+
+    async def run_operation(self, id, payload):
+        try:
+            errors = await self.stream_results(id, payload)
+        except asyncio.CancelledError:
+            # Cancelled by the client's "complete" or a closed connection.
+            raise
+        except Exception as e:
+            errors = [GraphQLError(str(e))]
+        if errors:
+            await self.send_json(
+                {"id": id, "type": "error", "payload": [e.formatted for e in errors]}
+            )
+        else:
+            await self.send_json({"id": id, "type": "complete"})
+        self.operations.pop(id, None)
+
+    async def stream_results(self, id, payload):
+        """Send the operation's results; return request errors, if any."""
+        query = payload.get("query")
+        variables = payload.get("variables")
+        operation_name = payload.get("operationName")
+        if not isinstance(query, str):
+            return [GraphQLError("Must provide query string.")]
+
+        schema = self.schema.graphql_schema
+        document, errors = document_cache.get_document(
+            schema, query, None, graphene_settings.MAX_VALIDATION_ERRORS
+        )
+        if document is None or errors:
+            return errors
+        errors = check_cost(schema, document, operation_name, variables)
+        if errors:
+            return errors
+
+        operation = get_operation_ast(document, operation_name)
+        options = {
+            "variable_values": variables,
+            "operation_name": operation_name,
+            "middleware": [ORMThreadMiddleware()],
+        }
+        if operation is None or operation.operation != OperationType.SUBSCRIPTION:
+            result = await execute_async(
+                schema, document, context_value=HttpRequest(), **options
+            )
+            await self.send_next(id, result)
+            return None
+
+        stream = await create_source_event_stream(
+            schema,
+            document,
+            context_value=HttpRequest(),
+            variable_values=variables,
+            operation_name=operation_name,
+        )
+        if isinstance(stream, ExecutionResult):
+            return stream.errors
+        try:
+            async for event in stream:
+                result = await execute_async(
+                    schema,
+                    document,
+                    root_value=event,
+                    context_value=HttpRequest(),
+                    **options,
+                )
+                await self.send_next(id, result)
+        finally:
+            await stream.aclose()
+        return None
+
+    async def send_next(self, id, result):
+        await self.send_json({"id": id, "type": "next", "payload": result.formatted})
+
+
+async def execute_async(schema, document, **options):
+    result = execute(schema, document, **options)
+    if asyncio.iscoroutine(result):
+        result = await result
+    return result
+
+
+def check_cost(schema, document, operation_name, variables):
+    if not cost.get_config()["ENABLED"]:
+        return []
+    _, max_cost, max_depth = cost.client_budget(None)
+    return cost.analyze(schema, document, operation_name, variables).errors(
+        max_cost, max_depth
+    )
+
+
+class GraphQLWebSocketApp:
+    """ASGI application for WebSocket connections to the GraphQL endpoint."""
+
+    def __init__(self, schema=None):
+        self.schema = schema or async_schema
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "websocket":
+            raise ValueError(f"GraphQLWebSocketApp cannot serve {scope['type']}")
+        # The connection's sync_to_async calls share one thread, and so one
+        # database connection, closed when the socket closes.
+        async with ThreadSensitiveContext():
+            try:
+                await GraphQLWebSocketConnection(
+                    scope, receive, send, self.schema
+                ).run()
+            finally:
+                await sync_to_async(connections.close_all)()